@@ -0,0 +1,275 @@
+import argparse
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import requests
+
+from mock_wcps import MockWCPSServer, synthetic_payload
+from wdc import byte_to_array, byte_to_list, byte_to_ndarray, dbc, dco, np
+
+
+QUERY = 'for $c in (AvgLandTemp) return avg($c[Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")])'
+
+
+# per-query latency of a fresh requests.post (the old behavior of dbc.send_query) and of the pooled session
+def bench_pooled_session(n = 500, latency = 0.0):
+    with MockWCPSServer(b'12.5', latency = latency) as server:
+        fresh = []
+        for _ in range(n):
+            start = time.perf_counter()
+            requests.post(server.url, data = {'query': QUERY}, verify = False)
+            fresh.append(time.perf_counter() - start)
+
+        pooled = []
+        with dbc(server.url) as connection:
+            for _ in range(n):
+                start = time.perf_counter()
+                connection.send_query(QUERY)
+                pooled.append(time.perf_counter() - start)
+    return {'fresh requests.post': fresh, 'pooled dbc session': pooled}
+
+
+# time and peak memory of decoding a CSV payload to a list of floats and to numpy arrays
+def bench_decoding(sizes = (10**4, 10**6, 10**7)):
+    decoders = {'byte_to_list': byte_to_list,
+                'byte_to_array float64': lambda content: byte_to_array(content, 'float64'),
+                'byte_to_array float32': lambda content: byte_to_array(content, 'float32')}
+    results = {}
+    for size in sizes:
+        content = ','.join(f'{i * 0.37:.2f}' for i in range(size)).encode()
+        for name, decode in decoders.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            decode(content)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[(size, name)] = (elapsed, peak)
+    return results
+
+
+# time of parsing a 2-D grid with byte_to_ndarray, against splitting the rows and values in Python
+def bench_grid_decoding(rows = 1000, columns = 1000):
+    content = ','.join('{' + ','.join(f'{(r * columns + c) * 0.37:.2f}' for c in range(columns)) + '}'
+                       for r in range(rows)).encode()
+
+    def python_parse(content):
+        return [[float(value) for value in row.strip('{}').split(',')] for row in content.decode().split('},{')]
+
+    results = {}
+    for name, decode in (('rows split in Python', python_parse), ('byte_to_ndarray', byte_to_ndarray)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        decode(content)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[(rows * columns, name)] = (elapsed, peak)
+    return results
+
+
+# the variable name scan of dco.get_all_var_names() before the tokenizer, for comparison
+def legacy_get_all_var_names(string):
+    var_names = []
+    index = 0
+    while index < len(string):
+        start_index = string.find('$', index)
+        if start_index == -1:
+            break
+        delimiters = [' ', ',', '(', ')', '[', ']', '{', '}', ';', '>', '<', '+', '-', '=', '.',
+                     '/', '\\', '|', '!']
+        end_index = len(string)
+        for i, char in enumerate(string[start_index:]):
+            if char in delimiters:
+                end_index = start_index + i
+                break
+        var_names.append(string[start_index:end_index])
+        index = end_index
+    return var_names or None
+
+
+# an encode switch expression of about the given length
+def switch_expression(length):
+    case = 'case $c > {0} return {{red: {0}; green: 0; blue: 255}} '
+    parts = ['switch ']
+    i = 0
+    while sum(map(len, parts)) < length:
+        parts.append(case.format(i))
+        i += 1
+    parts.append('default return {red: 255; green: 0; blue: 0}')
+    return ''.join(parts)
+
+
+# time of scanning expressions for variable names, uncached and cached
+def bench_var_names(lengths = (100, 1000, 10000, 100000), repeat = 20):
+    datacube = dco(dbc('http://localhost/rasdaman/ows')).initialize_var('$c in (AvgLandTemp)')
+    results = {}
+    for length in lengths:
+        expression = switch_expression(length)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            legacy_get_all_var_names(expression)
+        results[(length, 'legacy scan')] = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for i in range(repeat):
+            # a different expression every time, so nothing is cached
+            datacube.get_all_var_names(expression + ' ' * (i + 1))
+        results[(length, 'tokenizer, uncached')] = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            datacube.do_vars_exist(expression)
+        results[(length, 'do_vars_exist, cached')] = (time.perf_counter() - start) / repeat
+    return results
+
+
+# time of substituting the subsets of many variables into a long expression
+def bench_substitution(variables = 50, length = 100000, repeat = 20):
+    datacube = dco(dbc('http://localhost/rasdaman/ows'))
+    for i in range(variables):
+        datacube.initialize_var(f'$v{i} in (Coverage{i})')
+        datacube.subset(var_name = f'$v{i}', subset = f'ansi("2014-{i % 12 + 1:02}")')
+    expression = ' + '.join(f'$v{i % variables}' for i in range(length // 6))
+
+    def legacy_replace(expression):
+        for var, subset in zip(datacube.var_names, datacube.Subsets):
+            expression = expression.replace(var, f'{var}[{subset}]')
+        return expression
+
+    results = {}
+    for name, substitute in (('str.replace per variable', legacy_replace),
+                             ('single token pass', datacube.replace_variables_with_subsets)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            substitute(expression)
+        results[(len(expression), name)] = (time.perf_counter() - start) / repeat
+    return results
+
+
+# time of building a query for every request against binding a prepared template
+def bench_prepared(repeat = 20000):
+    connection = dbc('http://localhost/rasdaman/ows')
+
+    def build(lat, t0, t1):
+        datacube = dco(connection).initialize_var('$c in (AvgLandTemp)')
+        datacube.subset(var_name = '$c', subset = f'Lat({lat}), Long(8.80), ansi("{t0}":"{t1}")').where('$c > 0').avg()
+        return datacube.to_wcps_query()
+
+    template = dco(connection).initialize_var('$c in (AvgLandTemp)')
+    template = template.subset(var_name = '$c', subset = 'Lat(@lat), Long(8.80), ansi("@t0":"@t1")')
+    template = template.where('$c > 0').avg().prepare()
+    results = {}
+    for name, make in (('dco built per request', build), ('prepared template bind', template.bind)):
+        start = time.perf_counter()
+        for i in range(repeat):
+            make(lat = i % 90, t0 = '2014-01', t1 = '2014-12')
+        results[(repeat, name)] = (time.perf_counter() - start) / repeat
+    return results
+
+
+# throughput, latency percentiles and memory peak of dco.execute() against the stand-in server,
+# for every format, payload size and number of concurrent queries
+def bench_execute(formats = ('CSV', 'GTiff', 'PNG', 'JPEG'), sizes = (10**3, 10**5, 10**6), concurrency = (1, 4, 16),
+                  queries = 200, latency = 0.005, error_rate = 0.0):
+    results = []
+    for size in sizes:
+        with MockWCPSServer(synthetic_payload(size), latency = latency, error_rate = error_rate, seed = 0) as server:
+            connection = dbc(server.url, pool_maxsize = max(concurrency), backoff = 0.01)
+            for output_format in formats:
+                datacube = dco(connection).initialize_var('$c in (AvgLandTemp)').set_format(output_format).freeze()
+                payload_bytes = len(connection.send_query(datacube.to_wcps_query()).content)
+                for workers in concurrency:
+                    batch = connection.execute_many([datacube] * queries, max_workers = workers)
+                    # a shorter second run measures the memory, tracemalloc slows everything down
+                    tracemalloc.start()
+                    connection.execute_many([datacube] * workers, max_workers = workers)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results.append({'format': output_format, 'size': size, 'payload_bytes': payload_bytes,
+                                    'concurrency': workers, 'queries': queries, 'errors': len(batch.errors),
+                                    'qps': batch.qps, 'p50': batch.p50, 'p99': batch.p99, 'peak_bytes': peak})
+            connection.close()
+    return results
+
+
+def report_execute(results):
+    print('dco.execute, local stand-in server')
+    for row in results:
+        print(f"  {row['format']:<5} {row['size']:>8} ({row['payload_bytes'] / 1024:9.1f} KiB) x{row['concurrency']:<3}"
+              f"  {row['qps']:8.1f} q/s  p50 {row['p50'] * 1e3:8.2f} ms  p99 {row['p99'] * 1e3:8.2f} ms"
+              f"  peak {row['peak_bytes'] / 2**20:7.1f} MiB  errors {row['errors']}")
+
+
+# the results of all the benchmarks as lists of flat records, which can be stored and compared between releases
+def collect(quick = False, latency = 0.005, error_rate = 0.0):
+    scale = 10 if quick else 1
+
+    def timings(results):
+        return [{'name': name, 'p50': statistics.median(values), 'p99': sorted(values)[int(len(values) * 0.99) - 1]}
+                for name, values in results.items()]
+
+    def sized(results, keys):
+        return [dict(zip(keys, (*key, *(value if isinstance(value, tuple) else (value,)))))
+                for key, value in results.items()]
+
+    sizes = (10**3, 10**5) if quick else (10**3, 10**5, 10**6)
+    return {
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__ if np != None else None,
+                        'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                        'latency': latency, 'error_rate': error_rate},
+        'send_query': timings(bench_pooled_session(n = 500 // scale, latency = latency)),
+        'execute': bench_execute(sizes = sizes, queries = 200 // scale, latency = latency, error_rate = error_rate),
+        'csv_decoding': sized(bench_decoding(sizes[:2] if quick else (10**4, 10**6, 10**7)),
+                              ('size', 'name', 'seconds', 'peak_bytes')),
+        'grid_decoding': sized(bench_grid_decoding(rows = 1000 // scale), ('size', 'name', 'seconds', 'peak_bytes')),
+        'var_names': sized(bench_var_names(), ('length', 'name', 'seconds')),
+        'substitution': sized(bench_substitution(), ('length', 'name', 'seconds')),
+        'prepared': sized(bench_prepared(repeat = 20000 // scale), ('repeat', 'name', 'seconds')),
+    }
+
+
+def report_seconds(title, results):
+    print(title)
+    for (length, name), elapsed in results.items():
+        print(f'  {length:>7}  {name:<26} {elapsed * 1e6:12.1f} us')
+
+
+def report_decoding(title, results):
+    print(title)
+    for (size, name), (elapsed, peak) in results.items():
+        print(f'  {size:>9} values  {name:<22} {elapsed * 1e3:10.1f} ms   peak {peak / 2**20:8.1f} MiB')
+
+
+def report(title, timings):
+    print(title)
+    for name, values in timings.items():
+        values = sorted(values)
+        p50 = statistics.median(values) * 1e3
+        p99 = values[int(len(values) * 0.99) - 1] * 1e3
+        print(f'  {name:<24} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks of wdc against a local WCPS stand-in server.')
+    parser.add_argument('--json', metavar = 'PATH', help = 'write the results to a JSON file instead of printing them')
+    parser.add_argument('--quick', action = 'store_true', help = 'smaller payloads and fewer repetitions')
+    parser.add_argument('--latency', type = float, default = 0.005, metavar = 'SECONDS',
+                        help = 'the time the stand-in server takes for every query (default: 0.005)')
+    parser.add_argument('--error-rate', type = float, default = 0.0, metavar = 'FRACTION',
+                        help = 'the share of queries the stand-in server fails with 503 (default: 0)')
+    arguments = parser.parse_args()
+    if not 0 <= arguments.error_rate < 1:
+        parser.error('--error-rate must be at least 0 and below 1')
+    if arguments.json:
+        with open(arguments.json, 'w') as file:
+            json.dump(collect(arguments.quick, arguments.latency, arguments.error_rate), file, indent = 2)
+    else:
+        report('send_query latency, local stand-in server', bench_pooled_session(latency = arguments.latency))
+        report_execute(bench_execute(latency = arguments.latency, error_rate = arguments.error_rate))
+        report_decoding('CSV decoding', bench_decoding())
+        report_decoding('CSV grid decoding', bench_grid_decoding())
+        report_seconds('variable name scan', bench_var_names())
+        report_seconds('subset substitution', bench_substitution())
+        report_seconds('query building per request', bench_prepared())
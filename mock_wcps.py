@@ -0,0 +1,224 @@
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+# a CSV payload of size comma-separated values
+def synthetic_csv(size):
+    return ','.join(f'{i * 0.37 % 50:.2f}' for i in range(size)).encode()
+
+
+# a grayscale PNG image of width x height pixels with a gradient, written with zlib only
+def synthetic_png(width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    # every row starts with filter type 0
+    rows = b''.join(b'\0' + bytes((x + y) % 256 for x in range(width)) for y in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+# a uniform gray baseline JPEG image of width x height pixels, every 8x8 block only has a zero DC difference
+def synthetic_jpeg(width, height):
+    def segment(marker, data):
+        return b'\xff' + marker + struct.pack('>H', len(data) + 2) + data
+
+    blocks = math.ceil(width / 8) * math.ceil(height / 8)
+    # the one-bit code '0' of the DC category 0 and of the end of block, two bits per block, padded with ones
+    bits = '00' * blocks
+    bits += '1' * (-len(bits) % 8)
+    scan = bytes(int(bits[i:i + 8], 2) for i in range(0, len(bits), 8))
+    one_code = bytes([1] + [0] * 15) + b'\0'
+    return (b'\xff\xd8' + segment(b'\xe0', b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0')
+            + segment(b'\xdb', b'\0' + b'\x01' * 64)
+            + segment(b'\xc0', struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\0')
+            + segment(b'\xc4', b'\x00' + one_code) + segment(b'\xc4', b'\x10' + one_code)
+            + segment(b'\xda', b'\x01\x01\0\0\x3f\0') + scan + b'\xff\xd9')
+
+
+# a single-band float32 GeoTIFF image of width x height pixels, uncompressed in one strip
+def synthetic_tiff(width, height):
+    pixels = struct.pack(f'<{width * height}f', *(float(i % 50) for i in range(width * height)))
+    # width, height, bits per sample, compression, photometric, strip offset, samples per pixel,
+    # rows per strip, strip byte count and sample format
+    entries = [(256, 4, width), (257, 4, height), (258, 3, 32), (259, 3, 1), (262, 3, 1), (273, 4, 0),
+               (277, 3, 1), (278, 4, height), (279, 4, len(pixels)), (339, 3, 3)]
+    offset = 8 + 2 + 12 * len(entries) + 4
+    ifd = struct.pack('<H', len(entries)) + b''.join(
+        struct.pack('<HHI', tag, kind, 1) + (struct.pack('<HH', value, 0) if kind == 3 else
+                                             struct.pack('<I', offset if tag == 273 else value))
+        for tag, kind, value in entries) + struct.pack('<I', 0)
+    return b'II' + struct.pack('<HI', 42, 8) + ifd + pixels
+
+
+# a classic netCDF file with a float32 variable 'Gray' of height x width values on the dimensions lat and lon
+def synthetic_netcdf(width, height):
+    def name(text):
+        data = text.encode()
+        return struct.pack('>i', len(data)) + data + b'\0' * (-len(data) % 4)
+
+    values = struct.pack(f'>{width * height}f', *(float(i % 50) for i in range(width * height)))
+    header = (b'CDF\x01' + struct.pack('>i', 0) + struct.pack('>ii', 10, 2)
+              + name('lat') + struct.pack('>i', height) + name('lon') + struct.pack('>i', width)
+              + struct.pack('>ii', 0, 0) + struct.pack('>ii', 11, 1) + name('Gray') + struct.pack('>iii', 2, 0, 1)
+              + struct.pack('>ii', 0, 0) + struct.pack('>ii', 5, len(values)))
+    # the offset of the values is the last field of the header
+    return header + struct.pack('>i', len(header) + 4) + values
+
+
+# payload function of a server which answers with a synthetic result of the format asked for in the query
+def synthetic_payload(size):
+    """
+    Makes a payload function for MockWCPSServer which answers every query with a synthetic result
+        of the requested format: size values for CSV, a square grid of about size pixels for PNG, JPEG,
+        GTiff and netCDF.
+        Every payload is built once and reused.
+
+    Parameters:
+        size (int): The number of values or pixels of the results.
+
+    Example:
+        >>> with MockWCPSServer(synthetic_payload(10**6)) as server:
+        ...     dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('PNG').execute()
+    """
+    side = max(1, math.isqrt(size))
+    makers = {'image/png': lambda: synthetic_png(side, side), 'image/jpeg': lambda: synthetic_jpeg(side, side),
+              'image/tiff': lambda: synthetic_tiff(side, side),
+              'application/netcdf': lambda: synthetic_netcdf(side, side), 'text/csv': lambda: synthetic_csv(size)}
+    built = {}
+    lock = threading.Lock()
+
+    def payload(query):
+        output_format = next((name for name in makers if name in query), 'text/csv')
+        with lock:
+            if output_format not in built:
+                built[output_format] = makers[output_format]()
+            return built[output_format]
+
+    return payload
+
+
+# request handler of the stand-in server, it answers every WCPS query with the configured payload
+class _MockWCPSHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 is needed, otherwise every response closes the connection and keep-alive can't be measured
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, with Nagle's algorithm a kept-alive connection stalls on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        query = parse_qs(body.decode('utf-8')).get('query', [''])[0]
+        mock = self.server.mock
+        fault = mock.record(query, self.client_address)
+        if fault == 'drop':
+            # the connection is closed without an answer
+            self.close_connection = True
+            return
+        if isinstance(fault, float):
+            time.sleep(fault)
+        if mock.latency > 0:
+            time.sleep(mock.latency)
+        if isinstance(fault, int):
+            payload = (fault, b'<ows:ExceptionReport><ows:Exception><ows:ExceptionText>Injected fault'
+                              b'</ows:ExceptionText></ows:Exception></ows:ExceptionReport>')
+        else:
+            payload = mock.payload(query) if callable(mock.payload) else mock.payload
+        status = 200
+        if isinstance(payload, tuple):
+            status, payload = payload
+        self.send_response(status)
+        self.send_header('Content-Type', mock.content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # GetCapabilities requests, which clients use as a health check
+    def do_GET(self):
+        payload = b'<wcs:Capabilities/>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # the default implementation writes every request to stderr
+    def log_message(self, format, *args):
+        pass
+
+
+# local WCPS stand-in server used by the tests and the benchmarks
+class MockWCPSServer:
+    def __init__(self, payload = b'1', latency = 0.0, content_type = 'text/plain', faults = (), error_rate = 0.0,
+                 seed = None):
+        """
+        Initializes a local HTTP server that imitates a WCPS endpoint. The server runs in a background
+            thread and answers every query with the same payload, so the tests and benchmarks don't
+            depend on a remote server being reachable.
+
+        Parameters:
+            payload (bytes or callable): The body of every response, or a function which gets the
+                WCPS query string and returns the body or a (status code, body) tuple.
+            latency (float, optional): Seconds the server waits before answering a query.
+            content_type (str, optional): The value of the Content-Type header of the responses.
+            faults (list, optional): Faults injected into the first queries, one per query: an HTTP status code
+                answers with an error, a float delays the answer by that many seconds, 'drop' closes the
+                connection without an answer and None answers normally.
+            error_rate (float, optional): The share of the other queries answered with the status 503.
+            seed (int, optional): The seed of the random errors, so a run can be repeated.
+
+        Example:
+            >>> with MockWCPSServer(b'1,2,3') as server:
+            ...     dbc(server.url).send_query('for $c in (AvgLandTemp) return 1')
+        """
+        self.payload = payload
+        self.latency = latency
+        self.content_type = content_type
+        self.queries = []
+        self.clients = set()
+        self.faults = list(faults)
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _MockWCPSHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/rasdaman/ows'
+
+    # every (host, port) pair of a client is one TCP connection, so it shows how many connections were opened
+    def record(self, query, client_address):
+        with self._lock:
+            self.queries.append(query)
+            self.clients.add(client_address)
+            # the fault injected into this query, if there is one left
+            if self.faults:
+                return self.faults.pop(0)
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                return 503
+            return None
+
+    def start(self):
+        self._thread = threading.Thread(target = self._httpd.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
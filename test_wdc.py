@@ -1,8 +1,33 @@
-from wdc import dco, dbc
+from wdc import dco, dbc, DbcPool, AsyncDbc, FrozenDco, ResultCache, ResultStore, SeriesStore, LazyCoverage, \
+    CircuitBreaker, CircuitOpenError, QueryScheduler, QueryMetrics, WCPSQueryError, WCPSServerError, \
+    WCPSConnectionError, WCPSTimeoutError, normalize_query, byte_to_array, byte_to_ndarray, decode_image, \
+    decode_images, read_tiff, read_netcdf, iter_csv_values, split_subset, tile_interval
+import io
+import math
+import json
+from mock_wcps import MockWCPSServer, synthetic_payload, synthetic_png, synthetic_jpeg, synthetic_tiff, synthetic_netcdf
+import asyncio
+import re
+import threading
+import time
 import pytest
+import requests
 import warnings
 warnings.filterwarnings("ignore")
 
+# the array results need numpy, their tests are skipped without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+requires_numpy = pytest.mark.skipif(np == None, reason = "numpy isn't installed")
+# the image results are decoded with Pillow
+try:
+    import PIL
+except ImportError:
+    PIL = None
+requires_pillow = pytest.mark.skipif(np == None or PIL == None, reason = "numpy or Pillow isn't installed")
+
 # this tests initialization of dbc() instance
 class Test_init_dbc():
     # initialize dbc() instance correctly by passing a string
@@ -35,6 +60,31 @@ class Test_send_query():
         with pytest.raises(TypeError):
             my_dbc.send_query(1)
 
+# this tests the pooled session of dbc() against a local stand-in server
+class Test_session_pool():
+    # consecutive queries must reuse one connection instead of opening a new one each time
+    def test_connection_reused(self):
+        with MockWCPSServer(b'1') as server:
+            with dbc(server.url) as my_dbc:
+                for _ in range(5):
+                    assert my_dbc.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert len(server.queries) == 5 and len(server.clients) == 1
+
+    # with keep_alive turned off every query opens its own connection
+    def test_no_keep_alive(self):
+        with MockWCPSServer(b'1') as server:
+            with dbc(server.url, keep_alive = False) as my_dbc:
+                for _ in range(3):
+                    my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+            assert len(server.clients) == 3
+
+    # pool sizes must be positive integers
+    def test_wrong_pool_size(self):
+        with pytest.raises(TypeError):
+            dbc("https://ows.rasdaman.org/rasdaman/ows", pool_maxsize = '10')
+        with pytest.raises(ValueError):
+            dbc("https://ows.rasdaman.org/rasdaman/ows", pool_maxsize = 0)
+
 # this tests initialization of dco() instance
 class Test_init_dco():
     # init by not passing a dbc() instance
@@ -375,3 +425,1353 @@ class Test_to_wcps_query():
         my_dco.transform_data('$c + 200')
         my_dco.encode(200 + 100)
         assert my_dco.to_wcps_query() == 'for $c in (AvgLandTemp)\nreturn \n300'
+
+# a payload which records the largest number of queries answered at the same time
+class ConcurrencyProbe():
+    def __init__(self, delay = 0.05):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, query):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        return b'1'
+
+# this tests the asynchronous execution of queries
+class Test_async():
+    # execute_async() returns the same data as execute()
+    def test_execute_async(self):
+        with MockWCPSServer(b'1.5,2.5') as server:
+            async def run():
+                async with AsyncDbc(server.url) as connection:
+                    my_dco = dco(connection).initialize_var("$c in (AvgLandTemp)").set_format('CSV')
+                    return await my_dco.execute_async()
+            assert asyncio.run(run()) == [1.5, 2.5]
+
+    # execute_async() also works with a plain dbc
+    def test_execute_async_plain_dbc(self):
+        with MockWCPSServer(b'3') as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)")
+            assert asyncio.run(my_dco.execute_async()) == [3.0]
+
+    # the queries are sent concurrently, but not more than max_concurrency at once
+    def test_concurrency_limit(self):
+        probe = ConcurrencyProbe()
+        with MockWCPSServer(probe) as server:
+            async def run():
+                async with AsyncDbc(server.url, max_concurrency = 4) as connection:
+                    queries = [connection.send_query(f'for $c in (AvgLandTemp) return {i}') for i in range(8)]
+                    await asyncio.gather(*queries)
+            asyncio.run(run())
+            assert len(server.queries) == 8 and 1 < probe.peak <= 4
+
+    # a plain dbc runs the queries of execute_async() on no more threads than it keeps connections open
+    def test_plain_dbc_limit(self):
+        probe = ConcurrencyProbe()
+        with MockWCPSServer(probe) as server:
+            my_dbc = dbc(server.url, pool_maxsize = 2)
+            async def run():
+                queries = [dco(my_dbc).initialize_var("$c in (AvgLandTemp)").encode(str(i)) for i in range(6)]
+                return await asyncio.gather(*(query.execute_async() for query in queries))
+            assert asyncio.run(run()) == [[1.0]] * 6
+            assert len(server.queries) == 6 and probe.peak <= 2
+            my_dbc.close()
+
+    # leaving the context waits for the queries in flight without blocking the event loop
+    def test_close_without_blocking(self):
+        with MockWCPSServer(b'1', latency = 0.3) as server:
+            async def run():
+                ticks = []
+                connection = AsyncDbc(server.url)
+                pending = asyncio.ensure_future(connection.send_query('for $c in (AvgLandTemp) return 1'))
+                await asyncio.sleep(0)
+
+                async def tick():
+                    while not pending.done():
+                        ticks.append(1)
+                        await asyncio.sleep(0.01)
+                ticker = asyncio.ensure_future(tick())
+                await connection.__aexit__(None, None, None)
+                closing_ticks = len(ticks)
+                await pending
+                await ticker
+                return closing_ticks
+            assert asyncio.run(run()) >= 2
+
+    # the synchronous execute() can't be used with an AsyncDbc
+    def test_execute_with_async_dbc(self):
+        connection = AsyncDbc("https://ows.rasdaman.org/rasdaman/ows")
+        my_dco = dco(connection).initialize_var("$c in (AvgLandTemp)")
+        with pytest.raises(TypeError):
+            my_dco.execute()
+        connection.close()
+
+    # the concurrency limit must be a positive integer
+    def test_wrong_concurrency(self):
+        with pytest.raises(ValueError):
+            AsyncDbc("https://ows.rasdaman.org/rasdaman/ows", max_concurrency = 0)
+
+# answers a query 'return N' or 'return encode(N, ...)' with N, and with an error for negative N
+def echo_payload(query):
+    value = re.search(r'return\s*(?:encode\()?(-?\d+)', query).group(1)
+    if value.startswith('-'):
+        return 400, b'Query failed'
+    return value.encode()
+
+# this tests the batch execution of queries
+class Test_execute_many():
+    # the results come back in the order of the queries
+    def test_results_in_order(self):
+        with MockWCPSServer(echo_payload, latency = 0.01) as server:
+            with dbc(server.url) as my_dbc:
+                queries = [dco(my_dbc).initialize_var("$c in (AvgLandTemp)").encode(str(i)) for i in range(30)]
+                results = my_dbc.execute_many(queries, max_workers = 8)
+            assert results == [[float(i)] for i in range(30)]
+            assert results.errors == {} and len(results.latencies) == 30
+
+    # a failing query doesn't fail the whole batch
+    def test_errors_per_query(self):
+        with MockWCPSServer(echo_payload) as server:
+            with dbc(server.url) as my_dbc:
+                results = my_dbc.execute_many(['for $c in (AvgLandTemp) return 1',
+                                               'for $c in (AvgLandTemp) return -1',
+                                               'for $c in (AvgLandTemp) return 2'])
+            assert results[0].content == b'1' and results[1] == None and results[2].content == b'2'
+            assert list(results.errors) == [1]
+
+    # the same dco can be used several times in a batch and stays unchanged
+    def test_shared_dco(self):
+        with MockWCPSServer(b'5') as server:
+            with dbc(server.url) as my_dbc:
+                my_dco = dco(my_dbc).initialize_var("$c in (AvgLandTemp)").avg()
+                results = my_dbc.execute_many([my_dco] * 10, max_workers = 4)
+            assert results == [[5.0]] * 10 and my_dco.aggregation == 'AVG'
+
+    # the summary contains the throughput figures
+    def test_summary(self, capsys):
+        with MockWCPSServer(b'1') as server:
+            with dbc(server.url) as my_dbc:
+                results = my_dbc.execute_many(['for $c in (AvgLandTemp) return 1'] * 5, verbose = True)
+        assert 'queries/s' in capsys.readouterr().out
+        assert results.qps > 0 and results.p50 <= results.p99
+
+    # queries must be dco instances or strings
+    def test_wrong_query_type(self):
+        my_dbc = dbc("https://ows.rasdaman.org/rasdaman/ows")
+        with pytest.raises(TypeError):
+            my_dbc.execute_many([1])
+
+# this tests the immutable query builder
+class Test_frozen_dco():
+    # builder methods return new instances and leave the template unchanged
+    def test_template_unchanged(self):
+        base = create_good_dco().freeze()
+        variant = base.subset(var_name = '$c', subset = 'ansi("2014-07")').set_format('PNG')
+        assert isinstance(variant, FrozenDco) and variant is not base
+        assert base.Subsets == (None,) and base.format == None
+        assert variant.to_wcps_query() == 'for $c in (AvgLandTemp)\nreturn \nencode($c[ansi("2014-07")] , "image/png")'
+
+    # derived queries share the unchanged parts with the template
+    def test_structure_shared(self):
+        base = create_good_dco().freeze()
+        assert base.avg('$c > 12').vars is base.vars
+
+    # a FrozenDco can't be modified directly
+    def test_setattr(self):
+        base = FrozenDco(dbc("https://ows.rasdaman.org/rasdaman/ows"))
+        with pytest.raises(AttributeError):
+            base.format = 'PNG'
+
+    # the validation of the builder methods still applies
+    def test_validation(self):
+        base = create_good_dco().freeze()
+        with pytest.raises(ValueError):
+            base.where('$t > 10')
+        with pytest.raises(ValueError):
+            base.subset(var_name = '$t', subset = 'ansi("2014-07")')
+
+    # execute() doesn't reset the template, so it can be executed again
+    def test_execute_keeps_template(self):
+        with MockWCPSServer(b'7') as server:
+            template = FrozenDco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)").avg()
+            assert template.execute() == [7.0] and template.execute() == [7.0]
+            assert template.aggregation == 'AVG'
+
+    # one template can be used by many threads at once
+    def test_concurrent_variants(self):
+        with MockWCPSServer(echo_payload) as server:
+            with dbc(server.url) as my_dbc:
+                template = FrozenDco(my_dbc).initialize_var("$c in (AvgLandTemp)")
+                results = my_dbc.execute_many([template.encode(str(i)) for i in range(20)], max_workers = 8)
+            assert results == [[float(i)] for i in range(20)]
+
+    # thaw() returns a mutable copy
+    def test_thaw(self):
+        base = create_good_dco().freeze()
+        thawed = base.thaw()
+        thawed.subset(var_name = '$c', subset = 'ansi("2014-07")')
+        assert type(thawed) == dco and thawed.Subsets == ['ansi("2014-07")'] and base.Subsets == (None,)
+
+# this tests the cache of decoded results
+class Test_result_cache():
+    # the second identical query is answered from the cache
+    def test_hit(self):
+        with MockWCPSServer(b'1.5,2.5') as server:
+            cache = ResultCache()
+            my_dbc = dbc(server.url, cache = cache)
+            for _ in range(3):
+                assert dco(my_dbc).initialize_var("$c in (AvgLandTemp)").set_format('CSV').execute() == [1.5, 2.5]
+            assert len(server.queries) == 1
+            assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+    # queries which differ only in whitespace have the same key, other endpoints and formats don't
+    def test_key(self):
+        key = ResultCache.make_key('http://a', 'for $c in (AvgLandTemp)\nreturn  1', 'CSV')
+        assert key == ResultCache.make_key('http://a', 'for $c in (AvgLandTemp) return 1', 'CSV')
+        assert key != ResultCache.make_key('http://b', 'for $c in (AvgLandTemp) return 1', 'CSV')
+        assert key != ResultCache.make_key('http://a', 'for $c in (AvgLandTemp) return 1', 'PNG')
+        assert key != ResultCache.make_key('http://a', 'for $c in (AvgLandTemp) return "a  b"', 'CSV')
+
+    # changing a returned result doesn't change the cached one
+    def test_copy(self):
+        cache = ResultCache()
+        cache.store('key', [1.0, 2.0])
+        cache.lookup('key')[1].append(3.0)
+        assert cache.lookup('key') == (True, [1.0, 2.0])
+
+    # the least recently used results are evicted when the cache grows over max_bytes
+    def test_lru_eviction(self):
+        cache = ResultCache(max_bytes = 250)
+        cache.store('a', b'a' * 100)
+        cache.store('b', b'b' * 100)
+        cache.lookup('a')
+        cache.store('c', b'c' * 100)
+        assert cache.lookup('b') == (False, None) and cache.lookup('a')[0] and cache.lookup('c')[0]
+        assert cache.stats()['evictions'] == 1 and cache.stats()['bytes'] == 200
+
+    # expired results are not returned
+    def test_ttl(self):
+        cache = ResultCache(ttl = 0.05)
+        cache.store('a', b'a')
+        cache.store('b', b'b', ttl = 10)
+        time.sleep(0.1)
+        assert cache.lookup('a') == (False, None) and cache.lookup('b') == (True, b'b')
+        assert cache.stats()['expirations'] == 1
+
+    # the on-disk tier keeps the results for another cache using the same directory
+    def test_disk(self, tmp_path):
+        ResultCache(directory = str(tmp_path)).store('a', [1.0])
+        cache = ResultCache(directory = str(tmp_path))
+        assert cache.lookup('a') == (True, [1.0]) and cache.stats()['disk_hits'] == 1
+        cache.clear()
+        assert ResultCache(directory = str(tmp_path)).lookup('a') == (False, None)
+
+    # arrays, the arrays of netCDF results, records and raw bytes are written without pickle
+    @requires_numpy
+    def test_disk_types(self, tmp_path):
+        results = {'bytes': b'\x89PNG', 'array': np.arange(6, dtype = '>f4').reshape(2, 3),
+                   'arrays': {'Gray': np.ones((2, 2), dtype = 'u1'), 'name': np.array([b'a'], dtype = 'S1')},
+                   'record': {'min': 1.0, 'max': float('nan')}}
+        for key, data in results.items():
+            ResultCache(directory = str(tmp_path)).store(key, data)
+        cache = ResultCache(directory = str(tmp_path))
+        assert cache.lookup('bytes') == (True, b'\x89PNG')
+        array = cache.lookup('array')[1]
+        assert array.dtype == np.dtype('>f4') and array.tolist() == [[0, 1, 2], [3, 4, 5]]
+        arrays = cache.lookup('arrays')[1]
+        assert arrays['Gray'].tolist() == [[1, 1], [1, 1]] and arrays['name'].tolist() == [b'a']
+        record = cache.lookup('record')[1]
+        assert record['min'] == 1.0 and math.isnan(record['max'])
+        assert cache.stats()['disk_hits'] == 4
+
+    # an entry which can't be read is a miss and is removed, a pickled one is never unpickled
+    def test_disk_corrupt(self, tmp_path):
+        cache = ResultCache(directory = str(tmp_path))
+        cache.store('a', [1.0, 2.0])
+        entry = tmp_path / 'a.wdc'
+        entry.write_bytes(entry.read_bytes()[:-3])
+        assert ResultCache(directory = str(tmp_path)).lookup('a') == (False, None) and not entry.exists()
+        entry.write_bytes(b'\x80\x04\x95\x00\x00\x00')
+        assert ResultCache(directory = str(tmp_path)).lookup('a') == (False, None) and not entry.exists()
+
+    # the arrays of a cached netCDF result can't be changed through a returned result
+    @requires_numpy
+    def test_copy_arrays(self):
+        cache = ResultCache()
+        cache.store('key', {'Gray': np.zeros(3)})
+        cache.lookup('key')[1]['Gray'][0] = 1
+        assert cache.lookup('key')[1]['Gray'].tolist() == [0, 0, 0]
+
+# this tests decoding of the results to numpy arrays
+@requires_numpy
+class Test_byte_to_array():
+    # the numbers are parsed into a contiguous array of the requested type
+    def test_dtype(self):
+        array = byte_to_array(b'1.5,2.5,-3e2', dtype = 'float32')
+        assert array.dtype == np.float32 and array.flags['C_CONTIGUOUS']
+        assert array.tolist() == [1.5, 2.5, -300.0]
+
+    # the result is the same as the one of byte_to_list()
+    def test_same_as_list(self):
+        content = b','.join(str(i / 7).encode() for i in range(1000))
+        assert byte_to_array(content).tolist() == dco.decode_response(create_good_dco(), content)
+
+    # a value which isn't a number raises ValueError instead of being silently dropped
+    def test_not_number(self):
+        with pytest.raises(ValueError):
+            byte_to_array(b'1,2,abc')
+
+    # execute() returns an array after as_array()
+    def test_execute(self):
+        with MockWCPSServer(b'1,2,3') as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)").set_format('CSV').as_array()
+            array = my_dco.execute()
+        assert array.dtype == np.float64 and array.tolist() == [1.0, 2.0, 3.0]
+        assert my_dco.array_dtype == None
+
+    # only float64 and float32 are supported
+    def test_wrong_dtype(self):
+        with pytest.raises(ValueError):
+            create_good_dco().as_array('int8')
+
+# this tests the shape-preserving parser of the CSV output
+@requires_numpy
+class Test_byte_to_ndarray():
+    # a flat list of values stays one-dimensional
+    def test_flat(self):
+        assert byte_to_ndarray(b'1,2,3').shape == (3,)
+
+    # a 2-D grid of {} blocks
+    def test_grid(self):
+        array = byte_to_ndarray(b'{1,2,3},{4,5,6}', dtype = 'float32')
+        assert array.shape == (2, 3) and array.dtype == np.float32 and array[1, 0] == 4
+
+    # a 3-D grid with the blocks separated by ';'
+    def test_cube(self):
+        array = byte_to_ndarray(b'{{1,2},{3,4}};{{5,6},{7,8}};{{9,10},{11,12}}')
+        assert array.shape == (3, 2, 2) and array[2, 1, 0] == 11
+
+    # multi-band cells become the last axis
+    def test_bands_axis(self):
+        array = byte_to_ndarray(b'{"1 2 3","4 5 6"},{"7 8 9","10 11 12"}')
+        assert array.shape == (2, 2, 3) and array[1, 0].tolist() == [7, 8, 9]
+
+    # multi-band cells become the fields of a structured array
+    def test_bands_struct(self):
+        array = byte_to_ndarray(b'{"1 2","3 4"}', band_names = ['red', 'green'])
+        assert array.shape == (1, 2) and array['green'].tolist() == [[2, 4]]
+
+    # blocks of different sizes are rejected
+    def test_ragged(self):
+        with pytest.raises(ValueError):
+            byte_to_ndarray(b'{1,2},{3,4,5},{6}')
+        with pytest.raises(ValueError):
+            byte_to_ndarray(b'{1,2},{3,4')
+
+    # execute() with as_array() keeps the shape of the grid
+    def test_execute(self):
+        with MockWCPSServer(b'{1,2},{3,4}') as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)").set_format('CSV').as_array()
+            assert my_dco.execute().shape == (2, 2)
+
+# this tests the streaming execution
+class Test_streaming():
+    # values cut by a chunk boundary are put together again
+    def test_chunk_boundaries(self):
+        content = b'{1.25,22,-3},{4e1,5,6.5}'
+        for size in (1, 2, 3, 7):
+            chunks = [content[i:i + size] for i in range(0, len(content), size)]
+            assert [value for block in iter_csv_values(chunks) for value in block] == [1.25, 22, -3, 40, 5, 6.5]
+
+    # iter_execute() yields the same values as execute()
+    def test_iter_execute(self):
+        content = ','.join(str(i) for i in range(20000)).encode()
+        with MockWCPSServer(content) as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)").set_format('CSV')
+            blocks = list(my_dco.iter_execute(chunk_size = 4096))
+        assert len(blocks) > 1 and [value for block in blocks for value in block] == [float(i) for i in range(20000)]
+        assert my_dco.format == None
+
+    # iter_execute() yields arrays after as_array()
+    @requires_numpy
+    def test_iter_execute_array(self):
+        with MockWCPSServer(b'1,2,3') as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)").as_array('float32')
+            blocks = list(my_dco.iter_execute())
+        assert np.concatenate(blocks).tolist() == [1, 2, 3] and blocks[0].dtype == np.float32
+
+    # execute_to() writes the response to a file or a buffer
+    def test_execute_to(self, tmp_path):
+        content = bytes(range(256)) * 100
+        with MockWCPSServer(content) as server:
+            my_dbc = dbc(server.url)
+            path = tmp_path / 'result.png'
+            my_dco = dco(my_dbc).initialize_var("$c in (AvgLandTemp)").set_format('PNG')
+            assert my_dco.execute_to(str(path)) == len(content)
+            buffer = io.BytesIO()
+            dco(my_dbc).initialize_var("$c in (AvgLandTemp)").set_format('PNG').execute_to(buffer, chunk_size = 1000)
+        assert path.read_bytes() == content and buffer.getvalue() == content
+
+# answers a query on the grid axes i and j with the values 100 * i + j
+def grid_payload(query):
+    (i0, i1), (j0, j1) = [map(int, re.search(axis + r'\((\d+):(\d+)\)', query).groups()) for axis in 'ij']
+    rows = ['{' + ','.join(str(100 * i + j) for j in range(j0, j1 + 1)) + '}' for i in range(i0, i1 + 1)]
+    return ','.join(rows).encode()
+
+# answers subsets of a descending Lat axis whose cells are centred between the integers, with their coordinates
+def latitude_payload(query):
+    low, high = map(float, re.search(r'Lat\(([-\d.]+):([-\d.]+)\)', query).groups())
+    centres = [k + 0.5 for k in range(89, -91, -1) if low <= k + 0.5 <= high]
+    return ','.join(str(centre) for centre in centres).encode()
+
+# this tests splitting and tiling of subsets
+class Test_tiling():
+    # the subset is split at the commas between the axes only
+    def test_split_subset(self):
+        assert split_subset('Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")') == \
+            ['Lat(53.08)', 'Long(8.80)', 'ansi("2014-01":"2014-12")']
+
+    # dates are split by their own units
+    def test_tile_dates(self):
+        assert tile_interval('"2014-11"', '"2015-03"', 2) == \
+            [('"2014-11"', '"2014-12"'), ('"2015-01"', '"2015-02"'), ('"2015-03"', '"2015-03"')]
+        assert tile_interval('"2000"', '"2002"', 2) == [('"2000"', '"2001"'), ('"2002"', '"2002"')]
+
+    # numeric tiles don't overlap
+    def test_tile_numbers(self):
+        assert tile_interval('0', '9', 4) == [('0', '3'), ('4', '7'), ('8', '9')]
+        assert tile_interval('-1', '0.5', 1, resolution = 0.5) == [('-1', '-0.5'), ('0', '0.5')]
+        with pytest.raises(ValueError):
+            tile_interval('0.5', '10', 2)
+
+    # the tiles of a descending axis start at its highest coordinates, and their bounds are on the cells
+    def test_tile_descending(self):
+        assert tile_interval('-90', '90', 90, resolution = -1, origin = 89.5) == [('0.5', '89.5'), ('-89.5', '-0.5')]
+        assert tile_interval('0', '1', 0.5, resolution = 0.25, origin = 0.125) == \
+            [('0.125', '0.375'), ('0.625', '0.875')]
+        with pytest.raises(ValueError):
+            tile_interval('0.1', '0.2', 1, resolution = 1, origin = 0.5)
+
+    # the tiles are fetched separately and stitched into the full grid
+    @requires_numpy
+    def test_execute_tiled(self):
+        with MockWCPSServer(grid_payload) as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (Grid)").set_format('CSV')
+            my_dco.subset(var_name = '$c', subset = 'i(0:9), j(0:6)')
+            array = my_dco.execute_tiled('$c', tiles = {'i': 4, 'j': 3}, max_workers = 4)
+            assert len(server.queries) == 9
+        expected = [[100 * i + j for j in range(7)] for i in range(10)]
+        assert array.shape == (10, 7) and array.tolist() == expected
+
+    # the tiles of a descending axis are stitched in the order of its cells
+    @requires_numpy
+    def test_execute_tiled_descending(self):
+        with MockWCPSServer(latitude_payload) as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (Grid)").set_format('CSV')
+            my_dco.subset(var_name = '$c', subset = 'Lat(-3:3)')
+            array = my_dco.execute_tiled('$c', tiles = {'Lat': 2}, resolution = {'Lat': -1}, origin = {'Lat': 0.5})
+            assert len(server.queries) == 3
+        assert array.tolist() == [2.5, 1.5, 0.5, -0.5, -1.5, -2.5]
+
+    # a failing tile is retried on its own by the connection, a wrong query isn't retried
+    @requires_numpy
+    def test_retry_tile(self):
+        failures = []
+        def flaky_payload(query):
+            if 'i(4:7)' in query and len(failures) == 0:
+                failures.append(query)
+                return 503, b'Service unavailable'
+            return grid_payload(query)
+        with MockWCPSServer(flaky_payload) as server:
+            my_dco = dco(dbc(server.url, backoff = 0)).initialize_var("$c in (Grid)") \
+                .subset(var_name = '$c', subset = 'i(0:9), j(0:1)')
+            array = my_dco.execute_tiled('$c', tiles = {'i': 4})
+            assert len(server.queries) == 4
+        assert array[:, 1].tolist() == [100 * i + 1 for i in range(10)]
+        def wrong_payload(query):
+            return (400, b'Invalid query') if 'i(4:7)' in query else grid_payload(query)
+        with MockWCPSServer(wrong_payload) as server:
+            my_dco = dco(dbc(server.url, backoff = 0)).initialize_var("$c in (Grid)") \
+                .subset(var_name = '$c', subset = 'i(0:9), j(0:1)')
+            with pytest.raises(WCPSQueryError):
+                my_dco.execute_tiled('$c', tiles = {'i': 4}, max_workers = 1)
+            assert [query for query in server.queries if 'i(4:7)' in query] == [server.queries[1]]
+
+    # a sliced axis can't be tiled
+    def test_sliced_axis(self):
+        my_dco = create_good_dco().subset(var_name = '$c', subset = 'Lat(53.08), ansi("2014-01":"2014-12")')
+        with pytest.raises(ValueError):
+            my_dco.execute_tiled('$c', tiles = {'Lat': 1})
+
+# answers aggregations over the axis i, whose values are the squares of the coordinates
+def aggregate_payload(query):
+    low, high = map(int, re.search(r'i\((\d+):(\d+)\)', query).groups())
+    values = [float(i * i) for i in range(low, high + 1)]
+    results = {'min': min(values), 'max': max(values), 'sum': sum(values), 'avg': sum(values) / len(values),
+               'count': float(len(values))}
+    expression = query.split('return \n', 1)[1]
+    functions = re.findall(r'(?:^|: )(\w+)\(', expression)
+    # several aggregates come back as one composite value
+    if expression.startswith('{'):
+        return ('{' + ' '.join(repr(results[function]) for function in functions) + '}').encode()
+    return repr(results[functions[0]]).encode()
+
+# this tests aggregations computed from the partial aggregates of tiles
+class Test_partitioned_aggregation():
+    # the average comes from the sums and counts of the tiles, not from their averages
+    def test_avg(self):
+        with MockWCPSServer(aggregate_payload) as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (Grid)").subset(var_name = '$c', subset = 'i(0:10)')
+            assert my_dco.avg().execute_partitioned('$c', tiles = {'i': 4}) == [sum(i * i for i in range(11)) / 11]
+            # 3 tiles with the sum and the count in one query each
+            assert len(server.queries) == 3
+
+    # min, max and sum are combined from the tiles
+    def test_min_max_sum(self):
+        with MockWCPSServer(aggregate_payload) as server:
+            my_dbc = dbc(server.url)
+            def create():
+                return dco(my_dbc).initialize_var("$c in (Grid)").subset(var_name = '$c', subset = 'i(3:20)')
+            assert create().min().execute_partitioned('$c', tiles = {'i': 5}) == [9.0]
+            assert create().max().execute_partitioned('$c', tiles = {'i': 5}) == [400.0]
+            total = float(sum(i * i for i in range(3, 21)))
+            assert create().sum().execute_partitioned('$c', tiles = {'i': 5}) == [total]
+
+    # the partial query of a sum
+    def test_partial_query(self):
+        my_dco = create_good_dco().subset(var_name = '$c', subset = 'ansi("2014-07")').sum()
+        assert my_dco.partial_query() == (('sum',), 'for $c in (AvgLandTemp)\nreturn \nsum($c[ansi("2014-07")] )')
+
+    # several statistics are computed from the same partial aggregates
+    def test_stats(self):
+        with MockWCPSServer(aggregate_payload) as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (Grid)").subset(var_name = '$c', subset = 'i(0:9)')
+            result = my_dco.stats(['MIN', 'MAX', 'AVG', 'COUNT']).execute_partitioned('$c', tiles = {'i': 5})
+            assert len(server.queries) == 2
+        assert result == {'min': 0.0, 'max': 81.0, 'avg': 28.5, 'count': 10.0}
+
+    # without an aggregation there is nothing to partition
+    def test_no_aggregation(self):
+        my_dco = create_good_dco().subset(var_name = '$c', subset = 'i(0:10)')
+        with pytest.raises(ValueError):
+            my_dco.execute_partitioned('$c', tiles = {'i': 4})
+
+# this tests several aggregations computed in one query
+class Test_stats():
+    # the aggregates are returned together in one composite value
+    def test_query(self):
+        my_dco = create_good_dco().subset(var_name = '$c', subset = 'ansi("2014-07")').stats(['MIN', 'AVG'])
+        assert my_dco.to_wcps_query() == \
+            'for $c in (AvgLandTemp)\nreturn \n{min: min($c[ansi("2014-07")] ); avg: avg($c[ansi("2014-07")] )}'
+
+    # one round trip returns a record of all the aggregates
+    def test_execute(self):
+        with MockWCPSServer(aggregate_payload) as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (Grid)").subset(var_name = '$c', subset = 'i(1:3)')
+            assert my_dco.stats(['MIN', 'MAX', 'SUM', 'COUNT']).execute() == \
+                {'min': 1.0, 'max': 9.0, 'sum': 14.0, 'count': 3.0}
+            assert len(server.queries) == 1
+
+    # the last aggregation method used is applied
+    def test_last_applied(self):
+        my_dco = create_good_dco().stats(['MIN', 'MAX']).avg()
+        assert my_dco.aggregation == 'AVG'
+
+    # only the existing aggregations can be used, each once
+    def test_wrong_aggregations(self):
+        with pytest.raises(ValueError):
+            create_good_dco().stats(['MIN', 'MEDIAN'])
+        with pytest.raises(ValueError):
+            create_good_dco().stats(['MIN', 'MIN'])
+        with pytest.raises(TypeError):
+            create_good_dco().stats([])
+        with pytest.raises(ValueError):
+            create_good_dco().stats(['MIN'], '$t > 10')
+
+# this tests the scan for variable names
+class Test_var_names():
+    # the names end at the delimiters
+    def test_get_all_var_names(self):
+        my_dco = create_good_dco()
+        assert my_dco.get_all_var_names("abs($a-$b)>15 and {red: $cloud}") == ['$a', '$b', '$cloud']
+        assert my_dco.get_all_var_names("no variables") == None
+
+    # line breaks and tabs end a variable name in do_vars_exist()
+    def test_do_vars_exist_whitespace(self):
+        my_dco = create_good_dco()
+        assert my_dco.do_vars_exist("switch\n\tcase $c\n> 12 return 1\r\ndefault return 0")
+        with pytest.raises(ValueError):
+            my_dco.do_vars_exist("case $c\tand $t")
+
+    # cached results aren't shared between expressions or changed by callers
+    def test_cache(self):
+        my_dco = create_good_dco()
+        names = my_dco.get_all_var_names("$a + $b")
+        names.append('$x')
+        assert my_dco.get_all_var_names("$a + $b") == ['$a', '$b']
+
+# this tests the substitution of the variables with their subsets
+class Test_replace_variables_with_subsets():
+    # a variable whose name is a prefix of another variable's name
+    def test_prefix(self):
+        my_dco = create_good_dco().initialize_var("$cloud in (CloudCover)")
+        my_dco.subset(var_name = '$c', subset = 'ansi("2014-07")')
+        my_dco.subset(var_name = '$cloud', subset = 'ansi("2014-08")')
+        assert my_dco.replace_variables_with_subsets('$c + $cloud') == '$c[ansi("2014-07")] + $cloud[ansi("2014-08")]'
+
+    # the text of a substituted subset isn't substituted again
+    def test_no_resubstitution(self):
+        my_dco = create_good_dco().initialize_var("$d in (CloudCover)")
+        my_dco.subset(var_name = '$c', subset = 'ansi($d)')
+        my_dco.subset(var_name = '$d', subset = 'ansi("2014-08")')
+        assert my_dco.replace_variables_with_subsets('$c - $d') == '$c[ansi($d)] - $d[ansi("2014-08")]'
+
+    # variables without a subset and other text are left as they are
+    def test_unchanged(self):
+        my_dco = create_good_dco().initialize_var("$d in (CloudCover)").subset(var_name = '$d', subset = 'i(0)')
+        assert my_dco.replace_variables_with_subsets('abs($c\n- $d)') == 'abs($c\n- $d[i(0)])'
+
+# this tests prepared query templates
+class Test_prepared_query():
+    # the placeholders are filled in with the bound values
+    def test_bind(self):
+        my_dco = create_good_dco().subset(var_name = '$c', subset = 'Lat(@lat), ansi("@t0":"@t1")').where('$c > @min')
+        template = my_dco.prepare()
+        assert template.parameters == {'lat', 't0', 't1', 'min'}
+        assert template.bind(lat = 53.08, t0 = '2014-01', t1 = '2014-12', min = 0) == \
+            'for $c in (AvgLandTemp)\nwhere $c > 0\nreturn \n$c[Lat(53.08), ansi("2014-01":"2014-12")] '
+
+    # the braces of the query are kept
+    def test_braces(self):
+        template = create_good_dco().encode('switch case $c > @t return {red: 255; green: 0; blue: 0} '
+                                            'default return {red: 0; green: 0; blue: 0}').prepare()
+        assert template.bind(t = 5) == 'for $c in (AvgLandTemp)\nreturn \nencode(switch case $c > 5 return ' \
+            '{red: 255; green: 0; blue: 0} default return {red: 0; green: 0; blue: 0}, "text/csv")'
+
+    # every placeholder needs a value, and every value a placeholder
+    def test_wrong_values(self):
+        template = create_good_dco().subset(var_name = '$c', subset = 'ansi("@t")').prepare()
+        with pytest.raises(TypeError):
+            template.bind()
+        with pytest.raises(TypeError):
+            template.bind(t = '2014-01', x = 1)
+
+    # changing the dco afterwards doesn't change the template
+    def test_independent(self):
+        my_dco = create_good_dco().subset(var_name = '$c', subset = 'ansi("@t")')
+        template = my_dco.prepare()
+        my_dco.set_format('PNG')
+        assert template.bind(t = '2014-01').endswith('$c[ansi("2014-01")] ')
+
+    # execute() decodes like the dco would
+    def test_execute(self):
+        with MockWCPSServer(b'1,2') as server:
+            my_dco = dco(dbc(server.url)).initialize_var("$c in (AvgLandTemp)") \
+                .subset(var_name = '$c', subset = 'ansi("@t")')
+            template = my_dco.set_format('CSV').prepare()
+            assert template.execute(t = '2014-01') == [1.0, 2.0] and template.execute(t = '2014-02') == [1.0, 2.0]
+            assert server.queries[1].endswith('encode($c[ansi("2014-02")] , "text/csv")')
+
+# a clock which only moves when it's told to, for the tests of what happens after some time
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+# this tests retries, timeouts and the circuit breaker against a server which injects faults
+class Test_fault_tolerance():
+    # transient failures are retried
+    def test_retry_transient(self):
+        with MockWCPSServer(b'1', faults = [503, 'drop', 502]) as server:
+            my_dbc = dbc(server.url, retries = 3, backoff = 0)
+            assert my_dbc.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert len(server.queries) == 4
+
+    # the last error is raised with its status code and the server's message when the retries run out
+    def test_retries_exhausted(self):
+        with MockWCPSServer(b'1', faults = [503] * 3) as server:
+            my_dbc = dbc(server.url, retries = 2, backoff = 0)
+            with pytest.raises(WCPSServerError) as error:
+                my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+            assert error.value.status_code == 503 and error.value.server_message == 'Injected fault'
+            assert len(server.queries) == 3
+
+    # a rejected query isn't retried
+    def test_query_error(self):
+        with MockWCPSServer(b'1', faults = [400]) as server:
+            my_dbc = dbc(server.url, backoff = 0)
+            with pytest.raises(WCPSQueryError) as error:
+                my_dbc.send_query('for $c in')
+            assert error.value.status_code == 400 and isinstance(error.value, ValueError)
+            assert len(server.queries) == 1
+
+    # a server which doesn't answer in time raises a timeout
+    def test_timeout(self):
+        with MockWCPSServer(b'1', faults = [1.0]) as server:
+            my_dbc = dbc(server.url, timeout = (1, 0.2), retries = 0)
+            with pytest.raises(WCPSTimeoutError):
+                my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+
+    # a refused connection is a connection error
+    def test_connection_error(self):
+        with MockWCPSServer(b'1') as server:
+            url = server.url
+        with pytest.raises(WCPSConnectionError):
+            dbc(url, retries = 1, backoff = 0).send_query('for $c in (AvgLandTemp) return 1')
+
+    # the circuit opens after the failures and closes after a successful trial query
+    def test_circuit_breaker(self):
+        with MockWCPSServer(b'1', faults = [500, 500]) as server:
+            clock = FakeClock()
+            breaker = CircuitBreaker(failure_threshold = 2, reset_timeout = 30, clock = clock)
+            my_dbc = dbc(server.url, retries = 0, breaker = breaker)
+            for _ in range(2):
+                with pytest.raises(WCPSServerError):
+                    my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+            with pytest.raises(CircuitOpenError):
+                my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+            assert breaker.state == 'open' and len(server.queries) == 2
+            clock.advance(29)
+            assert breaker.state == 'open'
+            clock.advance(1)
+            assert breaker.state == 'half-open'
+            assert my_dbc.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert breaker.state == 'closed'
+
+    # a trial query which fails with another exception, e.g. of a hook, doesn't keep the circuit half-open
+    def test_trial_exception(self):
+        def broken_hook(response, *args, **kwargs):
+            raise RuntimeError("hook failed")
+        with MockWCPSServer(b'1') as server:
+            clock = FakeClock()
+            breaker = CircuitBreaker(failure_threshold = 1, reset_timeout = 30, clock = clock)
+            my_dbc = dbc(server.url, retries = 0, breaker = breaker)
+            breaker.trip()
+            clock.advance(30)
+            my_dbc.session.hooks['response'].append(broken_hook)
+            with pytest.raises(RuntimeError):
+                my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+            my_dbc.session.hooks['response'].remove(broken_hook)
+            assert my_dbc.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert breaker.state == 'closed'
+
+    # the wait before a retry grows exponentially, but not over max_backoff
+    def test_backoff_delay(self):
+        my_dbc = dbc("https://ows.rasdaman.org/rasdaman/ows", backoff = 1, max_backoff = 5)
+        assert all(0 <= my_dbc.backoff_delay(attempt) <= min(5, 2 ** attempt) for attempt in range(10))
+        assert my_dbc.backoff_delay(0, retry_after = 3) >= 3
+
+# this tests the pool of connections to several endpoints
+class Test_dbc_pool():
+    # the queries are spread over the endpoints
+    def test_load_balancing(self):
+        # every query is answered once the other one is in flight too, so both are in flight together
+        barrier = threading.Barrier(2, timeout = 10)
+
+        def payload(query):
+            barrier.wait()
+            return b'1'
+        with MockWCPSServer(payload) as first, MockWCPSServer(payload) as second:
+            pool = DbcPool([first.url, second.url], retries = 0)
+            results = pool.execute_many(['for $c in (AvgLandTemp) return 1'] * 2, max_workers = 2)
+            assert not results.errors
+            assert len(first.queries) == 1 and len(second.queries) == 1
+            pool.close()
+
+    # a query which fails on one endpoint is answered by another one
+    def test_failover(self):
+        with MockWCPSServer(b'1', faults = [503]) as first, MockWCPSServer(b'1', faults = [503]) as second:
+            pool = DbcPool([first.url, second.url], backoff = 0)
+            assert pool.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert pool.stats()[0]['failures'] + pool.stats()[1]['failures'] == 2
+            pool.close()
+
+    # a dead endpoint leaves the rotation and comes back after a successful health check
+    def test_rotation(self):
+        with MockWCPSServer(b'1') as alive:
+            with MockWCPSServer(b'1') as dead:
+                dead_url = dead.url
+            pool = DbcPool([dead_url, alive.url], failure_threshold = 1, reset_timeout = 60, backoff = 0)
+            for _ in range(3):
+                assert pool.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert [endpoint['state'] for endpoint in pool.stats()] == ['open', 'closed']
+            assert len(alive.queries) == 3
+            assert pool.check_health() == {dead_url: False, alive.url: True}
+            pool.endpoints[0].connection.server_url = alive.url
+            pool.check_health()
+            assert pool.stats()[0]['state'] == 'closed'
+            pool.close()
+
+    # an endpoint whose trial slot is taken turns the query away, and the query goes to another endpoint at once
+    def test_half_open_endpoint(self):
+        with MockWCPSServer(b'1') as first, MockWCPSServer(b'1') as second:
+            metrics = QueryMetrics()
+            pool = DbcPool([first.url, second.url], reset_timeout = 0, retries = 0, metrics = metrics)
+            breaker = pool.endpoints[0].connection.breaker
+            breaker.trip()
+            breaker.allow()
+            assert pool.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert len(first.queries) == 0 and len(second.queries) == 1
+            assert [endpoint['failures'] for endpoint in pool.stats()] == [0, 0]
+            assert [endpoint['requests'] for endpoint in pool.stats()] == [0, 1]
+            assert metrics.records[-1].attempts == 1
+            pool.close()
+
+    # only successful responses count for the latency, so an endpoint which fails fast doesn't attract the queries
+    def test_latency_of_failures(self):
+        with MockWCPSServer(b'1') as alive:
+            with MockWCPSServer(b'1') as dead:
+                dead_url = dead.url
+            pool = DbcPool([dead_url, alive.url], strategy = 'lowest_latency', failure_threshold = 10, backoff = 0)
+            for _ in range(3):
+                assert pool.send_query('for $c in (AvgLandTemp) return 1').content == b'1'
+            assert pool.stats()[0]['latency'] == None and pool.stats()[1]['latency'] > 0
+            assert pool.stats()[0]['requests'] == 1 and len(alive.queries) == 3
+            assert pool.session == None
+            pool.close()
+
+    # invalid arguments are rejected before any endpoint opens a session, and a failing endpoint closes the others
+    def test_invalid_arguments(self, monkeypatch):
+        sessions = []
+
+        # the session of the second endpoint can't be opened
+        class TrackedSession(requests.Session):
+            def __init__(self):
+                if len(sessions) == 1:
+                    raise OSError("Too many open files")
+                super().__init__()
+                self.closed = False
+                sessions.append(self)
+
+            def close(self):
+                self.closed = True
+                super().close()
+        monkeypatch.setattr(requests, 'Session', TrackedSession)
+        with pytest.raises(ValueError):
+            DbcPool(["https://a.example.org/rasdaman/ows", "https://b.example.org/rasdaman/ows"], health_interval = 0)
+        assert sessions == []
+        with pytest.raises(TypeError):
+            DbcPool(["https://a.example.org/rasdaman/ows", None])
+        with pytest.raises(OSError):
+            DbcPool(["https://a.example.org/rasdaman/ows", "https://b.example.org/rasdaman/ows"])
+        assert len(sessions) == 1 and sessions[0].closed
+
+    # the pool is a dbc, so a dco can use it and its results are cached under one name
+    def test_dco(self):
+        with MockWCPSServer(b'1,2,3') as first, MockWCPSServer(b'1,2,3') as second:
+            pool = DbcPool([first.url, second.url], cache = ResultCache())
+            for _ in range(2):
+                assert dco(pool).initialize_var('$c in (AvgLandTemp)').set_format('CSV').execute() == [1.0, 2.0, 3.0]
+            assert len(first.queries) + len(second.queries) == 1
+            pool.close()
+
+# waiting for another thread to get somewhere, without assuming how long it takes
+def wait_until(condition, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "The condition wasn't met in time"
+        time.sleep(0.005)
+
+# this tests the coalescing of identical queries in flight
+class Test_coalescing():
+    # identical queries in flight at the same time share one request
+    def test_shared_request(self):
+        # the response is held back until all the other callers wait for it
+        def payload(query):
+            wait_until(lambda: my_dbc.coalesced == 7)
+            return b'1'
+        with MockWCPSServer(payload) as server:
+            my_dbc = dbc(server.url, coalesce = True)
+            results = my_dbc.execute_many(['for $c in (AvgLandTemp) return 1'] * 8, max_workers = 8)
+            assert [response.content for response in results] == [b'1'] * 8
+            assert len(server.queries) == 1
+            assert my_dbc.flights == 1 and my_dbc.coalesced == 7
+
+    # different queries and queries sent one after another aren't shared
+    def test_distinct_queries(self):
+        with MockWCPSServer(b'1', latency = 0.1) as server:
+            my_dbc = dbc(server.url, coalesce = True)
+            my_dbc.execute_many(['for $c in (AvgLandTemp) return 1', 'for $c in (AvgLandTemp) return 2'])
+            my_dbc.send_query('for $c in (AvgLandTemp) return 1')
+            assert len(server.queries) == 3 and my_dbc.coalesced == 0
+
+    # the error of the shared request is raised to every caller
+    def test_shared_error(self):
+        def payload(query):
+            wait_until(lambda: my_dbc.coalesced == 3)
+            return 400, b'Invalid query'
+        with MockWCPSServer(payload) as server:
+            my_dbc = dbc(server.url, coalesce = True)
+            results = my_dbc.execute_many(['for $c in (AvgLandTemp) return 1'] * 4, max_workers = 4)
+            assert len(results.errors) == 4
+            assert all(isinstance(error, WCPSQueryError) for error in results.errors.values())
+            assert len(server.queries) == 1
+        # every caller gets its own error, the followers' errors are caused by the leader's
+        errors = list(results.errors.values())
+        assert len({id(error) for error in errors}) == 4
+        leader = [error for error in errors if error.__cause__ == None]
+        assert len(leader) == 1 and all(error.__cause__ is leader[0] for error in errors if error is not leader[0])
+        assert all(error.status_code == 400 for error in errors)
+
+    # the whitespace inside single-quoted strings is kept, so queries differing there aren't shared
+    def test_single_quotes(self):
+        assert normalize_query("for $c in (AvgLandTemp)\nreturn  encode($c, 'text/ csv')") == \
+            "for $c in (AvgLandTemp) return encode($c, 'text/ csv')"
+        assert normalize_query("return 'a  b'") != normalize_query("return 'a b'")
+        assert normalize_query('return "a  \'b"  ') == 'return "a  \'b"'
+
+# this tests the scheduler of the requests
+class Test_scheduler():
+    # interactive requests are sent before the batch requests which were waiting longer
+    def test_priority(self):
+        scheduler = QueryScheduler(max_in_flight = 1)
+        order = []
+        scheduler.acquire('batch')
+
+        def request(name, priority):
+            with scheduler.slot(priority):
+                order.append(name)
+
+        threads = [threading.Thread(target = request, args = (f'batch{i}', 'batch')) for i in range(3)]
+        for i, thread in enumerate(threads):
+            thread.start()
+            wait_until(lambda: scheduler.stats()['batch']['queued'] == i + 1)
+        threads.append(threading.Thread(target = request, args = ('interactive', 'interactive')))
+        threads[-1].start()
+        wait_until(lambda: scheduler.stats()['interactive']['queued'] == 1)
+        assert scheduler.stats()['batch']['queued'] == 3
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        assert order == ['interactive', 'batch0', 'batch1', 'batch2']
+
+    # the token bucket limits the rate after the burst
+    def test_rate(self):
+        clock = FakeClock()
+        scheduler = QueryScheduler(rate = 4, burst = 2, clock = clock)
+        for _ in range(2):
+            with scheduler.slot():
+                pass
+        waiter = threading.Thread(target = scheduler.acquire, daemon = True)
+        waiter.start()
+        wait_until(lambda: scheduler.stats()['interactive']['queued'] == 1)
+        # the bucket is empty until the clock has moved on by one token
+        clock.advance(0.125)
+        waiter.join(0.2)
+        assert waiter.is_alive() and scheduler.stats()['interactive']['admitted'] == 2
+        clock.advance(0.125)
+        waiter.join(10)
+        assert not waiter.is_alive() and scheduler.stats()['interactive']['admitted'] == 3
+        assert scheduler.stats()['interactive']['wait_max'] == 0.25
+
+    # no more than max_in_flight requests reach the server at once
+    def test_max_in_flight(self):
+        probe = ConcurrencyProbe()
+        with MockWCPSServer(probe) as server:
+            scheduler = QueryScheduler(max_in_flight = 2)
+            my_dbc = dbc(server.url, scheduler = scheduler, priority = 'batch')
+            queries = [f'for $c in (AvgLandTemp) return {i}' for i in range(6)]
+            results = my_dbc.execute_many(queries, max_workers = 6)
+            assert not results.errors and len(server.queries) == 6 and probe.peak <= 2
+            assert scheduler.stats()['in_flight'] == 0 and scheduler.stats()['batch']['admitted'] == 6
+
+    # an unknown priority class is rejected
+    def test_unknown_priority(self):
+        with pytest.raises(ValueError):
+            dbc("https://ows.rasdaman.org/rasdaman/ows", scheduler = QueryScheduler(), priority = 'urgent')
+        with pytest.raises(ValueError):
+            QueryScheduler(rate = 0)
+
+    # the scheduler of a pool limits the requests to all its endpoints together
+    def test_pool(self):
+        probe = ConcurrencyProbe()
+        with MockWCPSServer(probe) as first, MockWCPSServer(probe) as second:
+            scheduler = QueryScheduler(max_in_flight = 1)
+            pool = DbcPool([first.url, second.url], scheduler = scheduler)
+            results = pool.execute_many([f'for $c in (AvgLandTemp) return {i}' for i in range(4)], max_workers = 4)
+            assert not results.errors and probe.peak == 1
+            assert scheduler.stats()['interactive']['admitted'] == 4
+            pool.close()
+
+# this tests the metrics of the queries
+class Test_metrics():
+    # every phase of dco.execute() is measured and the record is passed to the hooks
+    def test_record(self):
+        records = []
+        with MockWCPSServer(b'1.5,2.5', faults = [503]) as server:
+            metrics = QueryMetrics(hooks = [records.append])
+            my_dbc = dbc(server.url, metrics = metrics, backoff = 0)
+            assert dco(my_dbc).initialize_var("$c in (AvgLandTemp)").set_format('CSV').execute() == [1.5, 2.5]
+        record = records[0]
+        assert record.kind == 'CSV' and record.status == 200 and record.retries == 1 and record.error == None
+        assert record.build > 0 and record.network > 0 and record.parse > 0
+        assert record.response_bytes == 7 and record.request_bytes > len(record.query)
+
+    # cache hits, errors and status codes are counted
+    def test_summary(self):
+        with MockWCPSServer(b'1', faults = [None, 400]) as server:
+            metrics = QueryMetrics()
+            my_dbc = dbc(server.url, metrics = metrics, cache = ResultCache())
+            for _ in range(2):
+                assert dco(my_dbc).initialize_var("$c in (AvgLandTemp)").set_format('CSV').execute() == [1.0]
+            with pytest.raises(WCPSQueryError):
+                my_dbc.send_query('for $c in')
+        summary = metrics.summary()
+        assert summary['queries'] == 3 and summary['cache_hits'] == 1 and summary['errors'] == 1
+        assert summary['statuses'] == {'200': 1, '400': 1}
+        assert json.loads(metrics.to_json()) == summary
+
+    # the Prometheus export has a line per counter and phase
+    def test_prometheus(self):
+        with MockWCPSServer(b'1') as server:
+            metrics = QueryMetrics()
+            dbc(server.url, metrics = metrics).send_query('for $c in (AvgLandTemp) return 1')
+        text = metrics.to_prometheus()
+        assert 'wdc_queries_total 1\n' in text and 'wdc_responses_total{status="200"} 1\n' in text
+        assert re.search(r'^wdc_phase_seconds\{phase="network",quantile="0.5"\} [0-9.e-]+$', text, re.M)
+
+# this tests the local stand-in server
+class Test_mock_server():
+    # the synthetic payload has the format asked for in the query
+    def test_synthetic_payload(self):
+        with MockWCPSServer(synthetic_payload(100)) as server:
+            datacube = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)')
+            assert len(datacube.set_format('CSV').execute()) == 100
+            png = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('PNG').execute()
+            assert png.startswith(b'\x89PNG') and int.from_bytes(png[16:20], 'big') == 10
+            jpeg = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('JPEG').execute()
+            assert jpeg.startswith(b'\xff\xd8') and jpeg.endswith(b'\xff\xd9')
+
+    # the random errors are repeatable with a seed
+    def test_error_rate(self):
+        statuses = []
+        for _ in range(2):
+            with MockWCPSServer(b'1', error_rate = 0.5, seed = 1) as server:
+                results = dbc(server.url, retries = 0).execute_many(['for $c in (AvgLandTemp) return 1'] * 20,
+                                                                    max_workers = 1)
+                statuses.append(sorted(results.errors))
+        assert 0 < len(statuses[0]) < 20 and statuses[0] == statuses[1]
+
+# this tests decoding of PNG and JPEG results
+@requires_pillow
+class Test_decode_image():
+    # a grayscale image gets one band
+    def test_png(self):
+        array = decode_image(synthetic_png(5, 3))
+        assert array.shape == (3, 5, 1) and array.dtype == np.uint8
+        assert array[2, 4, 0] == 6
+
+    def test_jpeg_dtype(self):
+        array = decode_image(synthetic_jpeg(16, 8), 'float32')
+        assert array.shape == (8, 16, 1) and array.dtype == np.float32
+        assert np.all(array == 128)
+
+    def test_not_image(self):
+        with pytest.raises(ValueError):
+            decode_image(b'1,2,3')
+
+    # the batch is decoded on worker processes, a broken image gives its exception in its place
+    def test_batch(self):
+        arrays = decode_images([synthetic_png(4, 4), b'broken', synthetic_jpeg(8, 8)], max_workers = 2,
+                               return_exceptions = True)
+        assert arrays[0].shape == (4, 4, 1) and isinstance(arrays[1], ValueError) and arrays[2].shape == (8, 8, 1)
+
+    # as_array() decodes the image results of execute() and execute_many()
+    def test_execute(self):
+        with MockWCPSServer(synthetic_payload(64)) as server:
+            my_dbc = dbc(server.url)
+            array = dco(my_dbc).initialize_var('$c in (AvgLandTemp)').set_format('PNG').as_array('uint8').execute()
+            assert array.shape == (8, 8, 1)
+            datacube = dco(my_dbc).initialize_var('$c in (AvgLandTemp)').set_format('JPEG').as_array('uint8').freeze()
+            results = my_dbc.execute_many([datacube] * 3, processes = 2)
+            assert not results.errors and all(result.shape == (8, 8, 1) for result in results)
+
+# this tests decoding of GeoTIFF and netCDF results
+@requires_numpy
+class Test_binary_formats():
+    def test_format_names(self):
+        datacube = dco(dbc("https://ows.rasdaman.org/rasdaman/ows")).initialize_var('$c in (AvgLandTemp)')
+        assert datacube.set_format('GTiff').return_format() == 'image/tiff'
+        assert datacube.set_format('netCDF').return_format() == 'application/netcdf'
+
+    # an uncompressed GeoTIFF is a view of the bytes, or of the memory-mapped file
+    def test_read_tiff(self, tmp_path):
+        array = read_tiff(synthetic_tiff(5, 3))
+        assert array.shape == (3, 5, 1) and array.dtype == np.float32 and not array.flags.writeable
+        assert array[2, 4, 0] == 14.0
+        path = tmp_path / 'result.tif'
+        path.write_bytes(synthetic_tiff(5, 3))
+        assert np.array_equal(read_tiff(str(path)), array)
+
+    def test_read_tiff_invalid(self):
+        with pytest.raises(ValueError):
+            read_tiff(b'1,2,3')
+
+    def test_read_netcdf(self, tmp_path):
+        arrays = read_netcdf(synthetic_netcdf(4, 2))
+        assert list(arrays) == ['Gray'] and arrays['Gray'].shape == (2, 4)
+        assert arrays['Gray'].tolist() == [[0, 1, 2, 3], [4, 5, 6, 7]]
+        path = tmp_path / 'result.nc'
+        path.write_bytes(synthetic_netcdf(4, 2))
+        assert np.array_equal(read_netcdf(path)['Gray'], arrays['Gray'])
+
+    # execute() decodes the binary results into typed arrays, as_array() converts them
+    def test_execute(self):
+        with MockWCPSServer(synthetic_payload(16)) as server:
+            datacube = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').freeze()
+            tiff = datacube.set_format('GTiff').execute()
+            assert tiff.shape == (4, 4, 1) and tiff.dtype == np.float32
+            assert datacube.set_format('GTiff').as_array('float64').execute().dtype == np.float64
+            assert datacube.set_format('netCDF').execute()['Gray'].shape == (4, 4)
+            assert 'image/tiff' in server.queries[0]
+
+# this tests the on-disk store of large results
+@requires_numpy
+class Test_result_store():
+    # a CSV result is parsed into a .npy file while it's read and opened memory-mapped
+    def test_csv(self, tmp_path):
+        store = ResultStore(str(tmp_path))
+        with MockWCPSServer(b'{1,2,3},{4,5,6}') as server:
+            datacube = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('CSV').freeze()
+            array = datacube.as_array('float32').execute_stored(store, chunk_size = 4)
+            assert isinstance(array, np.memmap) and array.dtype == np.float32
+            assert array.tolist() == [[1, 2, 3], [4, 5, 6]]
+            # the stored result is opened again, in this and in a new store of the same directory
+            assert np.array_equal(datacube.as_array('float32').execute_stored(ResultStore(str(tmp_path))), array)
+            assert len(server.queries) == 1
+        key = store.keys()[0]
+        assert store.info(key)['shape'] == [2, 3] and store.info(key)['query'] == server.queries[0]
+
+    # multi-band cells get the last axis
+    def test_bands(self, tmp_path):
+        with MockWCPSServer(b'{"1 2","3 4","5 6"}') as server:
+            array = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').execute_stored(ResultStore(tmp_path))
+            assert array.shape == (1, 3, 2) and array[0, 2].tolist() == [5, 6]
+
+    # a broken result isn't stored
+    def test_ragged(self, tmp_path):
+        store = ResultStore(str(tmp_path))
+        with MockWCPSServer(b'{1,2,3},{4,5}') as server:
+            with pytest.raises(ValueError):
+                dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('CSV').execute_stored(store)
+        assert store.keys() == [] and list(tmp_path.iterdir()) == []
+
+    # a file which can't be read after it's written isn't stored either
+    def test_broken_file(self, tmp_path):
+        store = ResultStore(str(tmp_path))
+        with MockWCPSServer(b'not a TIFF file') as server:
+            with pytest.raises(ValueError):
+                dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('GTiff').execute_stored(store)
+        assert store.keys() == [] and list(tmp_path.iterdir()) == []
+
+    # GTiff results are kept as they are and mapped by read_tiff()
+    def test_tiff(self, tmp_path):
+        store = ResultStore(str(tmp_path))
+        with MockWCPSServer(synthetic_payload(16)) as server:
+            array = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('GTiff').execute_stored(store)
+            assert array.shape == (4, 4, 1) and array.dtype == np.float32
+        assert store.info(store.keys()[0])['file'].endswith('.tif')
+        store.clear()
+        assert store.keys() == [] and list(tmp_path.iterdir()) == []
+
+    def test_aggregation(self, tmp_path):
+        datacube = dco(dbc("https://ows.rasdaman.org/rasdaman/ows")).initialize_var('$c in (AvgLandTemp)').avg()
+        with pytest.raises(ValueError):
+            datacube.execute_stored(ResultStore(str(tmp_path)))
+
+# a monthly series, every month of the asked range gives its number of months since 2000-01
+def monthly_payload(query):
+    low, high = re.search(r'ansi\("(\d{4}-\d{2})":"(\d{4}-\d{2})"\)', query).groups()
+    months = [int(date[:4]) * 12 + int(date[5:]) - 1 - 2000 * 12 for date in (low, high)]
+    return ','.join(str(month) for month in range(months[0], months[1] + 1)).encode()
+
+# this tests the incremental refresh of time series
+@requires_numpy
+class Test_incremental():
+    def create(self, url, high):
+        my_dco = dco(dbc(url)).initialize_var('$c in (AvgLandTemp)').set_format('CSV')
+        return my_dco.subset(var_name = '$c', subset = f'Lat(53.08), Long(8.80), ansi("2000-01":"{high}")')
+
+    # only the months after the stored ones are fetched and appended
+    def test_refresh(self, tmp_path):
+        store = SeriesStore(str(tmp_path))
+        with MockWCPSServer(monthly_payload) as server:
+            assert self.create(server.url, '2000-12').execute_incremental('$c', store).tolist() == list(range(12))
+            series = self.create(server.url, '2001-02').execute_incremental('$c', store)
+            assert series.tolist() == list(range(14)) and isinstance(series, np.memmap)
+            assert 'ansi("2001-01":"2001-02")' in server.queries[-1]
+            # nothing is fetched when the range is already stored
+            assert len(self.create(server.url, '2001-02').execute_incremental('$c', store)) == 14
+            assert len(server.queries) == 2
+        state = store.state(store.keys()[0])
+        assert state['first'] == '"2000-01"' and state['last'] == '"2001-02"' and state['count'] == 14
+
+    # a different start or spatial subset is a different series
+    def test_other_series(self, tmp_path):
+        store = SeriesStore(str(tmp_path))
+        with MockWCPSServer(monthly_payload) as server:
+            self.create(server.url, '2000-06').execute_incremental('$c', store)
+            other = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)').set_format('CSV')
+            other.subset(var_name = '$c', subset = 'Lat(10), Long(8.80), ansi("2000-01":"2000-06")')
+            assert len(other.execute_incremental('$c', store)) == 6
+            assert len(server.queries) == 2
+
+    # the dates of the slices are counted, so a range which the coverage doesn't fill month by month is rejected
+    def test_missing_slices(self, tmp_path):
+        store = SeriesStore(str(tmp_path))
+        coverage_end = ['2000-10']
+
+        def clipped_payload(query):
+            return monthly_payload(re.sub(r'(ansi\("\d{4}-\d{2}":")(\d{4}-\d{2})', lambda match: match.group(1) +
+                                          min(match.group(2), coverage_end[0]), query))
+        with MockWCPSServer(clipped_payload) as server:
+            with pytest.raises(ValueError):
+                self.create(server.url, '2000-12').execute_incremental('$c', store)
+            assert store.keys() == []
+            coverage_end[0] = '2001-01'
+            assert self.create(server.url, '2001-01').execute_incremental('$c', store).tolist() == list(range(13))
+            # a range which ends earlier gets only its own slices
+            assert self.create(server.url, '2000-06').execute_incremental('$c', store).tolist() == list(range(6))
+            assert len(server.queries) == 2
+        # quarterly slices asked for by months
+        with MockWCPSServer(lambda query: b'0,3,6,9') as server:
+            with pytest.raises(ValueError):
+                self.create(server.url, '2000-12').execute_incremental('$c', SeriesStore(str(tmp_path / 'quarterly')))
+
+    def test_invalid_range(self, tmp_path):
+        with pytest.raises(ValueError):
+            self.create("https://ows.rasdaman.org/rasdaman/ows", '1999-01') \
+                .execute_incremental('$c', SeriesStore(tmp_path))
+        # dates of different precision
+        with pytest.raises(ValueError):
+            self.create("https://ows.rasdaman.org/rasdaman/ows", '2001') \
+                .execute_incremental('$c', SeriesStore(tmp_path))
+
+# a grid with the value 100 * i + j, the axes are ranges or single coordinates, and their aggregates
+def lazy_payload(query):
+    bounds = []
+    for axis in 'ij':
+        low, high = re.search(axis + r'\((\d+)(?::(\d+))?\)', query).groups()
+        bounds.append((int(low), int(high) if high != None else None))
+    (i0, i1), (j0, j1) = bounds
+    grid = [[100 * i + j for j in range(j0, (j1 if j1 != None else j0) + 1)]
+            for i in range(i0, (i1 if i1 != None else i0) + 1)]
+    values = [float(value) for row in grid for value in row]
+    expression = query.split('return \n', 1)[1]
+    # a sliced axis isn't an axis of the result anymore
+    if expression.startswith('encode'):
+        if i1 != None and j1 != None:
+            return ','.join('{' + ','.join(map(str, row)) + '}' for row in grid).encode()
+        return ','.join(str(value) for row in grid for value in row).encode()
+    results = {'min': min(values), 'max': max(values), 'sum': sum(values), 'avg': sum(values) / len(values),
+               'count': float(len(values))}
+    functions = re.findall(r'(?:^|: )(\w+)\(', expression)
+    if expression.startswith('{'):
+        return ('{' + ' '.join(repr(results[function]) for function in functions) + '}').encode()
+    return repr(results[functions[0]]).encode()
+
+# this tests the lazy array over a coverage
+@requires_numpy
+class Test_lazy_coverage():
+    def create(self, url, chunks = None):
+        datacube = dco(dbc(url)).initialize_var('$c in (Grid)')
+        return LazyCoverage(datacube, '$c', {'i': (0, 9), 'j': (0, 4)}, chunks = chunks)
+
+    # slicing only narrows the subset, nothing is fetched
+    def test_slicing(self):
+        cube = self.create("https://ows.rasdaman.org/rasdaman/ows")
+        assert cube.shape == (10, 5) and len(cube) == 10
+        assert cube[2:5, 1:].subset == 'i(2:4), j(1:4)' and cube[2:5, 1:].shape == (3, 4)
+        assert cube[-1].subset == 'i(9), j(0:4)' and cube[-1].shape == (5,)
+        assert cube[..., 3][4:6].subset == 'i(4:5), j(3)'
+        with pytest.raises(IndexError):
+            cube[10]
+        with pytest.raises(IndexError):
+            cube[::2]
+
+    # dates step by their own units
+    def test_dates(self):
+        datacube = dco(dbc("https://ows.rasdaman.org/rasdaman/ows")).initialize_var('$c in (AvgLandTemp)')
+        cube = LazyCoverage(datacube, '$c', {'ansi': ('2000-01', '2001-12'), 'Lat': (-89.5, 89.5)})
+        assert cube.shape == (24, 180)
+        assert cube[-12:, 143].subset == 'ansi("2001-01":"2001-12"), Lat(53.5)'
+
+    # the cells of a descending axis are indexed in the order of the server, chunked or not
+    def test_descending(self):
+        datacube = dco(dbc("https://ows.rasdaman.org/rasdaman/ows")).initialize_var('$c in (AvgLandTemp)')
+        cube = LazyCoverage(datacube, '$c', {'Lat': (89.5, -89.5)})
+        assert cube.shape == (180,) and cube[:3].subset == 'Lat(87.5:89.5)' and cube[36].subset == 'Lat(53.5)'
+        assert LazyCoverage(datacube, '$c', {'Lat': (89.5, -89.5, -0.5)}).shape == (359,)
+        with pytest.raises(ValueError):
+            LazyCoverage(datacube, '$c', {'Lat': (89.5, -89.5, 1)})
+        centres = [k + 0.5 for k in range(89, -91, -1)]
+        with MockWCPSServer(latitude_payload) as server:
+            datacube = dco(dbc(server.url)).initialize_var('$c in (AvgLandTemp)')
+            cube = LazyCoverage(datacube, '$c', {'Lat': (89.5, -89.5)})
+            assert cube.compute().tolist() == centres
+            assert cube.compute()[:3].tolist() == cube[:3].compute().tolist() == [89.5, 88.5, 87.5]
+            assert cube[100:150].compute(chunks = {'Lat': 7}).tolist() == centres[100:150]
+            assert len(server.queries) == 3 + 8
+
+    # compute() fetches the selected part, in parallel chunks if asked for
+    def test_compute(self):
+        with MockWCPSServer(lazy_payload) as server:
+            cube = self.create(server.url)
+            assert cube[2:4, 1:3].compute().tolist() == [[201, 202], [301, 302]]
+            assert cube[:, 2].compute().tolist() == [100 * i + 2 for i in range(10)]
+            assert len(server.queries) == 2
+            chunked = self.create(server.url, chunks = {'i': 3})[1:9]
+            assert np.array_equal(chunked.compute(), np.array([[100 * i + j for j in range(5)] for i in range(1, 9)]))
+            assert len(server.queries) == 5
+
+    # the reductions are computed by the server, the chunked ones from partial aggregates
+    def test_reductions(self):
+        values = [100 * i + j for i in range(2, 6) for j in range(5)]
+        with MockWCPSServer(lazy_payload) as server:
+            cube = self.create(server.url)[2:6]
+            assert cube.sum() == sum(values) and cube.min() == min(values) and cube.max() == max(values)
+            assert cube.mean() == sum(values) / len(values) and cube.count('$c > 0') == 20
+            assert len(server.queries) == 5
+            chunked = self.create(server.url, chunks = {'i': 2})[2:6]
+            assert chunked.mean() == sum(values) / len(values)
+            assert chunked.stats(['MIN', 'MAX']) == {'min': min(values), 'max': max(values)}
+
+    # the reductions along axes and with conditions are WCPS condensers, only their results are downloaded
+    def test_pushdown(self):
+        def payload(query):
+            expression = query.split('return \n', 1)[1]
+            if expression.startswith('encode'):
+                return b'1,2,3,4'
+            return b'{7 8}' if expression.startswith('{') else b'7'
+        over_i, over_j = '$p0 i(imageCrsDomain($c[i(2:5), j(0:4)], i))', '$p1 j(imageCrsDomain($c[i(2:5), j(0:4)], j))'
+        over = f'{over_i}, {over_j}'
+        cell = '$c[i:"CRS:1"($p0), j:"CRS:1"($p1)]'
+        with MockWCPSServer(payload) as server:
+            cube = self.create(server.url)[2:6]
+            assert cube.sum(axis = 1).tolist() == [1, 2, 3, 4]
+            assert server.queries[-1].split('return \n')[1] == \
+                f'encode(coverage reduced over {over_i} values sum($c[i:"CRS:1"($p0), j(0:4)]), "text/csv")'
+            assert cube.min(condition = '$c > 250') == 7.0
+            assert server.queries[-1].split('return \n')[1] == \
+                f'condense min over {over} where {cell} > 250 using {cell}'
+            assert cube.mean(axis = -1, condition = '$c > 250').tolist() == [1, 2, 3, 4]
+            assert f'values (condense + over {over_j} where' in server.queries[-1]
+            assert f' using {cell}) / (condense + over ' in server.queries[-1]
+            assert cube.stats(['MIN', 'COUNT'], '$c > 250') == {'min': 7.0, 'count': 8.0}
+            assert server.queries[-1].split('return \n')[1] == \
+                f'{{min: condense min over {over} where {cell} > 250 using {cell}; ' \
+                f'count: condense + over {over} where {cell} > 250 using 1}}'
+            assert len(server.queries) == 4
+        with pytest.raises(ValueError):
+            cube.sum(axis = 2)
@@ -1,593 +1,3393 @@
+import asyncio
+import contextlib
+import copy
+import datetime
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
+# numpy is only needed for the array results
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-# database connection object
-class dbc:
-    # initalizing our dbc by providing it with the service endpoint, from which we can get a datacube
-    def __init__(self, url):
+# Pillow is only needed for decoding the PNG and JPEG results into arrays
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# tifffile and netCDF4 are only needed for the binary results which the built-in readers don't support
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+
+# base class of the errors of the queries, the subclasses tell what went wrong
+class WCPSError(Exception):
+    # status codes of transient failures, after which the same query can succeed when it is sent again
+    retryable_statuses = (429, 502, 503, 504)
+
+    def __init__(self, message, status_code = None, server_message = None, retry_after = None):
         """
-        Initializes a new dbc instance which is used to manage connections and send queries to a WCPS server.
+        Initializes an error of a WCPS query.
 
         Parameters:
-            url (str): The endpoint URL of the WCPS server.
+            message (str): A description of the error.
+            status_code (int, optional): The HTTP status code of the server's response, if there was one.
+            server_message (str, optional): The error text sent by the server.
+            retry_after (float, optional): The seconds the server asked to wait before the next query.
 
         Example:
-            >>> database_connection = dbc("https://ows.rasdaman.org/rasdaman/ows")
-        """
-        if not isinstance(url, str):
-            raise TypeError("Value entered must be a string.")
-        self.server_url = url
-    
-    def send_query(self, wcps_query):
+            >>> raise WCPSError("Query failed", status_code = 500, server_message = "Internal error")
         """
-        Sends a WCPS query to the server and retrieves the response.
+        super().__init__(message)
+        self.status_code = status_code
+        self.server_message = server_message
+        self.retry_after = retry_after
 
-        Parameters:
-            wcps_query (str): A string containing the WCPS query.
+    # whether sending the same query again can succeed
+    @property
+    def retryable(self):
+        return self.status_code in self.retryable_statuses
 
-        Returns:
-            Response: A response object from the requests library containing the server's response to the query.
 
-        Example:
-            >>> result = database_connection.send_query("for c in (AvgLandTemp) return encode(c, 'csv')")
-        """
-        if not isinstance(wcps_query, str):
-            raise TypeError("Value entered must be a string.")
-        # getting a response from the server
-        try:
-            # 'verify=False' is used to skip SSL certificate verification;
-            response = requests.post(self.server_url, data = {'query': wcps_query}, verify = False)
-            if response.status_code == 200:
-                return response
-            else:
-                raise ValueError("Not correct query")
-        except:
-            raise Exception("Something is wrong...")
-         # General exception handling to catch potential issues like network 
+# the server rejected the query (4xx), e.g. because of a syntax error or a coverage which doesn't exist
+class WCPSQueryError(WCPSError, ValueError):
+    pass
 
 
+# the server failed to answer the query (5xx)
+class WCPSServerError(WCPSError):
+    pass
 
 
-# function needed for converting a byte string to the list of numbers
-def byte_to_list(byte_str):
+# no response was received, because the connection failed
+class WCPSConnectionError(WCPSError):
+    @property
+    def retryable(self):
+        return True
+
+
+# no response was received in time
+class WCPSTimeoutError(WCPSConnectionError):
+    pass
+
+
+# the query wasn't sent, because the circuit breaker of the endpoint is open
+class CircuitOpenError(WCPSError):
+    @property
+    def retryable(self):
+        return False
+
+
+# the error text of a response, OWS exception reports keep it in ExceptionText elements
+_EXCEPTION_TEXT = re.compile(r'<(?:\w+:)?ExceptionText>(.*?)</(?:\w+:)?ExceptionText>', re.DOTALL)
+
+
+def error_from_response(response):
     """
-    Converts a byte string into a list of floats. Useful for parsing numeric data returned from a server.
+    Creates the error which describes a response with a status code other than 200.
 
     Parameters:
-        byte_str (bytes): The byte string to be converted.
+        response (Response): The server's response.
 
     Returns:
-        list of float: A list of floats derived from the byte string.
+        WCPSError: A WCPSQueryError for 4xx, a WCPSServerError for 5xx, otherwise a WCPSError.
 
     Example:
-        >>> byte_to_list(b'1.0,2.0,3.0')
-        [1.0, 2.0, 3.0]
+        >>> raise error_from_response(response)
     """
-    decoded_str = byte_str.decode('utf-8') # decode the byte string
-    str_list = decoded_str.split(',') # split numbers separated by comma
-    num_list = [float(num) for num in str_list] # create a list of numbers
-    return num_list
+    text = response.text
+    texts = _EXCEPTION_TEXT.findall(text)
+    server_message = ' '.join(part.strip() for part in texts) if texts else text.strip()[:1000]
+    retry_after = response.headers.get('Retry-After')
+    try:
+        retry_after = float(retry_after) if retry_after != None else None
+    except ValueError:
+        retry_after = None
+    status = response.status_code
+    message = f"The server answered with status {status}: {server_message}"
+    if 400 <= status < 500:
+        return WCPSQueryError(message, status, server_message, retry_after)
+    if 500 <= status < 600:
+        return WCPSServerError(message, status, server_message, retry_after)
+    return WCPSError(message, status, server_message, retry_after)
 
 
-# datacube object
-class dco:
-    # initializing the dco
-    def __init__(self, dbc_being_used):
+# circuit breaker of an endpoint, it stops sending queries to a server which keeps failing
+class CircuitBreaker:
+    def __init__(self, failure_threshold = 5, reset_timeout = 30.0, clock = time.monotonic):
         """
-        Initializes a dco instance which manages WCPS queries using a dbc object for server communication.
+        Initializes a circuit breaker. After failure_threshold consecutive failures the circuit opens and queries
+            fail right away with CircuitOpenError. After reset_timeout seconds one trial query is let through:
+            if it succeeds the circuit closes again, otherwise it stays open for another reset_timeout.
 
         Parameters:
-            dbc_being_used (dbc): An instance of dbc used for server communication.
+            failure_threshold (int, optional): The number of consecutive failures which open the circuit.
+            reset_timeout (float, optional): The seconds the circuit stays open before a trial query.
+            clock (callable, optional): Returns the current time in seconds, time.monotonic by default.
 
         Example:
-            >>> datacube = dco(database_connection)
+            >>> database_connection = dbc(url, breaker = CircuitBreaker(failure_threshold = 3, reset_timeout = 10))
         """
-        if not isinstance(dbc_being_used, dbc):
-            raise TypeError("dbc instance not passed")
-        
-        self.DBC = dbc_being_used
-        # default values
-        self.vars = []
-        self.Subsets = []
-        self.aggregation = None
-        self.format = None
-        self.aggregation_condition = None
-        self.filter_condition = None
-        self.var_names = []
-        self.transformation = None
-        self.encode_as = None
-        
-    def reset(self):
+        if not isinstance(failure_threshold, int) or isinstance(failure_threshold, bool) or failure_threshold < 1:
+            raise ValueError("failure_threshold must be a positive integer.")
+        if reset_timeout < 0:
+            raise ValueError("reset_timeout can't be negative.")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at == None:
+                return 'closed'
+            if self._trial or self.clock() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
         """
-        Resets the attributes of the dco instance to their default values, except for the dbc connection
-            which remains unchanged.
+        Checks whether a query can be sent.
 
         Returns:
-            self: Returns the instance itself with reset values.
+            bool: True if the query is the trial query of a half-open circuit, which must end with
+                record_success(), record_failure() or end_trial().
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or a trial query is already in flight.
 
         Example:
-            >>> datacube.reset()
+            >>> breaker.allow()
+            False
         """
-        self.vars = []
-        self.Subsets = []
-        self.aggregation = None
-        self.format = None
-        self.count_condition = None
-        self.filter_condition = None
-        self.var_names = []
-        self.transformation = None
-        self.encode_as = None
-        return self
+        with self._lock:
+            if self.opened_at == None:
+                return False
+            if not self._trial and self.clock() - self.opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            raise CircuitOpenError("The circuit breaker of the endpoint is open")
 
-    
-    def get_all_var_names(self, string):
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+    # ending a trial query which didn't tell whether the server works, the next query is a trial again
+    def end_trial(self):
+        with self._lock:
+            self._trial = False
+
+    # opening the circuit right away, e.g. after a failed health check
+    def trip(self):
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.opened_at = self.clock()
+            self._trial = False
+
+
+# client-side scheduler of the requests, it limits their rate and concurrency and lets the urgent ones go first
+class QueryScheduler:
+    # how many of the latest waits the percentiles are computed from
+    history = 1000
+
+    def __init__(self, rate = None, burst = None, max_in_flight = None, priorities = ('interactive', 'batch'),
+                 clock = time.monotonic):
         """
-        Extracts all variable names from a string where variables are prefixed by '$' and can be
-            followed by various delimiters such as spaces, commas, parentheses, etc.
+        Initializes a scheduler which the requests of one or more dbc instances wait in before being sent.
+            A request is sent when it's the most urgent one waiting, fewer than max_in_flight requests are in
+            flight and the token bucket has a token. The waiting requests are ordered by their priority class,
+            and within a class by their arrival.
 
         Parameters:
-            string (str): A string potentially containing multiple variables each prefixed by '$'.
-
-        Returns:
-            list: A list of extracted variable names. Returns an empty list if no variables are found.
+            rate (float, optional): The number of requests sent per second on average. None doesn't limit the rate.
+            burst (int, optional): The number of requests which can be sent at once after an idle time,
+                the size of the token bucket. It's 1 by default.
+            max_in_flight (int, optional): The maximum number of requests in flight. None doesn't limit it.
+            priorities (tuple, optional): The names of the priority classes, the most urgent first.
+            clock (callable, optional): Returns the current time in seconds, time.monotonic by default.
 
         Example:
-            >>> var_names = get_all_var_names("$a>15 and $b")
-            >>> print(var_names)
-            ['$a', '$b']
+            >>> scheduler = QueryScheduler(rate = 5, burst = 10, max_in_flight = 4)
+            >>> interactive = dbc(url, scheduler = scheduler)
+            >>> batch = dbc(url, scheduler = scheduler, priority = 'batch')
         """
-        var_names = []
-        index = 0
-        while index < len(string):
-            start_index = string.find('$', index) # Find the index of the next '$' symbol starting from 'index'
-            if start_index == -1:
-                break
-            
-            # Define a list of characters that should terminate the variable name
-            delimiters = [' ', ',', '(', ')', '[', ']', '{', '}', ';', '>', '<', '+', '-', '=', '.', 
-                         '/', '\\', '|', '!']
-            end_index = len(string)
-            
-            # Enumerate through the substring starting from 'start_index' to find the first delimiter
-            for i, char in enumerate(string[start_index:]):
-                if char in delimiters:
-                    end_index = start_index + i
-                    break
-
-            var_names.append(string[start_index:end_index])
-            index = end_index
-            
-        if len(var_names) == 0:
-            return None
-        return var_names
+        if rate != None and rate <= 0:
+            raise ValueError("rate must be positive.")
+        if burst == None:
+            burst = 1
+        if not isinstance(burst, int) or isinstance(burst, bool) or burst < 1:
+            raise ValueError("burst must be a positive integer.")
+        if max_in_flight != None and (not isinstance(max_in_flight, int) or max_in_flight < 1):
+            raise ValueError("max_in_flight must be a positive integer.")
+        if not priorities:
+            raise ValueError("At least one priority class is needed.")
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.priorities = tuple(priorities)
+        self.clock = clock
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self._updated = self.clock()
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._queued = {priority: 0 for priority in self.priorities}
+        self._admitted = {priority: 0 for priority in self.priorities}
+        self._waits = {priority: deque(maxlen = self.history) for priority in self.priorities}
 
-    
-    def initialize_var(self, s):
+    # the place of a priority class in the order, unknown classes are rejected
+    def rank(self, priority):
+        try:
+            return self.priorities.index(priority)
+        except ValueError:
+            raise ValueError(f"Unknown priority class {priority!r}, expected one of {self.priorities}.") from None
+
+    def acquire(self, priority = 'interactive'):
         """
-        Initializes a variable for the datacube object. This method extracts the variable name from 
-            the input,checks if it's successfully defined, and then appends the variable along with
-            its associated datacube to the respective lists within the dco instance.
+        Waits until a request of the given priority class can be sent and counts it as in flight.
+            Every acquire() must be followed by a release(), slot() does both.
 
         Parameters:
-            s (str): A string that combines the variable name and its associated datacube,
-                formatted as '$variable_name in (coverage_name)'.
+            priority (str, optional): The priority class of the request.
 
         Returns:
-            self: Returns the instance itself if the variable is successfully added.
-            
-        Raises:
-            ValueError: If the format of the variable initialization wasn't correct  
+            float: The seconds the request waited.
 
         Example:
-            >>> datacube.initialize_var("$c in (AvgLandTemp)")
-        """
-        if not isinstance(s, str):
-            raise TypeError("Value entered must be a string.")
-        # specifying  that s string must be formatted like: '$variable_name in (coverage_name)'
-        if not(s.startswith('$') and " in (" in s and s.endswith(')')):
-            raise ValueError("The format of variable initialization wasn't correct")
-        
-        var_name = self.get_all_var_names(s)[0]
-        self.vars.append(s)
-        #No subset has been defined yet
-        self.Subsets.append(None)
-        self.var_names.append(var_name)
-        return self
-    
-    def do_vars_exist(self, string):
+            >>> scheduler.acquire('batch')
+            0.2
         """
-        Checks whether all variable names extracted from the input string exist in the predefined list of
-        variable names of the current instance. This method is useful for validating that variables
-        referenced in a string (e.g., a query or command) are all recognized by the system
-        before proceeding with further operations.
+        ticket = (self.rank(priority), next(self._counter))
+        start = self.clock()
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            self._queued[priority] += 1
+            while True:
+                timeout = None
+                if self._queue[0] == ticket and (self.max_in_flight == None or self.in_flight < self.max_in_flight):
+                    self._refill()
+                    if self.rate == None or self.tokens >= 1:
+                        break
+                    # the next token comes in this many seconds
+                    timeout = (1 - self.tokens) / self.rate
+                self._condition.wait(timeout)
+            heapq.heappop(self._queue)
+            self._queued[priority] -= 1
+            self._admitted[priority] += 1
+            self.in_flight += 1
+            if self.rate != None:
+                self.tokens -= 1
+            wait = self.clock() - start
+            self._waits[priority].append(wait)
+            # the next request in the queue may be sendable too
+            self._condition.notify_all()
+        return wait
 
-        Parameters:
-            string (str): The string from which variable names are extracted and checked.
-                Variables in the string should be prefixed by '$'.
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
 
-        Returns:
-            bool: True if all extracted variables exist in the instance's variable list.
+    @contextlib.contextmanager
+    def slot(self, priority = 'interactive'):
+        """
+        Waits for the scheduler, then keeps the request counted as in flight until the block ends.
 
-        Raises:
-            ValueError: If no variables are specified in the string, or
-            if one or more variables do not exist in the instance's list of variables.
+        Parameters:
+            priority (str, optional): The priority class of the request.
 
         Example:
-            >>> datacube.do_vars_exist("$temp and $pressure")
-            True
-            >>> datacube.do_vars_exist("$humidity")
-            Traceback (most recent call last):
-            ...
-            ValueError: Variables in a string don't exist
-        """
-        # Normalize the string by replacing common whitespace characters with a space
-        string = string.replace('\n', ' ')
-        string = string.replace('\r', ' ')
-        string = string.replace('\t', ' ')
-        var_names = self.get_all_var_names(string)
-        if var_names != None:
-            var_names = set(var_names)
-            # Convert the list of variable names to a set for efficient comparison
-            if var_names.issubset(set(self.var_names)):
-                return True
-            else:
-                raise ValueError("Variables in a string don't exist")
-        else:
-            raise ValueError("Variables weren't specified")
-        
-        
-    def subset(self, subset, var_name):
+            >>> with scheduler.slot('batch'):
+            ...     response = session.post(url, data = {'query': wcps_query})
         """
-        Adds a subset specification for a specific variable in the datacube object. This method
-            identifies the variable by its name, then associates the specified subset with it, updating
-            the internal state of the dco instance.
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
 
-        Parameters:
-            subset (str): The subset condition to apply, typically specifying a range or filter for the
-                data retrieval.
-            var_name (str): The name of the variable to which the subset will be applied. This variable
-                must already be initialized in the dco instance.
+    # adding the tokens earned since the last refill, the bucket holds at most burst tokens
+    def _refill(self):
+        now = self.clock()
+        if self.rate != None:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def stats(self):
+        """
+        Returns the queue depth and the waits of the requests, per priority class.
 
         Returns:
-            self: Returns the instance itself after updating the subset for the specified variable,
-                allowing for method chaining.
+            dict: in_flight, and for every priority class the number of queued and admitted requests
+                and the median, 99th percentile and longest of the latest waits in seconds.
 
         Example:
-            >>> datacube.subset(var_name = '$c',
-                subset = 'Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")')
+            >>> scheduler.stats()['batch']['queued']
+            12
         """
-        if not isinstance(subset, str):
-            raise TypeError("Value entered must be a string.")
-        if not isinstance(var_name, str):
-            raise TypeError("Value entered must be a string.")
-        if not(var_name in self.var_names):
-            raise ValueError("Such variable doesn't exist")
-        # index of the variable name in the var_names list
-        idx = self.var_names.index(var_name)
-        # Update the subset specification at the corresponding index in the Subsets list
-        self.Subsets[idx] = subset
-        return self
-        
-    def where(self, filter_condition):
+        with self._condition:
+            result = {'in_flight': self.in_flight}
+            for priority in self.priorities:
+                waits = list(self._waits[priority])
+                result[priority] = {'queued': self._queued[priority], 'admitted': self._admitted[priority],
+                                    'wait_p50': percentile(waits, 50), 'wait_p99': percentile(waits, 99),
+                                    'wait_max': max(waits) if waits else None}
+            return result
+
+
+# measurements of one query, filled in while the query runs
+class QueryRecord:
+    # the phases of a query, in the order they run
+    phases = ('build', 'network', 'parse')
+
+    def __init__(self, wcps_query, kind = '', build = 0.0):
+        self.query = wcps_query
+        self.kind = kind
+        # seconds spent building the query, waiting for the response (retries included) and decoding it
+        self.build = build
+        self.network = 0.0
+        self.parse = 0.0
+        self.request_bytes = None
+        self.response_bytes = None
+        self.status = None
+        self.cache_hit = False
+        self.coalesced = False
+        self.attempts = 0
+        self.error = None
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    @property
+    def total(self):
+        return self.build + self.network + self.parse
+
+    def as_dict(self):
+        return {'query': self.query, 'kind': self.kind, 'build': self.build, 'network': self.network,
+                'parse': self.parse, 'total': self.total, 'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes, 'status': self.status, 'cache_hit': self.cache_hit,
+                'coalesced': self.coalesced, 'retries': self.retries, 'error': self.error}
+
+
+# collector of the measurements of the queries of one or more dbc instances
+class QueryMetrics:
+    def __init__(self, hooks = (), history = 1000):
         """
-        Sets a filter condition for the datacube query. This method allows specifying conditions that
-            filter the data according to certain criteria, similar to a SQL WHERE clause. The specified
-            condition will be applied when the query is executed to filter the results.
+        Initializes a collector of query measurements. Every finished query gives a QueryRecord, which is added
+            to the totals and passed to the hooks. A dbc without metrics doesn't measure anything.
 
         Parameters:
-            filter_condition (str): A string representing the condition to be applied to filter the data.
-                This condition should be formatted according to the expected WCPS syntax.
-
-        Returns:
-            self: Returns the instance itself, allowing for method chaining and further configuration.
+            hooks (list, optional): Functions called with the QueryRecord of every finished query.
+            history (int, optional): How many of the latest records are kept for the percentiles.
 
         Example:
-            >>> datacube.where("$c > 20 and $c < 50")
+            >>> metrics = QueryMetrics(hooks = [lambda record: print(record.total)])
+            >>> database_connection = dbc("https://ows.rasdaman.org/rasdaman/ows", metrics = metrics)
         """
-    
-        if not isinstance(filter_condition, str):
-            raise TypeError("Value entered must be a string.")
-        self.do_vars_exist(filter_condition)
-        self.filter_condition = filter_condition
-        return self
-    
+        if not isinstance(history, int) or isinstance(history, bool) or history < 1:
+            raise ValueError("history must be a positive integer.")
+        self.hooks = list(hooks)
+        self.records = deque(maxlen = history)
+        self.queries = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.statuses = {}
+        self.phase_totals = {phase: 0.0 for phase in QueryRecord.phases}
+        self._lock = threading.Lock()
 
-    def set_format(self, output_format):
-        """
-        Sets the output format for data retrieved from the datacube. This method allows the user to specify 
-        the format in which the data should be returned after a query is executed, enabling different
-        types of data processing.
+    def add_hook(self, hook):
+        if not callable(hook):
+            raise TypeError("A hook must be callable.")
+        self.hooks.append(hook)
 
-        Parameters:
-            output_format (str): The format to set for output data. Valid options are "CSV", "PNG", or "JPEG".
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            self.queries += 1
+            self.errors += record.error != None
+            self.cache_hits += record.cache_hit
+            self.coalesced += record.coalesced
+            self.retries += record.retries
+            self.request_bytes += record.request_bytes or 0
+            self.response_bytes += record.response_bytes or 0
+            if record.status != None:
+                self.statuses[record.status] = self.statuses.get(record.status, 0) + 1
+            for phase in QueryRecord.phases:
+                self.phase_totals[phase] += getattr(record, phase)
+        for hook in self.hooks:
+            hook(record)
+
+    def summary(self):
+        """
+        Returns the totals of the measured queries, and the median and 99th percentile of every phase
+            over the latest records.
 
         Returns:
-            self: Returns the instance itself after setting the output format, allowing for method chaining.
+            dict: The counters, the byte totals, the number of responses per status code and the phase timings.
 
         Example:
-            >>> datacube.set_format("PNG")
+            >>> metrics.summary()['phases']['network']['p50']
+            0.042
         """
-        if not isinstance(output_format, str):
-            raise TypeError("Value entered must be a string.")
-        if not (output_format in ['PNG', 'CSV', 'JPEG']):
-            raise ValueError("Entered format doesn't exist")
-        self.format = output_format
-        return self
-    
-        
-    # aggregation methods
-    def min(self, condition = None):
+        with self._lock:
+            records = list(self.records)
+            result = {'queries': self.queries, 'errors': self.errors, 'cache_hits': self.cache_hits,
+                      'coalesced': self.coalesced, 'retries': self.retries, 'request_bytes': self.request_bytes,
+                      'response_bytes': self.response_bytes,
+                      'statuses': {str(status): count for status, count in sorted(self.statuses.items())}}
+            totals = dict(self.phase_totals)
+        result['phases'] = {}
+        for phase in QueryRecord.phases:
+            timings = [getattr(record, phase) for record in records]
+            result['phases'][phase] = {'total': totals[phase], 'p50': percentile(timings, 50),
+                                       'p99': percentile(timings, 99)}
+        return result
+
+    def to_json(self):
         """
-        Configures the datacube to compute the minimum value of the specified data subset when executed.
-            An optional condition can specify the subset or criteria for the aggregation.
+        Exports the summary as a JSON document.
 
-        Parameters:
-            condition (str, optional): A condition that defines the subset of data for
-                which the minimum is calculated.
+        Example:
+            >>> json.loads(metrics.to_json())['queries']
+            12
+        """
+        return json.dumps(self.summary())
 
-        Returns:
-            self: Returns the instance itself, allowing for method chaining.
+    def to_prometheus(self, prefix = 'wdc'):
+        """
+        Exports the summary in the Prometheus text exposition format.
+
+        Parameters:
+            prefix (str, optional): The prefix of the metric names.
 
         Example:
-            >>> datacube.min("$c > 20")
+            >>> print(metrics.to_prometheus())
+            # TYPE wdc_queries_total counter
+            wdc_queries_total 12
+            ...
         """
-        #if condition is provided, check if it's a string and if all the variables are pre-defined
-        if condition != None:
-            if not isinstance(condition, str):
-                raise TypeError("Value entered must be a string.")
-            self.do_vars_exist(condition)
-        self.aggregation_condition = condition
-        self.aggregation = 'MIN'
-        return self
-        
-    def max(self, condition = None):
+        summary = self.summary()
+        lines = []
+        for name in ('queries', 'errors', 'cache_hits', 'coalesced', 'retries', 'request_bytes', 'response_bytes'):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {summary[name]}')
+        lines.append(f'# TYPE {prefix}_responses_total counter')
+        for status, count in summary['statuses'].items():
+            lines.append(f'{prefix}_responses_total{{status="{status}"}} {count}')
+        lines.append(f'# TYPE {prefix}_phase_seconds summary')
+        for phase, timing in summary['phases'].items():
+            for quantile, key in (('0.5', 'p50'), ('0.99', 'p99')):
+                if timing[key] != None:
+                    lines.append(f'{prefix}_phase_seconds{{phase="{phase}",quantile="{quantile}"}} {timing[key]}')
+            lines.append(f'{prefix}_phase_seconds_sum{{phase="{phase}"}} {timing["total"]}')
+            lines.append(f'{prefix}_phase_seconds_count{{phase="{phase}"}} {summary["queries"]}')
+        return '\n'.join(lines) + '\n'
+
+
+# database connection object
+class dbc:
+    # initalizing our dbc by providing it with the service endpoint, from which we can get a datacube
+    def __init__(self, url, pool_connections = 10, pool_maxsize = 10, pool_block = False, keep_alive = True,
+                 cache = None, timeout = (10, 300), retries = 3, backoff = 0.5, max_backoff = 30.0,
+                 breaker = None, coalesce = False, scheduler = None, priority = 'interactive', metrics = None):
         """
-        Configures the datacube to compute the maximum value of the specified data subset when executed.
-            An optional condition can specify the subset or criteria for the aggregation.
+        Initializes a new dbc instance which is used to manage connections and send queries to a WCPS server.
+            The dbc keeps a long-lived HTTP session, so consecutive queries reuse already opened
+            connections instead of paying for a new TCP connection and TLS handshake every time.
 
         Parameters:
-            condition (str, optional): A condition that defines the subset of data for
-                which the minimum is calculated.
-
-        Returns:
-            self: Returns the instance itself, allowing for method chaining.
+            url (str): The endpoint URL of the WCPS server.
+            pool_connections (int, optional): The number of connection pools (one per host) the session caches.
+            pool_maxsize (int, optional): The maximum number of connections kept open to a single host.
+            pool_block (bool, optional): If True, a query waits for a free connection when all pooled
+                connections to the host are in use, instead of opening a connection which isn't kept afterwards.
+            keep_alive (bool, optional): If False, every connection is closed after its response.
+            cache (ResultCache, optional): A cache for the decoded results of the queries run by dco.execute().
+            timeout (float or tuple, optional): Seconds to wait for the connection and for the response,
+                as one number or a (connect, read) tuple. None waits forever.
+            retries (int, optional): How many times a query is sent again after a transient failure:
+                a failed connection, a timeout or the status 429, 502, 503 or 504.
+            backoff (float, optional): The base of the exponential backoff, the n-th retry waits a random
+                time of up to backoff * 2 ** n seconds, but not more than max_backoff.
+            max_backoff (float, optional): The longest wait before a retry.
+            breaker (CircuitBreaker or False, optional): The circuit breaker of the endpoint. By default
+                every dbc has its own with the default settings, False turns it off.
+            coalesce (bool, optional): If True, identical queries sent at the same time by several threads
+                share one request and all get its response. Streamed queries are always sent on their own.
+            scheduler (QueryScheduler, optional): Limits the rate and the concurrency of the requests. It can be
+                shared by several dbc instances, e.g. one for interactive use and one for batch jobs.
+            priority (str, optional): The priority class of the queries of this dbc in the scheduler.
+            metrics (QueryMetrics, optional): Gets the timings, sizes and outcome of every query.
 
         Example:
-            >>> datacube.max("$c > 20")
+            >>> database_connection = dbc("https://ows.rasdaman.org/rasdaman/ows")
+            >>> with dbc("https://ows.rasdaman.org/rasdaman/ows", pool_maxsize = 20) as database_connection:
+            ...     database_connection.send_query("for $c in (AvgLandTemp) return 1")
         """
-        #if condition is provided, check if it's a string and if all the variables are pre-defined
-        if condition != None:
-            if not isinstance(condition, str):
-                raise TypeError("Value entered must be a string.")
-            self.do_vars_exist(condition)
-        self.aggregation_condition = condition
-        self.aggregation = 'MAX'
-        return self
-    
-    def avg(self, condition = None):
+        if not isinstance(url, str):
+            raise TypeError("Value entered must be a string.")
+        for value in (pool_connections, pool_maxsize):
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise TypeError("Pool sizes must be integers.")
+            if value < 1:
+                raise ValueError("Pool sizes must be positive.")
+        if cache != None and not isinstance(cache, ResultCache):
+            raise TypeError("cache must be a ResultCache instance.")
+        if not isinstance(retries, int) or isinstance(retries, bool) or retries < 0:
+            raise ValueError("retries must be a non-negative integer.")
+        if metrics != None and not isinstance(metrics, QueryMetrics):
+            raise TypeError("metrics must be a QueryMetrics instance.")
+        if scheduler != None:
+            if not isinstance(scheduler, QueryScheduler):
+                raise TypeError("scheduler must be a QueryScheduler instance.")
+            scheduler.rank(priority)
+        if breaker == None:
+            breaker = CircuitBreaker()
+        elif breaker != False and not isinstance(breaker, CircuitBreaker):
+            raise TypeError("breaker must be a CircuitBreaker instance or False.")
+        self.server_url = url
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker if breaker != False else None
+        self.coalesce = coalesce
+        self.scheduler = scheduler
+        self.priority = priority
+        self.metrics = metrics
+        # the queries in flight by their normalized text, and how many requests were sent and shared
+        self.flights = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        # the worker threads of the queries awaited by async code, as many as the connections kept open
+        self.pool_maxsize = pool_maxsize
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.session = self._open_session(pool_connections, pool_maxsize, pool_block, keep_alive)
+
+    # the long-lived HTTP session which the queries are sent with
+    def _open_session(self, pool_connections, pool_maxsize, pool_block, keep_alive):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize,
+                              pool_block = pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # 'verify=False' is used to skip SSL certificate verification;
+        session.verify = False
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def send_query(self, wcps_query, stream = False):
         """
-        Configures the datacube to compute the average value of the specified data subset when executed.
-            An optional condition can specify the subset or criteria for the aggregation.
+        Sends a WCPS query to the server and retrieves the response.
 
         Parameters:
-            condition (str, optional): A condition that defines the subset of data for
-                which the minimum is calculated.
+            wcps_query (str): A string containing the WCPS query.
+            stream (bool, optional): If True, only the headers are read and the body is left to be read in
+                chunks, e.g. with response.iter_content(). The response must be closed afterwards.
 
         Returns:
-            self: Returns the instance itself, allowing for method chaining.
+            Response: A response object from the requests library containing the server's response to the query.
+
+        Raises:
+            WCPSQueryError: If the server rejected the query (4xx).
+            WCPSServerError: If the server failed (5xx) on every attempt.
+            WCPSConnectionError: If the connection failed or timed out on every attempt.
+            CircuitOpenError: If the endpoint failed too often recently and the query wasn't sent.
 
         Example:
-            >>> datacube.avg("$c > 20")
+            >>> result = database_connection.send_query("for c in (AvgLandTemp) return encode(c, 'csv')")
         """
-        #if condition is provided, check if it's a string and if all the variables are pre-defined
-        if condition != None:
-            if not isinstance(condition, str):
-                raise TypeError("Value entered must be a string.")
-            self.do_vars_exist(condition)
-        self.aggregation_condition = condition
-        self.aggregation = 'AVG'
-        return self
-    
-    def sum(self, condition = None):
+        if not isinstance(wcps_query, str):
+            raise TypeError("Value entered must be a string.")
+        if self.metrics == None:
+            return self._dispatch(wcps_query, stream, None)
+        record = QueryRecord(wcps_query)
+        try:
+            return self._fetch(wcps_query, stream, record)
+        finally:
+            self.metrics.add(record)
+
+    # sending a query and filling its record in, if the queries are measured
+    def _fetch(self, wcps_query, stream, record):
+        if record == None:
+            return self._dispatch(wcps_query, stream, None)
+        start = time.perf_counter()
+        try:
+            response = self._dispatch(wcps_query, stream, record)
+        except Exception as error:
+            record.error = type(error).__name__
+            record.status = getattr(error, 'status_code', None)
+            raise
+        finally:
+            record.network = time.perf_counter() - start
+        record.status = response.status_code
+        body = response.request.body if response.request != None else None
+        record.request_bytes = len(body) if body else 0
+        # the body of a streamed response isn't read yet
+        if not stream:
+            record.response_bytes = len(response.content)
+        return response
+
+    def _dispatch(self, wcps_query, stream, record):
+        # a streamed body can only be read once, so it can't be shared
+        if self.coalesce and not stream:
+            return self._send_coalesced(wcps_query, record)
+        return self._send(wcps_query, stream, record)
+
+    # sending a query once per group of identical queries in flight, the other callers wait for its outcome
+    def _send_coalesced(self, wcps_query, record):
+        key = normalize_query(wcps_query)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight == None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.flights += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            if record != None:
+                record.coalesced = True
+            flight.done.wait()
+            if flight.error != None:
+                raise _shared_error(flight.error)
+            return flight.response
+        try:
+            flight.response = self._send(wcps_query, False, record)
+            return flight.response
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            # the queries sent after this one finished get a fresh response
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    # sending a query with the retries after transient failures
+    def _send(self, wcps_query, stream, record):
+        attempt = 0
+        while True:
+            with self._slot():
+                outcome = self._send_once(wcps_query, stream)
+            if record != None:
+                record.attempts += 1
+            if not isinstance(outcome, WCPSError):
+                return outcome
+            error = outcome
+            # WCPS queries only read data, so every transient failure can be retried
+            if not error.retryable or attempt >= self.retries:
+                raise error
+            time.sleep(self.backoff_delay(attempt, error.retry_after))
+            attempt += 1
+
+    # waiting for the scheduler before a request, every attempt takes its own slot
+    def _slot(self):
+        if self.scheduler == None:
+            return contextlib.nullcontext()
+        return self.scheduler.slot(self.priority)
+
+    # sending a query once, the response is returned and an error is returned instead of raised
+    def _send_once(self, wcps_query, stream):
+        trial = self.breaker.allow() if self.breaker != None else False
+        try:
+            # getting a response from the server
+            try:
+                # the pooled session reuses an open connection to the server if there is one
+                response = self.session.post(self.server_url, data = {'query': wcps_query}, stream = stream,
+                                             timeout = self.timeout)
+            except requests.exceptions.Timeout as cause:
+                error = WCPSTimeoutError(f"The server didn't answer in time: {cause}")
+            except requests.exceptions.RequestException as cause:
+                error = WCPSConnectionError(f"The connection to the server failed: {cause}")
+            else:
+                if response.status_code == 200:
+                    if self.breaker != None:
+                        self.breaker.record_success()
+                    return response
+                error = error_from_response(response)
+                # an unread streamed response would keep its connection out of the pool
+                response.close()
+            if self.breaker != None:
+                # a rejected query means the server itself works
+                if isinstance(error, WCPSQueryError) and not error.retryable:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+            return error
+        except BaseException:
+            # any other exception, e.g. of a hook, must still end the trial, or the circuit would stay half-open
+            if trial:
+                self.breaker.end_trial()
+            raise
+
+    # how long to wait before the next attempt
+    def backoff_delay(self, attempt, retry_after = None):
         """
-        Configures the datacube to compute the sum of values across the specified data subset when executed.
-            An optional condition can specify the subset or criteria for the aggregation.
+        Computes the wait before a retry, a random time of up to backoff * 2 ** attempt seconds ("full jitter"),
+            so the clients which failed together don't retry together. If the server asked for a wait, it's respected.
 
         Parameters:
-            condition (str, optional): A condition that defines the subset of data for
-                which the minimum is calculated.
+            attempt (int): The number of the retry, starting at 0.
+            retry_after (float, optional): The seconds the server asked to wait.
 
         Returns:
-            self: Returns the instance itself, allowing for method chaining.
+            float: The seconds to wait.
 
         Example:
-            >>> datacube.sum("$c > 20")
+            >>> database_connection.backoff_delay(2)
+            1.37
         """
-        #if condition is provided, check if it's a string and if all the variables are pre-defined
-        if condition != None:
-            if not isinstance(condition, str):
-                raise TypeError("Value entered must be a string.")
-            self.do_vars_exist(condition)
-        self.aggregation_condition = condition
-        self.aggregation = 'SUM'
-        return self
-        
-    def count(self, condition = None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after != None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    # sending a query and decoding its response, the decoded result is looked up in the cache first
+    def run_query(self, wcps_query, decode = None, kind = '', _record = None):
         """
-        Configures the datacube to count the number of data points that meet the specified
-            condition when executed.
+        Sends a WCPS query and decodes the response. If the dbc has a cache, the decoded result is
+            looked up there first and stored there afterwards, so a hit skips both the request and the decoding.
 
         Parameters:
-            condition (str, optional): A condition that specifies the criteria that data
-                points must meet to be counted.
+            wcps_query (str): A string containing the WCPS query.
+            decode (callable, optional): A function which turns the content of the response into the result.
+                Without it the response object is returned and nothing is cached.
+            kind (str, optional): Describes how the result is decoded. Queries decoded differently are cached apart.
 
         Returns:
-            self: Returns the instance itself, allowing for method chaining.
+            Varies: The decoded result, or the response object if no decode function was given.
 
         Example:
-            >>> datacube.count("$c > 20")
-        """
-        #if condition is provided, check if it's a string and if all the variables are pre-defined
-        if condition != None:
-            if not isinstance(condition, str):
-                raise TypeError("Value entered must be a string.")
-            self.do_vars_exist(condition)
-        self.aggregation = 'COUNT'
-        self.aggregation_condition = condition
-        return self
-    
-    def replace_variables_with_subsets(self, str_to_transform = None):
+            >>> database_connection.run_query("for $c in (AvgLandTemp) return 1", byte_to_list, 'CSV')
+            [1.0]
         """
-        Replaces variables in a given string with their corresponding subsets if defined.
-            If no string is provided, it constructs a string representation of
-            all variables and their subsets.
+        if decode == None:
+            return self.send_query(wcps_query)
+        if self.metrics == None:
+            return self._run(wcps_query, decode, kind, None)
+        # dco.execute() passes the record in with the time it took to build the query
+        record = _record if _record != None else QueryRecord(wcps_query, kind)
+        try:
+            return self._run(wcps_query, decode, kind, record)
+        except Exception as error:
+            record.error = record.error or type(error).__name__
+            raise
+        finally:
+            self.metrics.add(record)
 
-        Parameters:
-            str_to_transform (str, optional):
-                A string containing variable names that need to be replaced with their subsets.
+    def _run(self, wcps_query, decode, kind, record):
+        key = None
+        if self.cache != None:
+            key = self.cache.make_key(self.server_url, wcps_query, kind)
+            found, data = self.cache.lookup(key)
+            if found:
+                if record != None:
+                    record.cache_hit = True
+                return data
+        content = self._fetch(wcps_query, False, record).content
+        if record == None:
+            data = decode(content)
+        else:
+            start = time.perf_counter()
+            data = decode(content)
+            record.parse = time.perf_counter() - start
+        if key != None:
+            self.cache.store(key, data)
+        return data
+
+
+    async def run_query_async(self, wcps_query, decode = None, kind = ''):
+        """
+        Runs a query like run_query() without blocking the event loop. The query is sent by one of pool_maxsize
+            worker threads of the dbc, so no more queries are in flight at once than it keeps connections open.
 
         Returns:
-            str: A new string with variables replaced by their subsets,
-                or a concatenated string of all variables and subsets.
+            Varies: The decoded result, or the response object if no decode function was given.
 
         Example:
-            >>> datacube.replace_variables_with_subsets("abs($c - 200)")
-            >>> "abs($c[corresponding_subset] - 200)"
+            >>> data = await database_connection.run_query_async("for $c in (AvgLandTemp) return 1", byte_to_list)
         """
-        #This distinction is critical as it determines the course of action
-        #code will either modifying an existing string or creating a new list of all variables and their subsets.
-        if str_to_transform != None:
-            expression = str_to_transform
-            #iterate over tuples of variables and corresponding subsets
-            for var, subset in zip(self.var_names, self.Subsets):
-                if subset != None:
-                    #replace the variable in the expression with its subset
-                    expression = expression.replace(var, f'{var}[{subset}]')
-            return expression
-        else:
-            expression = ''
-            for var, subset in zip(self.var_names, self.Subsets):
-                if subset != None:
-                    # If a subset exists, append the variable and its subset in bracketed form
-                    expression += f'''{var}[{subset}] '''
-                else:
-                    #If no subset exists, simply append the variable
-                    expression += f'''{var}'''
-            return expression
-    
-    def transform_data(self, operation):
+        with self._executor_lock:
+            if self._executor == None:
+                self._executor = ThreadPoolExecutor(max_workers = self.pool_maxsize, thread_name_prefix = 'wdc-async')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.run_query, wcps_query, decode, kind)
+
+    # running a list of queries on a thread pool
+    def execute_many(self, queries, max_workers = 8, verbose = False, processes = None):
         """
-        Sets a transformation operation to be applied to the datacube when the query is executed.
+        Runs many queries in parallel on a thread pool and returns their results in the input order.
+            A failing query doesn't stop the batch, its exception is kept in the errors of the result.
+            The queries are only read, so the same dco can be passed several times and isn't reset afterwards.
 
         Parameters:
-            operation (str): A string representing the transformation operation to be applied.
+            queries (list): dco instances, or WCPS query strings whose responses are returned undecoded.
+                Every query is sent through this dbc, whichever dbc a dco was created with.
+            max_workers (int, optional): The number of queries sent at the same time. It shouldn't be larger
+                than pool_maxsize, otherwise the extra connections are closed after every query.
+            verbose (bool, optional): If True, the throughput and latency figures are printed.
+            processes (int, optional): If given, the PNG and JPEG results of dco instances with as_array() are
+                decoded on a pool of this many processes after they were fetched, instead of in the threads.
+                The latencies then only cover the fetching.
 
         Returns:
-            self: Returns the instance itself, allowing for method chaining.
+            BatchResult: A list of the results in the input order, None in place of the failed queries.
 
         Example:
-            >>> datacube.transform_data("abs($c - 3.6 * $c)")
-        """
-        if not isinstance(operation, str):
-            raise TypeError("Value entered must be a string.")
-        self.do_vars_exist(operation)
-        self.transformation = operation
-        return self
-    
-    def encode(self, operation):
+            >>> results = database_connection.execute_many(monthly_queries, max_workers = 8, verbose = True)
+            >>> results.errors
+            {}
         """
-        Specifies the encoding operation to be applied to the output of the query.
+        if not isinstance(max_workers, int) or isinstance(max_workers, bool):
+            raise TypeError("max_workers must be an integer.")
+        if max_workers < 1:
+            raise ValueError("max_workers must be positive.")
+        # the queries are built in the calling thread, so the workers only send them and decode the responses
+        jobs = []
+        # the images decoded on the process pool, by their position in the batch
+        images = {}
+        for query in queries:
+            if isinstance(query, dco):
+                if processes != None and query.format in ('PNG', 'JPEG') and query.array_dtype != None:
+                    # the raw image is fetched and cached like a result without as_array()
+                    images[len(jobs)] = query.array_dtype
+                    jobs.append((query.to_wcps_query(), bytes, query.format))
+                else:
+                    jobs.append((query.to_wcps_query(), query.decode_response, query.result_kind()))
+            elif isinstance(query, str):
+                jobs.append((query, None, ''))
+            else:
+                raise TypeError("Queries must be dco instances or strings.")
 
-        Parameters:
-            operation (str): A string representing the encoding function, such as "encode".
+        def run(job):
+            start = time.perf_counter()
+            try:
+                data = self.run_query(*job)
+                return data, None, time.perf_counter() - start
+            except Exception as error:
+                return None, error, time.perf_counter() - start
 
-        Returns:
-            self: Returns the instance itself, allowing for method chaining.
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'wdc-batch') as executor:
+            outcomes = list(executor.map(run, jobs))
+        fetched = [index for index in images if outcomes[index][1] == None]
+        for dtype in set(images[index] for index in fetched):
+            indexes = [index for index in fetched if images[index] == dtype]
+            arrays = decode_images([outcomes[index][0] for index in indexes], dtype, processes,
+                                   return_exceptions = True)
+            for index, array in zip(indexes, arrays):
+                latency = outcomes[index][2]
+                if isinstance(array, Exception):
+                    outcomes[index] = (None, array, latency)
+                else:
+                    outcomes[index] = (array, None, latency)
+        results = BatchResult(outcomes, time.perf_counter() - start)
+        if verbose:
+            print(results.summary())
+        return results
+
+    def close(self):
+        """
+        Closes the session of the dbc and releases all the pooled connections, after the queries
+            run by run_query_async() are done.
 
         Example:
-            >>> datacube.encode("
-                switch 
-                    case $c = 99999 
-                        return {red: 255; green: 255; blue: 255} 
-                    case 18 > $c
-                        return {red: 0; green: 0; blue: 255} 
-                    case 23 > $c
-                        return {red: 255; green: 255; blue: 0} 
-                    case 30 > $c
-                        return {red: 255; green: 140; blue: 0} 
-                    default return {red: 255; green: 0; blue: 0}
-            ")
+            >>> database_connection.close()
         """
-        # Ensure the operation is a string, convert if not
-        if not isinstance(operation, str):
-            operation = str(operation)
-        # Ensure all variables used in the operation are recognized by the datacube    
-        if self.get_all_var_names(operation) != None:
-            self.do_vars_exist(operation)
-        self.encode_as = operation
+        with self._executor_lock:
+            if self._executor != None:
+                self._executor.shutdown(wait = True)
+                self._executor = None
+        if self.session != None:
+            self.session.close()
+
+    def __enter__(self):
         return self
-        
-            
-    # method, which returns the result after using aggregation functions
-    def aggregate_data(self):
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# the error of a shared request for one more caller, a copy so the tracebacks of the callers aren't mixed together
+def _shared_error(error):
+    try:
+        shared = copy.copy(error)
+    except Exception:
+        return error
+    shared.__cause__ = error
+    return shared
+
+
+# an identical query in flight, shared by the callers which sent it at the same time
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+# one server of a DbcPool, with the figures the pool routes by
+class _Endpoint:
+    def __init__(self, connection):
+        self.connection = connection
+        self.in_flight = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def state(self):
+        return self.connection.breaker.state
+
+
+# database connection object spread over several replicas of the same WCPS server
+class DbcPool(dbc):
+    # weight of the newest response time in the moving average of an endpoint's latency
+    latency_weight = 0.2
+
+    def __init__(self, urls, strategy = 'least_loaded', cache = None, retries = 3, backoff = 0.5, max_backoff = 30.0,
+                 failure_threshold = 3, reset_timeout = 30.0, health_interval = None, coalesce = False,
+                 scheduler = None, priority = 'interactive', metrics = None, **options):
         """
-        Constructs a part of the WCPS query for performing aggregation functions based on the current settings.
+        Initializes a pool of connections to several endpoints which serve the same coverages. Every query
+            goes to the healthiest, least busy endpoint, and when an endpoint fails the query is sent to another one.
+            An endpoint which keeps failing is taken out of the rotation by its circuit breaker and comes back
+            after a successful trial query or health check. The pool can be used everywhere a dbc can.
 
-        Returns:
-            str: A string representing the aggregation part of the WCPS query.
+        Parameters:
+            urls (list): The endpoint URLs of the replicas.
+            strategy (str, optional): 'least_loaded' sends a query to the endpoint with the fewest queries in flight,
+                'lowest_latency' to the one with the lowest average response time.
+            cache (ResultCache, optional): A cache for the decoded results, shared by all the endpoints.
+            retries (int, optional): How many times a query is sent again after a transient failure,
+                each time to another endpoint if there is one left.
+            backoff (float, optional): The base of the exponential backoff once every endpoint was tried.
+            max_backoff (float, optional): The longest wait before a retry.
+            failure_threshold (int, optional): The consecutive failures which take an endpoint out of the rotation.
+            reset_timeout (float, optional): The seconds an endpoint stays out before a trial query is sent to it.
+            health_interval (float, optional): If given, every endpoint is checked in the background this often.
+            coalesce (bool, optional): If True, identical queries sent at the same time share one request.
+            scheduler (QueryScheduler, optional): Limits the rate and the concurrency of the requests of the pool.
+            priority (str, optional): The priority class of the queries of the pool in the scheduler.
+            metrics (QueryMetrics, optional): Gets the timings, sizes and outcome of every query of the pool.
+            **options: Further settings of the dbc of every endpoint, e.g. timeout or pool_maxsize.
 
         Example:
-            >>> query_part = datacube.aggregate_data()
+            >>> pool = DbcPool(["https://a.example.org/rasdaman/ows", "https://b.example.org/rasdaman/ows"])
+            >>> datacube = dco(pool)
         """
+        if isinstance(urls, str) or not urls:
+            raise ValueError("urls must be a non-empty list of endpoint URLs.")
+        if not all(isinstance(url, str) for url in urls):
+            raise TypeError("Value entered must be a string.")
+        if strategy not in ('least_loaded', 'lowest_latency'):
+            raise ValueError("strategy must be 'least_loaded' or 'lowest_latency'.")
+        if health_interval != None and health_interval <= 0:
+            raise ValueError("health_interval must be positive.")
+        urls = list(urls)
+        # the replicas serve the same data, so the cached results are shared under one name
+        super().__init__(urls[0], cache = cache, retries = retries,
+                         backoff = backoff, max_backoff = max_backoff, breaker = False, coalesce = coalesce,
+                         scheduler = scheduler, priority = priority, metrics = metrics)
+        self.server_url = 'pool:' + ','.join(sorted(urls))
+        self.urls = urls
+        self.strategy = strategy
+        # the retries and the backoff are done by the pool, so every endpoint sends a query once
+        self.endpoints = []
+        try:
+            for url in urls:
+                breaker = CircuitBreaker(failure_threshold, reset_timeout)
+                self.endpoints.append(_Endpoint(dbc(url, retries = 0, breaker = breaker, **options)))
+        except BaseException:
+            # the sessions of the endpoints created so far would keep their connections otherwise
+            for endpoint in self.endpoints:
+                endpoint.connection.close()
+            raise
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_interval != None:
+            self._health_thread = threading.Thread(target = self._check_periodically, args = (health_interval,),
+                                                   name = 'wdc-health', daemon = True)
+            self._health_thread.start()
 
-        # The `helper_query` contains the conditions and/or
-        # subsets that have been applied to the variables in the datacube.
-        # helper_query will betargeted specifically for preforming aggregation functions later on
-        helper_query = self.replace_variables_with_subsets(self.aggregation_condition)
-        if self.aggregation == 'MIN':
-            query = f'''min({helper_query})'''
-        elif self.aggregation == 'AVG':
-            query = f'''avg({helper_query})'''
-        elif self.aggregation == 'MAX':
-            query = f'''max({helper_query})'''
-        elif self.aggregation == 'SUM':
-            query = f'''sum({helper_query})'''
-        elif self.aggregation == 'COUNT':
-            query = f'''count({helper_query})'''
-        return query
-    
-    def return_format(self):
+    # the endpoints send the queries with their own sessions
+    def _open_session(self, pool_connections, pool_maxsize, pool_block, keep_alive):
+        return None
+
+    # sending a query to the endpoints in turn until one answers or the retries run out
+    def _send(self, wcps_query, stream, record):
+        attempt = 0
+        tried = set()
+        while True:
+            # the endpoint is picked after the wait in the scheduler, so the wait doesn't count as its latency
+            with self._slot():
+                endpoint, outcome = self._send_to_endpoint(wcps_query, stream, tried)
+            if record != None:
+                record.attempts += 1
+            if not isinstance(outcome, WCPSError):
+                return outcome
+            error = outcome
+            with self._lock:
+                endpoint.failures += 1
+            if not error.retryable or attempt >= self.retries:
+                raise error
+            tried.add(endpoint)
+            if len(tried) >= len(self.endpoints):
+                # every endpoint failed once, so the next round waits like a single dbc does
+                time.sleep(self.backoff_delay(attempt, error.retry_after))
+                tried.clear()
+            attempt += 1
+
+    # sending a query once, to the first endpoint picked whose circuit breaker lets it through
+    def _send_to_endpoint(self, wcps_query, stream, tried):
+        # the endpoints which turned the query away, because another query took their trial slot in the meantime
+        rejected = set()
+        while True:
+            endpoint = self._acquire(tried, rejected)
+            start = time.perf_counter()
+            try:
+                outcome = endpoint.connection._send_once(wcps_query, stream)
+            except CircuitOpenError:
+                # the query wasn't sent, so it neither counts as a failure nor uses up a retry
+                self._release(endpoint, sent = False)
+                rejected.add(endpoint)
+                continue
+            except BaseException:
+                self._release(endpoint)
+                raise
+            # an endpoint which fails fast mustn't look like the fastest one
+            latency = time.perf_counter() - start if not isinstance(outcome, WCPSError) else None
+            self._release(endpoint, latency = latency)
+            return endpoint, outcome
+
+    # picking the endpoint of the next query and counting the query as in flight
+    def _acquire(self, tried, rejected = ()):
+        with self._lock:
+            available = [endpoint for endpoint in self.endpoints
+                         if endpoint not in rejected and endpoint.state != 'open']
+            candidates = [endpoint for endpoint in available if endpoint not in tried] or available
+            if not candidates:
+                raise CircuitOpenError("Every endpoint of the pool is out of the rotation")
+            # an endpoint which never answered is tried first, so its latency gets known, unless it only failed
+            if self.strategy == 'least_loaded':
+                endpoint = min(candidates, key = lambda e: (e.in_flight, self._expected_latency(e)))
+            else:
+                endpoint = min(candidates, key = lambda e: (self._expected_latency(e), e.in_flight))
+            endpoint.in_flight += 1
+            return endpoint
+
+    @staticmethod
+    def _expected_latency(endpoint):
+        if endpoint.latency != None:
+            return endpoint.latency
+        return math.inf if endpoint.failures else 0.0
+
+    # counting the query as done, the latency is only that of a successful response
+    def _release(self, endpoint, sent = True, latency = None):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if sent:
+                endpoint.requests += 1
+            if latency == None:
+                return
+            if endpoint.latency == None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.latency_weight * (latency - endpoint.latency)
+
+    def check_health(self):
         """
-        Determines the format for the output based on the configured settings of the datacube.
+        Sends a GetCapabilities request to every endpoint. An endpoint which answers is put back into
+            the rotation, one which doesn't is taken out of it.
 
         Returns:
-            str: A string indicating the desired output format for the WCPS query.
+            dict: Whether every endpoint URL answered.
 
         Example:
-            >>> output_format = datacube.return_format()
+            >>> pool.check_health()
+            {'https://a.example.org/rasdaman/ows': True, 'https://b.example.org/rasdaman/ows': False}
         """
-        if self.format == 'CSV':
-            query = "text/csv" # if the desired format of the output is text/csv
-        elif self.format == 'PNG':
-            query = "image/png" # if the desired format of the output is image/png:
-        elif self.format == 'JPEG': 
-            query = "image/jpeg" # if the desired format of the output is image/jpeg:
-        return query
-    
-    
-    # the function, which converts operations from the dco object to the query
-    def to_wcps_query(self):
+        health = {}
+        for endpoint in self.endpoints:
+            connection = endpoint.connection
+            try:
+                response = connection.session.get(connection.server_url, timeout = connection.timeout,
+                                                  params = {'service': 'WCS', 'version': '2.0.1',
+                                                            'request': 'GetCapabilities'})
+                response.close()
+                healthy = response.status_code == 200
+            except requests.exceptions.RequestException:
+                healthy = False
+            if healthy:
+                connection.breaker.record_success()
+            else:
+                connection.breaker.trip()
+            health[connection.server_url] = healthy
+        return health
+
+    def _check_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.check_health()
+
+    def stats(self):
         """
-        Constructs a WCPS query string from the current state of the dco instance.
+        Returns the routing figures of every endpoint.
 
         Returns:
-            str: A string that represents the complete WCPS query based on the current state of the
-                dco instance
+            list: A dict per endpoint with its url, state, in_flight, latency, requests and failures.
 
         Example:
-            >>> query = datacube.to_wcps_query()
+            >>> pool.stats()[0]['state']
+            'closed'
         """
-        query = '''for '''
+        with self._lock:
+            return [{'url': endpoint.connection.server_url, 'state': endpoint.state, 'in_flight': endpoint.in_flight,
+                     'latency': endpoint.latency, 'requests': endpoint.requests, 'failures': endpoint.failures}
+                    for endpoint in self.endpoints]
+
+    def close(self):
+        """
+        Stops the health checks and closes the sessions of all the endpoints.
+
+        Example:
+            >>> pool.close()
+        """
+        self._stop.set()
+        if self._health_thread != None:
+            self._health_thread.join()
+        for endpoint in self.endpoints:
+            endpoint.connection.close()
+        super().close()
+
+
+
+
+# approximate number of bytes a decoded result takes in memory
+def result_size(data):
+    """
+    Estimates how many bytes a decoded result takes in memory, which is what the cache is bounded by.
+
+    Parameters:
+        data: A decoded result, e.g. bytes or a list of floats.
+
+    Returns:
+        int: The estimated size in bytes.
+
+    Example:
+        >>> result_size(b'12345')
+        5
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, list):
+        # every float of the list is a separate object
+        return sys.getsizeof(data) + sum(sys.getsizeof(item) for item in data)
+    if hasattr(data, 'nbytes'):
+        return int(data.nbytes)
+    return sys.getsizeof(data)
+
+
+# a string in double or single quotes, one which isn't closed runs to the end of the query
+_QUOTED = re.compile(r'("[^"]*(?:"|\Z)|\'[^\']*(?:\'|\Z))')
+
+
+# the collapsed form of a query, so that the same query written with different whitespace has the same key
+def normalize_query(wcps_query):
+    """
+    Collapses the whitespace of a WCPS query outside the quoted strings, in double or single quotes.
+
+    Parameters:
+        wcps_query (str): A string containing the WCPS query.
+
+    Returns:
+        str: The query with every run of whitespace outside quotes replaced by a single space.
+
+    Example:
+        >>> normalize_query('for $c in (AvgLandTemp)\nreturn   1')
+        'for $c in (AvgLandTemp) return 1'
+    """
+    parts = _QUOTED.split(wcps_query)
+    # the even parts are outside the quotes
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i])
+    return ''.join(parts).strip()
+
+
+# content-addressed cache of decoded query results
+class ResultCache:
+    def __init__(self, max_bytes = 64 * 1024 * 1024, ttl = None, directory = None):
+        """
+        Initializes a cache of decoded query results. The results are kept in memory in least recently
+            used order, bounded by their total size, and optionally also written to a directory, which
+            keeps them between runs. Results are addressed by a hash of the endpoint and the normalized query.
+
+        Parameters:
+            max_bytes (int, optional): The maximum total size of the results kept in memory.
+            ttl (float, optional): The default number of seconds a result stays valid. None means forever.
+            directory (str, optional): A directory for the on-disk tier. Without it, results are only kept in memory.
+
+        Example:
+            >>> cache = ResultCache(max_bytes = 256 * 1024 * 1024, ttl = 600, directory = '/tmp/wdc-cache')
+            >>> database_connection = dbc("https://ows.rasdaman.org/rasdaman/ows", cache = cache)
+        """
+        if not isinstance(max_bytes, int) or isinstance(max_bytes, bool):
+            raise TypeError("max_bytes must be an integer.")
+        if max_bytes < 0:
+            raise ValueError("max_bytes can't be negative.")
+        if ttl != None and ttl <= 0:
+            raise ValueError("ttl must be positive.")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        if directory != None:
+            os.makedirs(directory, exist_ok = True)
+        # key -> (expiry time or None, size, result), the least recently used entry comes first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(url, wcps_query, kind = ''):
+        """
+        Computes the key of a query result.
+
+        Parameters:
+            url (str): The endpoint URL of the WCPS server.
+            wcps_query (str): A string containing the WCPS query.
+            kind (str, optional): Describes how the result was decoded.
+
+        Returns:
+            str: A hex digest addressing the result.
+
+        Example:
+            >>> key = ResultCache.make_key(database_connection.server_url, query, 'CSV')
+        """
+        text = '\0'.join((url, normalize_query(wcps_query), kind))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        """
+        Looks a result up, first in memory and then on disk.
+
+        Parameters:
+            key (str): The key computed by make_key().
+
+        Returns:
+            tuple: (True, result) if a valid result was found, otherwise (False, None).
+
+        Example:
+            >>> found, data = cache.lookup(key)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None:
+                expires, _, data = entry
+                if expires == None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, copy_result(data)
+                self._remove(key)
+                self.expirations += 1
+        if self.directory != None:
+            found, expires, data = self._read_disk(key, now)
+            if found:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(key, expires, data)
+                return True, copy_result(data)
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def store(self, key, data, ttl = None):
+        """
+        Stores a result in memory and, if there is a directory, on disk.
+
+        Parameters:
+            key (str): The key computed by make_key().
+            data: The decoded result.
+            ttl (float, optional): Seconds the result stays valid, instead of the default ttl of the cache.
+
+        Example:
+            >>> cache.store(key, [1.0, 2.0], ttl = 60)
+        """
+        ttl = self.ttl if ttl == None else ttl
+        expires = None if ttl == None else time.time() + ttl
+        data = copy_result(data)
+        with self._lock:
+            self._insert(key, expires, data)
+        if self.directory != None:
+            self._write_disk(key, expires, data)
+
+    def clear(self):
+        """
+        Removes all the results from memory and from the directory.
+
+        Example:
+            >>> cache.clear()
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.directory != None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.wdc'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The numbers of hits, disk hits, misses, evictions and expirations,
+                and the entries and bytes in memory.
+
+        Example:
+            >>> cache.stats()['hits']
+            12
+        """
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+    # the following methods must be called with the lock held
+    def _insert(self, key, expires, data):
+        size = result_size(data)
+        if key in self._entries:
+            self._remove(key)
+        # a result larger than the whole memory tier is only kept on disk
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires, size, data)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.wdc')
+
+    def _read_disk(self, key, now):
+        try:
+            with open(self._path(key), 'rb') as file:
+                content = file.read()
+        except OSError:
+            return False, None, None
+        try:
+            expires, data = _load_entry(content)
+        except Exception:
+            # an entry which can't be read, e.g. a truncated one or one of an older version, is a miss
+            self._discard(key)
+            return False, None, None
+        if expires != None and expires <= now:
+            with self._lock:
+                self.expirations += 1
+            self._discard(key)
+            return False, None, None
+        return True, expires, data
+
+    def _discard(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _write_disk(self, key, expires, data):
+        parts = _dump_entry(expires, data)
+        # a result which can't be written without pickling is only kept in memory
+        if parts == None:
+            return
+        # written to a temporary file first, so a reader never sees a half written entry
+        descriptor, temporary = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        with os.fdopen(descriptor, 'wb') as file:
+            for part in parts:
+                file.write(part)
+        os.replace(temporary, self._path(key))
+
+
+# an entry of the disk tier of the ResultCache is a JSON header line followed by the raw bytes of the result,
+# so reading a cache directory which others can write to never runs their code the way unpickling would
+def _dump_entry(expires, data):
+    header = {'expires': expires}
+    if isinstance(data, (bytes, bytearray)):
+        header['type'] = 'bytes'
+        return [json.dumps(header).encode() + b'\n', bytes(data)]
+    if isinstance(data, list) and all(type(value) == float for value in data):
+        header['type'] = 'list'
+        return [json.dumps(header).encode() + b'\n', struct.pack(f'<{len(data)}d', *data)]
+    arrays = data if isinstance(data, dict) else {None: data}
+    if np != None and arrays and all(isinstance(array, np.ndarray) and array.dtype.kind in 'biufcS'
+                                     for array in arrays.values()):
+        header['type'] = 'arrays' if isinstance(data, dict) else 'array'
+        header['arrays'] = [{'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                            for name, array in arrays.items()]
+        return [json.dumps(header).encode() + b'\n'] + [np.ascontiguousarray(array).tobytes()
+                                                        for array in arrays.values()]
+    try:
+        header['type'] = 'json'
+        header['value'] = data
+        return [json.dumps(header).encode() + b'\n']
+    except (TypeError, ValueError):
+        return None
+
+
+def _load_entry(content):
+    end = content.index(b'\n')
+    header = json.loads(content[:end])
+    body = memoryview(content)[end + 1:]
+    kind = header['type']
+    if kind == 'bytes':
+        return header['expires'], bytes(body)
+    if kind == 'list':
+        return header['expires'], list(struct.unpack(f'<{len(body) // 8}d', body))
+    if kind == 'json':
+        return header['expires'], header['value']
+    if kind not in ('array', 'arrays'):
+        raise ValueError(f"Unknown entry type {kind}")
+    arrays, offset = {}, 0
+    for described in header['arrays']:
+        dtype = np.dtype(described['dtype'])
+        count = math.prod(described['shape'])
+        arrays[described['name']] = np.frombuffer(body, dtype = dtype, count = count,
+                                                  offset = offset).reshape(described['shape'])
+        offset += count * dtype.itemsize
+    if offset != len(body):
+        raise ValueError("The entry has a different size than its header describes")
+    return header['expires'], arrays if kind == 'arrays' else arrays[None]
+
+
+# on-disk store of large results, which are opened as memory-mapped arrays instead of being read
+class ResultStore:
+    # the files of the stored results by format, the other formats are stored as .npy files
+    suffixes = {'GTiff': '.tif', 'netCDF': '.nc'}
+
+    def __init__(self, directory):
+        """
+        Initializes a store of decoded results in a directory. Every result is kept in an array file, .npy
+            for CSV, PNG and JPEG results and the file itself for GTiff and netCDF results, with a JSON file
+            describing it. Opening a stored result only maps its file into memory, so it takes the same
+            time for any size and only the parts which are used are read from the disk.
+
+        Parameters:
+            directory (str): The directory of the files, it's created if it doesn't exist.
+
+        Example:
+            >>> store = ResultStore("results")
+            >>> temperature = datacube.set_format("CSV").execute_stored(store)
+            >>> temperature[:, 100:200].mean()
+        """
+        if not isinstance(directory, (str, os.PathLike)):
+            raise TypeError("directory must be a path.")
+        if np == None:
+            raise ImportError("numpy is needed for array results.")
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+
+    # the key of a query, the same as in the ResultCache
+    make_key = staticmethod(ResultCache.make_key)
+
+    def info(self, key):
+        """
+        Returns the description of a stored result, or None if it isn't stored.
+
+        Returns:
+            dict: The query, url, kind, format, file, dtype, shape, bytes and creation time of the result.
+
+        Example:
+            >>> store.info(key)['shape']
+            [180, 360]
+        """
+        try:
+            with open(self._path(key, '.json')) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def open(self, key):
+        """
+        Opens a stored result without reading it.
+
+        Parameters:
+            key (str): The key of the result, see make_key().
+
+        Returns:
+            numpy.memmap or dict: The result backed by its file, a dict of arrays for netCDF results,
+                or None if it isn't stored.
+
+        Example:
+            >>> array = store.open(ResultStore.make_key(url, wcps_query, 'CSV'))
+        """
+        info = self.info(key)
+        if info == None:
+            return None
+        path = os.path.join(self.directory, info['file'])
+        if info['format'] == 'GTiff':
+            return read_tiff(path)
+        if info['format'] == 'netCDF':
+            return read_netcdf(path)
+        return np.load(path, mmap_mode = 'r')
+
+    def write(self, key, chunks, output_format, dtype = None, metadata = None):
+        """
+        Decodes a result from the chunks of its response and stores it. CSV results are parsed while the
+            chunks arrive, so the memory used doesn't grow with the size of the result. The description
+            is written last, so a result which failed halfway isn't found afterwards.
+
+        Parameters:
+            key (str): The key of the result, see make_key().
+            chunks (iterable of bytes): The consecutive parts of the response.
+            output_format (str): The format of the response, 'CSV', 'PNG', 'JPEG', 'GTiff' or 'netCDF'.
+            dtype (str, optional): The type of the CSV, PNG and JPEG arrays.
+            metadata (dict, optional): Further fields of the description, e.g. the query.
+
+        Raises:
+            ValueError: If the response can't be decoded into an array.
+
+        Example:
+            >>> store.write(key, response.iter_content(1024 * 1024), 'CSV', 'float32')
+        """
+        suffix = self.suffixes.get(output_format, '.npy')
+        temporary, path = self._path(key, suffix + '.part'), self._path(key, suffix)
+        try:
+            with open(temporary, 'wb') as file:
+                if output_format in self.suffixes:
+                    for chunk in chunks:
+                        file.write(chunk)
+                elif output_format in ('PNG', 'JPEG'):
+                    array = decode_image(b''.join(chunks), dtype or 'uint8')
+                    np.save(file, array)
+                else:
+                    _write_csv_npy(chunks, file, dtype or 'float64')
+            # the file is mapped only after it's renamed, a mapped file can't be renamed on Windows
+            os.replace(temporary, path)
+            result = self._read(path, output_format)
+        except BaseException:
+            # a result which can't be decoded isn't kept, nor the description of the one it replaced
+            for leftover in (temporary, path, self._path(key, '.json')):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+        info = dict(metadata or {}, key = key, format = output_format, file = key + suffix,
+                    bytes = os.path.getsize(path), created = time.time(),
+                    dtype = str(result.dtype) if not isinstance(result, dict) else None,
+                    shape = list(result.shape) if not isinstance(result, dict) else None)
+        temporary = self._path(key, '.json.part')
+        with open(temporary, 'w') as file:
+            json.dump(info, file)
+        os.replace(temporary, self._path(key, '.json'))
+
+    def keys(self):
+        return sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def remove(self, key):
+        info = self.info(key)
+        if info == None:
+            return
+        # without its description the result isn't found anymore, even if removing the data fails
+        os.remove(self._path(key, '.json'))
+        path = os.path.join(self.directory, info['file'])
+        if os.path.exists(path):
+            os.remove(path)
+
+    def clear(self):
+        for key in self.keys():
+            self.remove(key)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    # opening a written file checks that it can be read
+    def _read(self, path, output_format):
+        if output_format == 'GTiff':
+            return read_tiff(path)
+        if output_format == 'netCDF':
+            return read_netcdf(path)
+        return np.load(path, mmap_mode = 'r')
+
+
+# on-disk store of time series, which grow by the time slices fetched since the last refresh
+class SeriesStore:
+    def __init__(self, directory):
+        """
+        Initializes a store of time series in a directory. Every series is kept as a raw array file, which
+            the new time slices are appended to, with a JSON file holding the range fetched so far.
+
+        Parameters:
+            directory (str): The directory of the files, it's created if it doesn't exist.
+
+        Example:
+            >>> store = SeriesStore("series")
+            >>> datacube.subset(var_name = '$c', subset = 'Lat(53.08), Long(8.80), ansi("2000-01":"2024-06")')
+            >>> temperature = datacube.execute_incremental('$c', store)
+        """
+        if not isinstance(directory, (str, os.PathLike)):
+            raise TypeError("directory must be a path.")
+        if np == None:
+            raise ImportError("numpy is needed for array results.")
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+
+    # the key of a series, the same as in the ResultCache
+    make_key = staticmethod(ResultCache.make_key)
+
+    def state(self, key):
+        """
+        Returns the state of a series, or None if nothing was fetched yet.
+
+        Returns:
+            dict: The first and last fetched time bounds, the number of slices, their dtype and shape,
+                and the query and url of the series.
+
+        Example:
+            >>> store.state(key)['last']
+            '"2024-06"'
+        """
+        try:
+            with open(self._path(key, '.json')) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def open(self, key):
+        """
+        Opens a series without reading it.
+
+        Returns:
+            numpy.memmap: The slices along the first axis, or None if nothing was fetched yet.
+
+        Example:
+            >>> store.open(key)[-12:].mean()
+        """
+        state = self.state(key)
+        if state == None:
+            return None
+        return np.memmap(self._path(key, '.bin'), dtype = state['dtype'], mode = 'r',
+                         shape = (state['count'], *state['shape']))
+
+    def append(self, key, values, first, last, metadata = None):
+        """
+        Appends time slices to a series and records the new last bound. The state is written after the values,
+            and values written after the recorded ones by an append which failed halfway are dropped first.
+
+        Parameters:
+            key (str): The key of the series.
+            values (numpy.ndarray): The new slices along the first axis.
+            first (str): The first time bound of the series, used if it's new.
+            last (str): The last time bound covered after this append.
+            metadata (dict, optional): Further fields of the state of a new series, e.g. the query.
+
+        Raises:
+            ValueError: If the slices don't have the shape or the type of the stored ones.
+
+        Example:
+            >>> store.append(key, np.array([14.2]), '"2000-01"', '"2024-07"')
+        """
+        state = self.state(key)
+        if state == None:
+            state = dict(metadata or {}, key = key, first = first, count = 0, dtype = str(values.dtype),
+                         shape = list(values.shape[1:]))
+        if list(values.shape[1:]) != state['shape'] or str(values.dtype) != state['dtype']:
+            raise ValueError("The new time slices don't match the shape or the type of the series")
+        path = self._path(key, '.bin')
+        slice_bytes = math.prod(state['shape']) * np.dtype(state['dtype']).itemsize
+        with open(path, 'ab') as file:
+            file.truncate(state['count'] * slice_bytes)
+            values.tofile(file)
+        state['count'] += len(values)
+        state['last'] = last
+        state['updated'] = time.time()
+        temporary = self._path(key, '.json.part')
+        with open(temporary, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary, self._path(key, '.json'))
+
+    def keys(self):
+        return sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def remove(self, key):
+        for suffix in ('.json', '.bin'):
+            if os.path.exists(self._path(key, suffix)):
+                os.remove(self._path(key, suffix))
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+
+# writing a CSV output which arrives in chunks to a .npy file, the values are parsed chunk by chunk
+def _write_csv_npy(chunks, file, dtype):
+    state = {'head': b'', 'shape': None, 'braces': [0, 0]}
+
+    def observed():
+        for chunk in chunks:
+            state['braces'][0] += chunk.count(b'{')
+            state['braces'][1] += chunk.count(b'}')
+            # the shape is read from the first top-level block, once a closing brace may have completed it
+            if state['shape'] == None:
+                state['head'] += chunk
+                if b'}' in chunk or b'{' not in state['head']:
+                    try:
+                        state['shape'] = csv_shape(state['head'])
+                        state['head'] = b''
+                    except ValueError:
+                        pass
+            yield chunk
+
+    with tempfile.TemporaryFile(dir = os.path.dirname(getattr(file, 'name', '')) or None) as values:
+        count = 0
+        for block in iter_csv_values(observed(), dtype):
+            block.tofile(values)
+            count += block.size
+        inner, bands = state['shape'] if state['shape'] != None else csv_shape(state['head'])
+        cell_size = math.prod(inner) * (bands if bands != None else 1)
+        if count == 0 or cell_size == 0 or count % cell_size != 0:
+            raise ValueError("The blocks of the CSV output don't form a regular grid")
+        top = count // cell_size
+        # the rows aren't checked one by one like in byte_to_ndarray(), the numbers of braces and values are
+        braces = sum(top * math.prod(inner[:level]) for level in range(len(inner)))
+        if state['braces'] != [braces, braces]:
+            raise ValueError("The blocks of the CSV output don't form a regular grid")
+        shape = tuple([top] + inner + ([bands] if bands != None else []))
+        np.lib.format.write_array_header_1_0(file, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                    'fortran_order': False, 'shape': shape})
+        values.seek(0)
+        shutil.copyfileobj(values, file)
+
+
+# cached results are handed out as copies, so a caller changing its result doesn't change the cache
+def copy_result(data):
+    if isinstance(data, list):
+        return list(data)
+    # the arrays of a netCDF result are copied too, not only the dict holding them
+    if isinstance(data, dict):
+        return {name: copy_result(value) for name, value in data.items()}
+    if hasattr(data, 'copy'):
+        return data.copy()
+    return data
+
+
+# nearest-rank percentile of a list of numbers
+def percentile(values, q):
+    """
+    Computes the nearest-rank percentile of a list of numbers.
+
+    Parameters:
+        values (list of float): The numbers, in any order.
+        q (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile, or None if the list is empty.
+
+    Example:
+        >>> percentile([1.0, 2.0, 3.0, 4.0], 50)
+        2.0
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# results of dbc.execute_many(), kept in the order of the queries
+class BatchResult(list):
+    def __init__(self, outcomes, elapsed):
+        """
+        Initializes the list of results of a batch, together with the errors and timings of the queries.
+
+        Parameters:
+            outcomes (list of tuple): A (data, error, latency) tuple for every query, in the input order.
+            elapsed (float): The wall-clock seconds the whole batch took.
+
+        Example:
+            >>> results = BatchResult([([1.0], None, 0.02)], 0.02)
+        """
+        super().__init__(data for data, _, _ in outcomes)
+        self.errors = {index: error for index, (_, error, _) in enumerate(outcomes) if error != None}
+        self.latencies = [latency for _, _, latency in outcomes]
+        self.elapsed = elapsed
+
+    @property
+    def qps(self):
+        return len(self) / self.elapsed if self.elapsed > 0 else float('inf')
+
+    @property
+    def p50(self):
+        return percentile(self.latencies, 50)
+
+    @property
+    def p99(self):
+        return percentile(self.latencies, 99)
+
+    def summary(self):
+        """
+        Describes the throughput and latency of the batch.
+
+        Returns:
+            str: A one-line summary of the batch.
+
+        Example:
+            >>> print(results.summary())
+            480 queries (0 failed) in 3.214 s: 149.3 queries/s, p50 52.1 ms, p99 88.0 ms
+        """
+        if len(self) == 0:
+            return "0 queries"
+        return (f"{len(self)} queries ({len(self.errors)} failed) in {self.elapsed:.3f} s: "
+                f"{self.qps:.1f} queries/s, p50 {self.p50 * 1e3:.1f} ms, p99 {self.p99 * 1e3:.1f} ms")
+
+
+# asynchronous database connection object
+class AsyncDbc:
+    # initializing the async counterpart of dbc, the queries are sent by a pooled dbc on a bounded set of worker threads
+    def __init__(self, url, max_concurrency = 10, keep_alive = True, cache = None, **options):
+        """
+        Initializes a new AsyncDbc instance, which sends WCPS queries without blocking the event loop.
+            At most max_concurrency queries are in flight at once, the others wait for a free slot.
+
+        Parameters:
+            url (str): The endpoint URL of the WCPS server.
+            max_concurrency (int, optional): The maximum number of queries sent to the server at the same time.
+            keep_alive (bool, optional): If False, every connection is closed after its response.
+            cache (ResultCache, optional): A cache for the decoded results of the queries run by dco.execute_async().
+            **options: Further settings of the underlying dbc, e.g. timeout, retries or breaker.
+
+        Example:
+            >>> async with AsyncDbc("https://ows.rasdaman.org/rasdaman/ows", max_concurrency = 20) as connection:
+            ...     response = await connection.send_query("for $c in (AvgLandTemp) return 1")
+        """
+        if not isinstance(max_concurrency, int) or isinstance(max_concurrency, bool):
+            raise TypeError("max_concurrency must be an integer.")
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive.")
+        # the pool is as large as the concurrency limit, so every worker keeps its connection open
+        self.DBC = dbc(url, pool_maxsize = max_concurrency, pool_block = True, keep_alive = keep_alive,
+                       cache = cache, **options)
+        self.server_url = url
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers = max_concurrency, thread_name_prefix = 'wdc-async')
+
+    async def send_query(self, wcps_query):
+        """
+        Sends a WCPS query to the server and waits for the response without blocking the event loop.
+
+        Parameters:
+            wcps_query (str): A string containing the WCPS query.
+
+        Returns:
+            Response: A response object from the requests library containing the server's response to the query.
+
+        Example:
+            >>> result = await connection.send_query("for $c in (AvgLandTemp) return 1")
+        """
+        if not isinstance(wcps_query, str):
+            raise TypeError("Value entered must be a string.")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.DBC.send_query, wcps_query)
+
+    async def run_query(self, wcps_query, decode = None, kind = ''):
+        """
+        Sends a WCPS query and decodes the response like dbc.run_query(), without blocking the event loop.
+
+        Parameters:
+            wcps_query (str): A string containing the WCPS query.
+            decode (callable, optional): A function which turns the content of the response into the result.
+            kind (str, optional): Describes how the result is decoded. Queries decoded differently are cached apart.
+
+        Returns:
+            Varies: The decoded result, or the response object if no decode function was given.
+
+        Example:
+            >>> data = await connection.run_query("for $c in (AvgLandTemp) return 1", byte_to_list, 'CSV')
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.DBC.run_query, wcps_query, decode, kind)
+
+    def close(self):
+        """
+        Waits for the queries in flight, then releases the worker threads and the pooled connections.
+
+        Example:
+            >>> connection.close()
+        """
+        self._executor.shutdown(wait = True)
+        self.DBC.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # waiting for the queries in flight mustn't block the event loop
+        await asyncio.to_thread(self.close)
+
+
+# the buffer of a binary result, a file is memory-mapped instead of read
+def _binary_buffer(source):
+    if isinstance(source, (str, os.PathLike)):
+        return np.memmap(source, dtype = 'uint8', mode = 'r')
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source)
+    raise TypeError("source must be a path or a bytes object.")
+
+
+# the numpy type codes of the TIFF field types, and the (bits, sample format) pairs of the pixel types
+_TIFF_FIELDS = {1: 'u1', 2: 'u1', 3: 'u2', 4: 'u4', 6: 'i1', 8: 'i2', 9: 'i4', 11: 'f4', 12: 'f8', 16: 'u8',
+                17: 'i8'}
+_TIFF_SAMPLES = {1: 'u', 2: 'i', 3: 'f'}
+
+
+# the tags of the first image of a TIFF file, by their number
+def _tiff_tags(buffer):
+    order = bytes(buffer[:2])
+    if order not in (b'II', b'MM'):
+        raise ValueError("The content isn't a TIFF file")
+    endian = '<' if order == b'II' else '>'
+    version = struct.unpack_from(endian + 'H', buffer, 2)[0]
+    # BigTIFF has 64 bit counts and offsets
+    if version == 42:
+        ifd, count_format, entry_format, inline = struct.unpack_from(endian + 'I', buffer, 4)[0], 'H', 'HHI', 4
+    elif version == 43:
+        ifd, count_format, entry_format, inline = struct.unpack_from(endian + 'Q', buffer, 8)[0], 'Q', 'HHQ', 8
+    else:
+        raise ValueError("The content isn't a TIFF file")
+    entries = struct.unpack_from(endian + count_format, buffer, ifd)[0]
+    position = ifd + struct.calcsize(endian + count_format)
+    entry_size = struct.calcsize(endian + entry_format) + inline
+    tags = {}
+    for _ in range(entries):
+        tag, kind, count = struct.unpack_from(endian + entry_format, buffer, position)
+        value_offset = position + entry_size - inline
+        position += entry_size
+        if kind not in _TIFF_FIELDS:
+            continue
+        dtype = np.dtype(endian + _TIFF_FIELDS[kind])
+        # values which fit in the entry are stored in it, the others at the offset it holds
+        if dtype.itemsize * count > inline:
+            value_offset = struct.unpack_from(endian + ('I' if inline == 4 else 'Q'), buffer, value_offset)[0]
+        tags[tag] = np.frombuffer(buffer, dtype = dtype, count = count, offset = value_offset)
+    return endian, tags
+
+
+# function needed for converting a GeoTIFF result to an array
+def read_tiff(source):
+    """
+    Reads the first image of a TIFF or GeoTIFF file into a numpy array of height x width x bands. Uncompressed
+        images stored in one block, as the WCPS servers write them, aren't copied: the array is a view of the
+        bytes, or of the memory-mapped file if a path is given, and only the pixels which are used are read.
+        Deflate compressed and tiled images are decoded into a new array. Other layouts need tifffile.
+
+    Parameters:
+        source (bytes or str): The content of the file, or its path.
+
+    Returns:
+        numpy.ndarray: The pixels of the image, read-only if they weren't copied.
+
+    Raises:
+        ValueError: If the source isn't a TIFF file, or its layout isn't supported.
+
+    Example:
+        >>> datacube.set_format("GTiff").execute_to("temperature.tif")
+        >>> read_tiff("temperature.tif")[100:200, 100:200].mean()
+    """
+    if np == None:
+        raise ImportError("numpy is needed for array results.")
+    buffer = _binary_buffer(source)
+    endian, tags = _tiff_tags(buffer)
+
+    def tag(number, default = None):
+        return int(tags[number][0]) if number in tags else default
+
+    width, height, bands = tag(256), tag(257), tag(277, 1)
+    bits = set(int(value) for value in tags.get(258, [1]))
+    compression, predictor, planar = tag(259, 1), tag(317, 1), tag(284, 1)
+    sample_format = tag(339, 1)
+    supported = (len(bits) == 1 and next(iter(bits)) in (8, 16, 32, 64) and sample_format in _TIFF_SAMPLES
+                 and compression in (1, 8, 32946) and predictor in (1, 2) and (planar == 1 or bands == 1))
+    if width == None or height == None or not supported:
+        if tifffile != None:
+            return tifffile.imread(io.BytesIO(bytes(buffer)) if not isinstance(buffer, np.memmap) else source)
+        raise ValueError("The layout of the TIFF file isn't supported, tifffile is needed for it")
+    dtype = np.dtype(endian + _TIFF_SAMPLES[sample_format] + str(next(iter(bits)) // 8))
+    if 322 in tags:
+        block_width, block_height = tag(322), tag(323)
+        offsets, counts = tags[324], tags[325]
+    else:
+        block_width, block_height = width, min(tag(278, height), height)
+        offsets, counts = tags[273], tags[279]
+    size = width * height * bands * dtype.itemsize
+    # the strips of an uncompressed image usually follow each other, then the image is one view
+    if compression == 1 and 322 not in tags and int(counts.sum()) >= size and \
+            all(int(offsets[i]) + int(counts[i]) == int(offsets[i + 1]) for i in range(len(offsets) - 1)):
+        return np.frombuffer(buffer, dtype = dtype, count = width * height * bands,
+                             offset = int(offsets[0])).reshape(height, width, bands)
+    array = np.empty((height, width, bands), dtype = dtype)
+    across = math.ceil(width / block_width)
+    for index, (offset, count) in enumerate(zip(offsets, counts)):
+        data = bytes(buffer[int(offset):int(offset) + int(count)])
+        if compression != 1:
+            data = zlib.decompress(data)
+        # the last strip of an image can be shorter than the others
+        rows = min(block_height, height - index // across * block_height) if 322 not in tags else block_height
+        block = np.frombuffer(data, dtype = dtype, count = rows * block_width * bands).reshape(rows, block_width,
+                                                                                           bands)
+        if predictor == 2:
+            block = np.cumsum(block, axis = 1, dtype = dtype)
+        top, left = index // across * block_height, index % across * block_width
+        visible = array[top:top + rows, left:left + block_width]
+        visible[...] = block[:visible.shape[0], :visible.shape[1]]
+    return array
+
+
+# the numpy types of the netCDF types
+_NETCDF_TYPES = {1: 'i1', 2: 'S1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8', 7: 'u1', 8: '>u2', 9: '>u4', 10: '>i8',
+                 11: '>u8'}
+
+
+# function needed for converting a netCDF result to arrays
+def read_netcdf(source):
+    """
+    Reads the variables of a netCDF file into numpy arrays. Classic netCDF files (CDF-1, CDF-2 and CDF-5),
+        as the WCPS servers write them, are read without copying: every array is a view of the bytes,
+        or of the memory-mapped file if a path is given. netCDF-4 files need the netCDF4 library.
+
+    Parameters:
+        source (bytes or str): The content of the file, or its path.
+
+    Returns:
+        dict: The arrays of the variables, by their names.
+
+    Raises:
+        ValueError: If the source isn't a netCDF file.
+
+    Example:
+        >>> datacube.set_format("netCDF").execute_to("temperature.nc")
+        >>> read_netcdf("temperature.nc")['Gray'][0, :10]
+    """
+    if np == None:
+        raise ImportError("numpy is needed for array results.")
+    buffer = _binary_buffer(source)
+    magic = bytes(buffer[:4])
+    if magic == b'\x89HDF':
+        if netCDF4 == None:
+            raise ImportError("The netCDF4 library is needed for netCDF-4 results.")
+        if isinstance(buffer, np.memmap):
+            dataset = netCDF4.Dataset(source)
+        else:
+            dataset = netCDF4.Dataset('result.nc', memory = bytes(buffer))
+        with dataset:
+            return {name: variable[...] for name, variable in dataset.variables.items()}
+    if magic[:3] != b'CDF' or magic[3] not in (1, 2, 5):
+        raise ValueError("The content isn't a netCDF file")
+    version = magic[3]
+    count_format = '>q' if version == 5 else '>i'
+    offset_format = '>i' if version == 1 else '>q'
+    position = 4
+
+    def read(format):
+        nonlocal position
+        value = struct.unpack_from(format, buffer, position)[0]
+        position += struct.calcsize(format)
+        return value
+
+    def name():
+        nonlocal position
+        length = read(count_format)
+        text = bytes(buffer[position:position + length]).decode('utf-8')
+        position += length + (-length % 4)
+        return text
+
+    def skip_attributes():
+        nonlocal position
+        read('>i')
+        for _ in range(read(count_format)):
+            name()
+            kind = read('>i')
+            length = read(count_format) * np.dtype(_NETCDF_TYPES[kind]).itemsize
+            position += length + (-length % 4)
+
+    records = read(count_format)
+    read('>i')
+    dimensions = [(name(), read(count_format)) for _ in range(read(count_format))]
+    skip_attributes()
+    read('>i')
+    variables = []
+    for _ in range(read(count_format)):
+        variable = name()
+        ids = [read(count_format) for _ in range(read(count_format))]
+        skip_attributes()
+        dtype = np.dtype(_NETCDF_TYPES[read('>i')])
+        size = read(count_format if version == 5 else '>i')
+        begin = read(offset_format)
+        variables.append((variable, ids, dtype, size, begin))
+    # the record variables are interleaved, one record of every variable after the other
+    recorded = [variable for variable in variables if variable[1] and dimensions[variable[1][0]][1] == 0]
+    record_size = sum(size for _, _, _, size, _ in recorded)
+    if len(recorded) == 1:
+        record_size = recorded[0][2].itemsize * math.prod(dimensions[i][1] for i in recorded[0][1][1:])
+    arrays = {}
+    for variable, ids, dtype, size, begin in variables:
+        shape = [dimensions[i][1] for i in ids]
+        if variable in [recorded_variable[0] for recorded_variable in recorded]:
+            shape[0] = records
+            inner = np.empty(shape[1:], dtype = dtype).strides if len(shape) > 1 else ()
+            arrays[variable] = np.ndarray(shape, dtype = dtype, buffer = buffer, offset = begin,
+                                          strides = (record_size, *inner))
+        else:
+            arrays[variable] = np.frombuffer(buffer, dtype = dtype, count = math.prod(shape),
+                                             offset = begin).reshape(shape)
+    return arrays
+
+
+# converting a decoded binary result to another dtype, the arrays which already have it are kept as they are
+def _convert_arrays(result, dtype = None):
+    # the char variables of netCDF files aren't numbers
+    if dtype == None or (not isinstance(result, dict) and result.dtype.kind not in 'iuf'):
+        return result
+    if isinstance(result, dict):
+        return {name: _convert_arrays(array, dtype) for name, array in result.items()}
+    return result if result.dtype == np.dtype(dtype) else result.astype(dtype)
+
+
+# function needed for converting a PNG or JPEG result to an array of pixels
+def decode_image(content, dtype = 'uint8'):
+    """
+    Decodes a PNG or JPEG image into a numpy array of height x width x bands. The decoder reads
+        straight from the bytes of the response, they aren't copied first. Grayscale images get one band,
+        palette images are expanded to RGB or RGBA.
+
+    Parameters:
+        content (bytes): The body of the server's response.
+        dtype (str, optional): The type of the array, 'uint8' keeps the pixels as they are and returns
+            a read-only array, 'float32' or 'float64' converts them.
+
+    Returns:
+        numpy.ndarray: The pixels of the image.
+
+    Raises:
+        ValueError: If the content isn't an image Pillow can decode.
+
+    Example:
+        >>> decode_image(datacube.set_format("PNG").execute()).shape
+        (180, 360, 1)
+    """
+    if np == None:
+        raise ImportError("numpy is needed for array results.")
+    if Image == None:
+        raise ImportError("Pillow is needed for decoding PNG and JPEG results.")
+    # a BytesIO over a bytes object shares its buffer, any other buffer would be copied anyway
+    if not isinstance(content, bytes):
+        content = bytes(content)
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            if image.mode == 'P':
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            elif image.mode == '1':
+                image = image.convert('L')
+            # the array wraps the decoded pixels without copying them again
+            array = np.asarray(image)
+    except Image.UnidentifiedImageError:
+        raise ValueError("The content isn't a PNG or JPEG image") from None
+    if array.ndim == 2:
+        array = array[..., np.newaxis]
+    if array.dtype != np.dtype(dtype):
+        array = array.astype(dtype)
+    return array
+
+
+# decoding one image of a batch, the exception is returned instead of raised if asked for
+def _decode_image_job(job):
+    content, dtype, return_exceptions = job
+    try:
+        return decode_image(content, dtype)
+    except Exception as error:
+        if not return_exceptions:
+            raise
+        return error
+
+
+# function needed for decoding many images on all the cores
+def decode_images(contents, dtype = 'uint8', max_workers = None, return_exceptions = False):
+    """
+    Decodes many PNG or JPEG images with decode_image() on a process pool, so the decoding of a batch
+        isn't limited by the speed of one core. Small batches are decoded in the calling process,
+        where starting the workers would take longer than decoding.
+
+    Parameters:
+        contents (list of bytes): The images.
+        dtype (str, optional): The type of the arrays, see decode_image().
+        max_workers (int, optional): The number of worker processes, by default the number of cores.
+        return_exceptions (bool, optional): If True, an image which can't be decoded gives its exception
+            in place of the array, otherwise the exception is raised.
+
+    Returns:
+        list: The arrays in the order of the images.
+
+    Example:
+        >>> arrays = decode_images([response.content for response in responses], max_workers = 4)
+    """
+    jobs = [(content, dtype, return_exceptions) for content in contents]
+    if len(jobs) < 2 or max_workers == 1:
+        return [_decode_image_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        # the images are sent to the workers a few at a time, so one slow image doesn't hold a worker idle
+        chunksize = max(1, len(jobs) // (4 * (max_workers or os.cpu_count() or 1)))
+        return list(executor.map(_decode_image_job, jobs, chunksize = chunksize))
+
+
+# function needed for converting a byte string to the list of numbers
+def byte_to_list(byte_str):
+    """
+    Converts a byte string into a list of floats. Useful for parsing numeric data returned from a server.
+
+    Parameters:
+        byte_str (bytes): The byte string to be converted.
+
+    Returns:
+        list of float: A list of floats derived from the byte string.
+
+    Example:
+        >>> byte_to_list(b'1.0,2.0,3.0')
+        [1.0, 2.0, 3.0]
+    """
+    decoded_str = byte_str.decode('utf-8') # decode the byte string
+    str_list = decoded_str.split(',') # split numbers separated by comma
+    num_list = [float(num) for num in str_list] # create a list of numbers
+    return num_list
+
+
+# function needed for converting a byte string straight to an array of numbers
+def byte_to_array(byte_str, dtype = 'float64'):
+    """
+    Converts a byte string of comma separated numbers into a contiguous numpy array. Unlike byte_to_list()
+        it parses the bytes directly, without decoding them to a string and building a list of floats first.
+
+    Parameters:
+        byte_str (bytes): The byte string to be converted.
+        dtype (str, optional): The type of the array, 'float64' or 'float32'.
+
+    Returns:
+        numpy.ndarray: A one-dimensional array of the numbers.
+
+    Raises:
+        ValueError: If the byte string contains something which isn't a number.
+
+    Example:
+        >>> byte_to_array(b'1.0,2.0,3.0', dtype = 'float32')
+        array([1., 2., 3.], dtype=float32)
+    """
+    if np == None:
+        raise ImportError("numpy is needed for array results.")
+    if isinstance(byte_str, (bytearray, memoryview)):
+        byte_str = bytes(byte_str)
+    # numpy only warns about a malformed string and returns the numbers parsed so far, we want an error instead
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(byte_str, dtype = dtype, sep = ',')
+        except DeprecationWarning:
+            raise ValueError("The byte string contains values which aren't numbers")
+
+
+# tokens of rasdaman CSV output: braces, quoted multi-band cells and single values
+_CSV_TOKEN = re.compile(rb'[{}]|"[^"]*"|[^{},;"\s]+')
+# the innermost blocks, i.e. the rows of values
+_CSV_ROW = re.compile(rb'\{([^{}]*)\}')
+# everything which isn't part of a number is turned into a space, so numpy can parse the values in one go
+_CSV_BLANKS = bytes.maketrans(b'{};,"', b'     ')
+
+
+# the shape of the nested {...} blocks of a rasdaman CSV output
+def csv_shape(byte_str):
+    """
+    Reads the shape of a rasdaman CSV output from its first top-level block. The blocks are expected to
+        form a regular grid, which byte_to_ndarray() checks against the number of values and braces.
+
+    Parameters:
+        byte_str (bytes): The CSV output, e.g. b'{1,2,3},{4,5,6}'.
+
+    Returns:
+        tuple: The sizes of the nested blocks below the top level, and the number of bands of a cell
+            (None if the cells aren't quoted multi-band cells).
+
+    Example:
+        >>> csv_shape(b'{"1 2","3 4","5 6"},{"7 8","9 10","11 12"}')
+        ([3], 2)
+    """
+    depth = 0
+    max_depth = 0
+    bands = None
+    # children[d] is the number of items of the block which is open at depth d
+    children = [0]
+    first_sizes = {}
+    for match in _CSV_TOKEN.finditer(byte_str):
+        token = match.group()
+        if token == b'{':
+            children[depth] += 1
+            depth += 1
+            max_depth = max(max_depth, depth)
+            if depth == len(children):
+                children.append(0)
+            children[depth] = 0
+        elif token == b'}':
+            if depth == 0:
+                raise ValueError("Unmatched '}' in the CSV output")
+            first_sizes.setdefault(depth, children[depth])
+            depth -= 1
+            # the first top-level block is complete, the others must have the same shape
+            if depth == 0:
+                break
+        else:
+            if bands == None and token.startswith(b'"'):
+                bands = len(token.split()) if token.strip(b'"').strip() else 0
+            children[depth] += 1
+            if depth == 0:
+                break
+    if depth != 0:
+        raise ValueError("Unmatched '{' in the CSV output")
+    return [first_sizes[d] for d in range(1, max_depth + 1)], bands
+
+
+# function needed for converting a byte string to an array which keeps the shape of the coverage subset
+def byte_to_ndarray(byte_str, dtype = 'float64', band_names = None):
+    """
+    Converts a rasdaman CSV output into a numpy array with the shape of the returned grid. The nested
+        {...} blocks become the axes of the array and the quoted multi-band cells ("a b c") become the last
+        axis, or the fields of a structured array if band_names are given. All the values are parsed in a
+        single pass over the bytes, only the first top-level block is read separately to find the shape,
+        and the rest of the structure is checked per row.
+
+    Parameters:
+        byte_str (bytes): The byte string to be converted, e.g. b'{1,2,3},{4,5,6}' for a 2 x 3 grid.
+        dtype (str, optional): The type of the values.
+        band_names (list of str, optional): Names of the bands, if a structured array should be returned.
+
+    Returns:
+        numpy.ndarray: An array with one axis per nesting level and, for multi-band cells, one for the bands.
+
+    Raises:
+        ValueError: If the output contains values which aren't numbers or the blocks don't form a regular grid.
+
+    Example:
+        >>> byte_to_ndarray(b'{1,2,3},{4,5,6}').shape
+        (2, 3)
+        >>> byte_to_ndarray(b'{"1 2 3","4 5 6"}', band_names = ['red', 'green', 'blue'])['green']
+        array([[2., 5.]])
+    """
+    if np == None:
+        raise ImportError("numpy is needed for array results.")
+    byte_str = bytes(byte_str)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(byte_str.translate(_CSV_BLANKS), dtype = dtype, sep = ' ')
+        except DeprecationWarning:
+            raise ValueError("The byte string contains values which aren't numbers")
+    inner, bands = csv_shape(byte_str)
+    cell_size = math.prod(inner) * (bands if bands != None else 1)
+    if cell_size == 0 or values.size % cell_size != 0:
+        raise ValueError("The blocks of the CSV output don't form a regular grid")
+    top = values.size // cell_size
+    # a regular grid has the same number of braces as its first block, times the number of top-level items
+    braces = sum(top * math.prod(inner[:level]) for level in range(len(inner)))
+    if byte_str.count(b'{') != braces or byte_str.count(b'}') != braces:
+        raise ValueError("The blocks of the CSV output don't form a regular grid")
+    # every row must have the same length, this is checked per row and not per value
+    if len(inner) > 0:
+        for match in _CSV_ROW.finditer(byte_str):
+            row = match.group(1)
+            if row.count(b',') + row.count(b';') != inner[-1] - 1:
+                raise ValueError("The blocks of the CSV output don't form a regular grid")
+    shape = [top] + inner + ([bands] if bands != None else [])
+    array = values.reshape(shape)
+    if band_names != None:
+        if bands == None or len(band_names) != bands:
+            raise ValueError("The number of band names doesn't match the number of bands")
+        fields = np.dtype([(name, array.dtype) for name in band_names])
+        array = np.ascontiguousarray(array).view(fields)[..., 0]
+    return array
+
+
+# the bytes which separate the values of a CSV output
+_CSV_DELIMITERS = b'{};," \t\r\n'
+
+
+# incremental parser of a CSV output which arrives in chunks
+def iter_csv_values(chunks, dtype = None):
+    """
+    Parses the values of a CSV output as its chunks arrive, e.g. from response.iter_content(). A value cut
+        in two by a chunk boundary is kept until the next chunk completes it, so only about one chunk is
+        held in memory at a time. The nesting of the {...} blocks is not kept, the values come out flat.
+
+    Parameters:
+        chunks (iterable of bytes): The consecutive parts of the CSV output.
+        dtype (str, optional): If given, every block of values is a numpy array of this type,
+            otherwise a list of floats.
+
+    Returns:
+        generator: Yields one block of values per chunk, in the order of the output.
+
+    Example:
+        >>> list(iter_csv_values([b'1.5,2', b'.5,3']))
+        [[1.5], [2.5], [3.0]]
+    """
+    if dtype != None and np == None:
+        raise ImportError("numpy is needed for array results.")
+
+    def parse(data):
+        blanked = data.translate(_CSV_BLANKS)
+        if dtype == None:
+            return [float(value) for value in blanked.split()]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                return np.fromstring(blanked, dtype = dtype, sep = ' ')
+            except DeprecationWarning:
+                raise ValueError("The byte string contains values which aren't numbers")
+
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk
+        # everything after the last delimiter may be the beginning of a value which continues in the next chunk
+        cut = max(data.rfind(delimiter) for delimiter in _CSV_DELIMITERS)
+        carry = data[cut + 1:]
+        if cut >= 0:
+            block = parse(data[:cut + 1])
+            if len(block) > 0:
+                yield block
+    if carry:
+        yield parse(carry)
+
+
+# splitting a subset like 'Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")' into the parts of its axes
+def split_subset(subset):
+    """
+    Splits a subset specification into the subsets of the single axes. Commas inside parentheses
+        or quotes don't split.
+
+    Parameters:
+        subset (str): The subset specification.
+
+    Returns:
+        list of str: The subsets of the axes, in order.
+
+    Example:
+        >>> split_subset('Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")')
+        ['Lat(53.08)', 'Long(8.80)', 'ansi("2014-01":"2014-12")']
+    """
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    for i, char in enumerate(subset):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(subset[start:i].strip())
+            start = i + 1
+    parts.append(subset[start:].strip())
+    return [part for part in parts if part]
+
+
+# reading the axis name and the bounds from the subset of a single axis
+def parse_axis_interval(axis_subset):
+    """
+    Reads the axis name and the bounds of the subset of one axis.
+
+    Parameters:
+        axis_subset (str): The subset of one axis, e.g. 'ansi("2014-01":"2014-12")' or 'Lat(53.08)'.
+
+    Returns:
+        tuple: (axis name, low bound, high bound) as strings. The high bound is None for a slice.
+
+    Raises:
+        ValueError: If the subset isn't formatted like 'axis(low:high)' or 'axis(point)'.
+
+    Example:
+        >>> parse_axis_interval('ansi("2014-01":"2014-12")')
+        ('ansi', '"2014-01"', '"2014-12"')
+    """
+    match = re.fullmatch(r'\s*([^\s(]+)\s*\((.*)\)\s*', axis_subset, re.DOTALL)
+    if match == None:
+        raise ValueError(f"The subset '{axis_subset}' isn't formatted like 'axis(low:high)'")
+    name, bounds = match.group(1), match.group(2)
+    # the colon between the bounds is the one outside the quotes
+    parts = re.split(r':(?=(?:[^"]*"[^"]*")*[^"]*$)', bounds)
+    if len(parts) == 1:
+        return name, parts[0].strip(), None
+    if len(parts) == 2:
+        return name, parts[0].strip(), parts[1].strip()
+    raise ValueError(f"The subset '{axis_subset}' isn't formatted like 'axis(low:high)'")
+
+
+# dates are counted in the units of their own precision: years, months or days
+_DATE_FORMATS = {'year': re.compile(r'\d{4}'), 'month': re.compile(r'\d{4}-\d{2}'),
+                 'day': re.compile(r'\d{4}-\d{2}-\d{2}')}
+
+
+def _date_to_ordinal(text):
+    for precision, pattern in _DATE_FORMATS.items():
+        if pattern.fullmatch(text):
+            break
+    else:
+        return None, None
+    if precision == 'year':
+        return precision, int(text)
+    if precision == 'month':
+        year, month = text.split('-')
+        return precision, int(year) * 12 + int(month) - 1
+    return precision, datetime.date.fromisoformat(text).toordinal()
+
+
+def _ordinal_to_date(precision, ordinal):
+    if precision == 'year':
+        return f'{ordinal:04}'
+    if precision == 'month':
+        return f'{ordinal // 12:04}-{ordinal % 12 + 1:02}'
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+
+def _format_number(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(round(value, 10))
+
+
+# splitting the bounds of one axis into consecutive, non-overlapping tiles
+def tile_interval(low, high, tile_size, resolution = None, origin = None):
+    """
+    Splits the bounds of an axis subset into consecutive intervals, which together cover the same cells
+        exactly once. Dates ("2014", "2014-01" or "2014-01-31") are split by years, months or days, and
+        tile_size counts those units. Numbers are split at the grid points of the axis, the coordinates
+        origin + k * resolution, into intervals of up to tile_size: because WCPS intervals include both bounds,
+        a tile ends on the grid point before the one the next tile starts on, so no cell falls between
+        two tiles. Non-integer coordinates need the resolution (grid step) of the axis. The tiles are listed
+        in the order of the cells in the result, so on an axis stored in descending order, which has
+        a negative resolution like Lat in most EPSG:4326 coverages, the tile of the highest coordinates is first.
+
+    Parameters:
+        low (str): The low bound, as written in the subset.
+        high (str): The high bound, as written in the subset.
+        tile_size (int or float): The size of a tile, in units of the dates or of the coordinates.
+        resolution (float, optional): The grid step of a numeric axis, negative if the axis is descending.
+            1 for integer coordinates by default.
+        origin (float, optional): The coordinate of any cell of a numeric axis, the low bound by default.
+
+    Returns:
+        list of tuple: (low, high) bounds of the tiles as strings, formatted like the given bounds.
+
+    Example:
+        >>> tile_interval('"2014-01"', '"2014-12"', 6)
+        [('"2014-01"', '"2014-06"'), ('"2014-07"', '"2014-12"')]
+        >>> tile_interval('0', '99', 50)
+        [('0', '49'), ('50', '99')]
+        >>> tile_interval('-90', '90', 90, resolution = -1, origin = 89.5)
+        [('0.5', '89.5'), ('-89.5', '-0.5')]
+    """
+    if not isinstance(tile_size, (int, float)) or isinstance(tile_size, bool) or tile_size <= 0:
+        raise ValueError("tile_size must be a positive number.")
+    if low.startswith('"') and high.startswith('"'):
+        precision, start = _date_to_ordinal(low.strip('"'))
+        high_precision, end = _date_to_ordinal(high.strip('"'))
+        if precision == None or precision != high_precision:
+            raise ValueError("Only dates like 2014, 2014-01 or 2014-01-31 with the same precision can be tiled")
+        if not isinstance(tile_size, int):
+            raise ValueError("The tile_size of dates must be an integer.")
+        return [(f'"{_ordinal_to_date(precision, first)}"',
+                 f'"{_ordinal_to_date(precision, min(first + tile_size - 1, end))}"')
+                for first in range(start, end + 1, tile_size)]
+    try:
+        start, end = float(low), float(high)
+        origin = float(origin) if origin != None else start
+    except ValueError:
+        raise ValueError(f"The interval {low}:{high} can't be tiled")
+    if resolution == None:
+        if not (origin.is_integer() and float(tile_size).is_integer()):
+            raise ValueError("Non-integer coordinates need the resolution of the axis to be tiled")
+        resolution = 1
+    if resolution == 0:
+        raise ValueError("resolution can't be 0.")
+    step = abs(resolution)
+    # the grid points inside the bounds, by their number counted from the origin
+    first = math.ceil(round((start - origin) / step, 10))
+    last = math.floor(round((end - origin) / step, 10))
+    if last < first:
+        raise ValueError(f"The interval {low}:{high} contains no grid point of the axis")
+    points = range(first, last + 1) if resolution > 0 else range(last, first - 1, -1)
+    per_tile = max(1, math.floor(round(tile_size / step, 10)))
+    tiles = []
+    for i in range(0, len(points), per_tile):
+        bounds = sorted((points[i], points[min(i + per_tile, len(points)) - 1]))
+        tiles.append(tuple(_format_number(round(origin + point * step, 10)) for point in bounds))
+    return tiles
+
+
+# putting the tiles of a grid back together into one array
+def stitch_tiles(tiles, grid_shape, axes):
+    """
+    Concatenates the arrays of a grid of tiles into one array. The tiles are joined in the order of their
+        indices, which must be the order of their cells in the result, see tile_interval().
+
+    Parameters:
+        tiles (dict): The array of every tile, by its index in the grid of tiles.
+        grid_shape (tuple): The number of tiles along every tiled axis.
+        axes (list of int): The axis of the arrays every tiled axis corresponds to.
+
+    Returns:
+        numpy.ndarray: The stitched array.
+
+    Example:
+        >>> stitch_tiles({(0,): np.zeros(2), (1,): np.ones(3)}, (2,), [0])
+        array([0., 0., 1., 1., 1.])
+    """
+    if len(grid_shape) == 0:
+        return tiles[()]
+    # the last tiled axis is joined first, then the rows of tiles along the earlier axes
+    rows = {}
+    for index in itertools.product(*(range(size) for size in grid_shape[:-1])):
+        parts = [tiles[index + (i,)] for i in range(grid_shape[-1])]
+        rows[index] = np.concatenate(parts, axis = axes[-1])
+    return stitch_tiles(rows, grid_shape[:-1], axes[:-1])
+
+
+# the partial aggregates every aggregation is computed from, the partials of the tiles are combined on the client
+_PARTIALS = {'MIN': ('min',), 'MAX': ('max',), 'SUM': ('sum',), 'COUNT': ('count',), 'AVG': ('sum', 'cells')}
+# the WCPS expression of every partial, 'cells' counts the values and leaves out NaN, which isn't equal to itself
+_PARTIAL_EXPRESSIONS = {'min': 'min({0})', 'max': 'max({0})', 'sum': 'sum({0})', 'count': 'count({0})',
+                        'cells': 'count(({0}) = ({0}))'}
+_PARTIAL_COMBINE = {'min': min, 'max': max, 'sum': math.fsum, 'count': math.fsum, 'cells': math.fsum}
+
+
+# several expressions returned together as the bands of one composite value
+def composite_expression(expressions):
+    """
+    Constructs a WCPS composite value, which returns several expressions in one result.
+
+    Parameters:
+        expressions (dict): The expression of every band, by the band name.
+
+    Returns:
+        str: The composite value.
+
+    Example:
+        >>> composite_expression({'min': 'min($c)', 'max': 'max($c)'})
+        '{min: min($c); max: max($c)}'
+    """
+    return '{' + '; '.join(f'{name}: {expression}' for name, expression in expressions.items()) + '}'
+
+
+# function needed for converting the byte string of a composite value to a record
+def byte_to_record(byte_str, names):
+    """
+    Converts the byte string of a composite value into a dict of its bands.
+
+    Parameters:
+        byte_str (bytes): The byte string to be converted, e.g. b'{-3.2 24.5}' or b'-3.2,24.5'.
+        names (list of str): The names of the bands, in order.
+
+    Returns:
+        dict: The value of every band, by its name.
+
+    Raises:
+        ValueError: If the number of values doesn't match the number of names.
+
+    Example:
+        >>> byte_to_record(b'{-3.2 24.5}', ['min', 'max'])
+        {'min': -3.2, 'max': 24.5}
+    """
+    values = [float(value) for value in bytes(byte_str).translate(_CSV_BLANKS).split()]
+    if len(values) != len(names):
+        raise ValueError("The number of values doesn't match the number of names")
+    return dict(zip(names, values))
+
+
+# the exact aggregate from the combined partial aggregates
+def finish_aggregate(aggregation, partials):
+    """
+    Computes an aggregate from the partial aggregates of all the tiles combined.
+
+    Parameters:
+        aggregation (str): 'MIN', 'MAX', 'AVG', 'SUM' or 'COUNT'.
+        partials (dict): The combined partial aggregates, e.g. {'sum': 10.0, 'cells': 4.0} for 'AVG'.
+
+    Returns:
+        float: The aggregate.
+
+    Example:
+        >>> finish_aggregate('AVG', {'sum': 10.0, 'cells': 4.0})
+        2.5
+    """
+    if aggregation == 'AVG':
+        return partials['sum'] / partials['cells'] if partials['cells'] > 0 else float('nan')
+    return partials[_PARTIALS[aggregation][0]]
+
+
+# a variable is a '$' followed by everything up to the first delimiter
+_VAR_NAME = re.compile(r'\$[^ ,()\[\]{};><+\-=./\\|!]*')
+# the same, with line breaks and tabs ending a variable name as well
+_VAR_TOKEN = re.compile(r'\$[^ \t\r\n,()\[\]{};><+\-=./\\|!]*')
+
+
+# the variable names of an expression, the builder methods check the same expressions repeatedly
+@functools.lru_cache(maxsize = 1024)
+def _var_names(string):
+    return tuple(_VAR_NAME.findall(string))
+
+
+@functools.lru_cache(maxsize = 1024)
+def _var_tokens(string):
+    return frozenset(_VAR_TOKEN.findall(string))
+
+
+# datacube object
+class dco:
+    # initializing the dco
+    def __init__(self, dbc_being_used):
+        """
+        Initializes a dco instance which manages WCPS queries using a dbc object for server communication.
+
+        Parameters:
+            dbc_being_used (dbc or AsyncDbc): An instance of dbc used for server communication. With an
+                AsyncDbc the query must be run by execute_async().
+
+        Example:
+            >>> datacube = dco(database_connection)
+        """
+        if not isinstance(dbc_being_used, (dbc, AsyncDbc)):
+            raise TypeError("dbc instance not passed")
+        
+        self.DBC = dbc_being_used
+        # default values
+        self.vars = []
+        self.Subsets = []
+        self.aggregation = None
+        self.format = None
+        self.aggregation_condition = None
+        self.filter_condition = None
+        self.var_names = []
+        self.transformation = None
+        self.encode_as = None
+        self.array_dtype = None
+        
+    def reset(self):
+        """
+        Resets the attributes of the dco instance to their default values, except for the dbc connection
+            which remains unchanged.
+
+        Returns:
+            self: Returns the instance itself with reset values.
+
+        Example:
+            >>> datacube.reset()
+        """
+        self.vars = []
+        self.Subsets = []
+        self.aggregation = None
+        self.format = None
+        self.count_condition = None
+        self.filter_condition = None
+        self.var_names = []
+        self.transformation = None
+        self.encode_as = None
+        self.array_dtype = None
+        return self
+
+    def freeze(self):
+        """
+        Creates an immutable copy of the dco instance, which can be used as a query template
+            and shared between threads.
+
+        Returns:
+            FrozenDco: An immutable dco with the same variables, subsets and operations.
+
+        Example:
+            >>> template = datacube.initialize_var("$c in (AvgLandTemp)").freeze()
+        """
+        return FrozenDco._from_state(self.__dict__)
+
+    
+    def get_all_var_names(self, string):
+        """
+        Extracts all variable names from a string where variables are prefixed by '$' and can be
+            followed by various delimiters such as spaces, commas, parentheses, etc.
+
+        Parameters:
+            string (str): A string potentially containing multiple variables each prefixed by '$'.
+
+        Returns:
+            list: A list of extracted variable names. Returns an empty list if no variables are found.
+
+        Example:
+            >>> var_names = get_all_var_names("$a>15 and $b")
+            >>> print(var_names)
+            ['$a', '$b']
+        """
+        # the names are found in one pass of a precompiled pattern, and cached per expression
+        var_names = _var_names(string)
+        if len(var_names) == 0:
+            return None
+        return list(var_names)
+
+    
+    def initialize_var(self, s):
+        """
+        Initializes a variable for the datacube object. This method extracts the variable name from 
+            the input,checks if it's successfully defined, and then appends the variable along with
+            its associated datacube to the respective lists within the dco instance.
+
+        Parameters:
+            s (str): A string that combines the variable name and its associated datacube,
+                formatted as '$variable_name in (coverage_name)'.
+
+        Returns:
+            self: Returns the instance itself if the variable is successfully added.
+            
+        Raises:
+            ValueError: If the format of the variable initialization wasn't correct  
+
+        Example:
+            >>> datacube.initialize_var("$c in (AvgLandTemp)")
+        """
+        if not isinstance(s, str):
+            raise TypeError("Value entered must be a string.")
+        # specifying  that s string must be formatted like: '$variable_name in (coverage_name)'
+        if not(s.startswith('$') and " in (" in s and s.endswith(')')):
+            raise ValueError("The format of variable initialization wasn't correct")
+        
+        var_name = self.get_all_var_names(s)[0]
+        self.vars.append(s)
+        #No subset has been defined yet
+        self.Subsets.append(None)
+        self.var_names.append(var_name)
+        return self
+    
+    def do_vars_exist(self, string):
+        """
+        Checks whether all variable names extracted from the input string exist in the predefined list of
+        variable names of the current instance. This method is useful for validating that variables
+        referenced in a string (e.g., a query or command) are all recognized by the system
+        before proceeding with further operations.
+
+        Parameters:
+            string (str): The string from which variable names are extracted and checked.
+                Variables in the string should be prefixed by '$'.
+
+        Returns:
+            bool: True if all extracted variables exist in the instance's variable list.
+
+        Raises:
+            ValueError: If no variables are specified in the string, or
+            if one or more variables do not exist in the instance's list of variables.
+
+        Example:
+            >>> datacube.do_vars_exist("$temp and $pressure")
+            True
+            >>> datacube.do_vars_exist("$humidity")
+            Traceback (most recent call last):
+            ...
+            ValueError: Variables in a string don't exist
+        """
+        # line breaks and tabs end a variable name like spaces do
+        var_names = _var_tokens(string)
+        if len(var_names) != 0:
+            if var_names.issubset(self.var_names):
+                return True
+            else:
+                raise ValueError("Variables in a string don't exist")
+        else:
+            raise ValueError("Variables weren't specified")
+        
+        
+    def subset(self, subset, var_name):
+        """
+        Adds a subset specification for a specific variable in the datacube object. This method
+            identifies the variable by its name, then associates the specified subset with it, updating
+            the internal state of the dco instance.
+
+        Parameters:
+            subset (str): The subset condition to apply, typically specifying a range or filter for the
+                data retrieval.
+            var_name (str): The name of the variable to which the subset will be applied. This variable
+                must already be initialized in the dco instance.
+
+        Returns:
+            self: Returns the instance itself after updating the subset for the specified variable,
+                allowing for method chaining.
+
+        Example:
+            >>> datacube.subset(var_name = '$c',
+                subset = 'Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")')
+        """
+        if not isinstance(subset, str):
+            raise TypeError("Value entered must be a string.")
+        if not isinstance(var_name, str):
+            raise TypeError("Value entered must be a string.")
+        if not(var_name in self.var_names):
+            raise ValueError("Such variable doesn't exist")
+        # index of the variable name in the var_names list
+        idx = self.var_names.index(var_name)
+        # Update the subset specification at the corresponding index in the Subsets list
+        self.Subsets[idx] = subset
+        return self
+        
+    def where(self, filter_condition):
+        """
+        Sets a filter condition for the datacube query. This method allows specifying conditions that
+            filter the data according to certain criteria, similar to a SQL WHERE clause. The specified
+            condition will be applied when the query is executed to filter the results.
+
+        Parameters:
+            filter_condition (str): A string representing the condition to be applied to filter the data.
+                This condition should be formatted according to the expected WCPS syntax.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining and further configuration.
+
+        Example:
+            >>> datacube.where("$c > 20 and $c < 50")
+        """
+    
+        if not isinstance(filter_condition, str):
+            raise TypeError("Value entered must be a string.")
+        self.do_vars_exist(filter_condition)
+        self.filter_condition = filter_condition
+        return self
+    
+
+    def set_format(self, output_format):
+        """
+        Sets the output format for data retrieved from the datacube. This method allows the user to specify 
+        the format in which the data should be returned after a query is executed, enabling different
+        types of data processing.
+
+        Parameters:
+            output_format (str): The format to set for output data. Valid options are "CSV", "PNG", "JPEG",
+                and the binary "GTiff" and "netCDF", which are decoded into arrays without parsing text.
+
+        Returns:
+            self: Returns the instance itself after setting the output format, allowing for method chaining.
+
+        Example:
+            >>> datacube.set_format("PNG")
+        """
+        if not isinstance(output_format, str):
+            raise TypeError("Value entered must be a string.")
+        if not (output_format in ['PNG', 'CSV', 'JPEG', 'GTiff', 'netCDF']):
+            raise ValueError("Entered format doesn't exist")
+        self.format = output_format
+        return self
+    
+
+    def as_array(self, dtype = 'float64'):
+        """
+        Makes execute() return the numbers as a numpy array instead of a list of floats. The array keeps
+            the shape of the returned grid, see byte_to_ndarray(). PNG and JPEG results are decoded into
+            an array of height x width x bands, see decode_image(). GTiff and netCDF results are always arrays,
+            as_array() converts them to the dtype.
+
+        Parameters:
+            dtype (str, optional): The type of the array, 'float64', 'float32' or, for images, 'uint8'.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.set_format("CSV").as_array('float32')
+        """
+        if not isinstance(dtype, str):
+            raise TypeError("Value entered must be a string.")
+        if not (dtype in ['float64', 'float32', 'uint8']):
+            raise ValueError("Entered dtype isn't supported")
+        self.array_dtype = dtype
+        return self
+    
+        
+    # aggregation methods
+    def min(self, condition = None):
+        """
+        Configures the datacube to compute the minimum value of the specified data subset when executed.
+            An optional condition can specify the subset or criteria for the aggregation.
+
+        Parameters:
+            condition (str, optional): A condition that defines the subset of data for
+                which the minimum is calculated.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.min("$c > 20")
+        """
+        #if condition is provided, check if it's a string and if all the variables are pre-defined
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.do_vars_exist(condition)
+        self.aggregation_condition = condition
+        self.aggregation = 'MIN'
+        return self
+        
+    def max(self, condition = None):
+        """
+        Configures the datacube to compute the maximum value of the specified data subset when executed.
+            An optional condition can specify the subset or criteria for the aggregation.
+
+        Parameters:
+            condition (str, optional): A condition that defines the subset of data for
+                which the minimum is calculated.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.max("$c > 20")
+        """
+        #if condition is provided, check if it's a string and if all the variables are pre-defined
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.do_vars_exist(condition)
+        self.aggregation_condition = condition
+        self.aggregation = 'MAX'
+        return self
+    
+    def avg(self, condition = None):
+        """
+        Configures the datacube to compute the average value of the specified data subset when executed.
+            An optional condition can specify the subset or criteria for the aggregation.
+
+        Parameters:
+            condition (str, optional): A condition that defines the subset of data for
+                which the minimum is calculated.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.avg("$c > 20")
+        """
+        #if condition is provided, check if it's a string and if all the variables are pre-defined
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.do_vars_exist(condition)
+        self.aggregation_condition = condition
+        self.aggregation = 'AVG'
+        return self
+    
+    def sum(self, condition = None):
+        """
+        Configures the datacube to compute the sum of values across the specified data subset when executed.
+            An optional condition can specify the subset or criteria for the aggregation.
+
+        Parameters:
+            condition (str, optional): A condition that defines the subset of data for
+                which the minimum is calculated.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.sum("$c > 20")
+        """
+        #if condition is provided, check if it's a string and if all the variables are pre-defined
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.do_vars_exist(condition)
+        self.aggregation_condition = condition
+        self.aggregation = 'SUM'
+        return self
+        
+    def count(self, condition = None):
+        """
+        Configures the datacube to count the number of data points that meet the specified
+            condition when executed.
+
+        Parameters:
+            condition (str, optional): A condition that specifies the criteria that data
+                points must meet to be counted.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.count("$c > 20")
+        """
+        #if condition is provided, check if it's a string and if all the variables are pre-defined
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.do_vars_exist(condition)
+        self.aggregation = 'COUNT'
+        self.aggregation_condition = condition
+        return self
+
+    def stats(self, aggregations, condition = None):
+        """
+        Configures the datacube to compute several aggregates of the same data in one query when executed,
+            e.g. its minimum, maximum and average. The server scans the data once and returns all of them
+            together, and execute() returns them as a dict. Like with the other aggregation methods, only
+            the last aggregation method used is applied.
+
+        Parameters:
+            aggregations (list of str): The aggregates to compute, any of "MIN", "MAX", "AVG", "SUM" and "COUNT".
+            condition (str, optional): A condition that defines the subset of data for
+                which the aggregates are calculated.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.stats(["MIN", "MAX", "AVG"]).execute()
+            {'min': -3.2, 'max': 24.5, 'avg': 10.1}
+        """
+        if not isinstance(aggregations, (list, tuple)) or len(aggregations) == 0:
+            raise TypeError("Aggregations must be a non-empty list of strings.")
+        for aggregation in aggregations:
+            if not isinstance(aggregation, str):
+                raise TypeError("Value entered must be a string.")
+            if not (aggregation in ['MIN', 'MAX', 'AVG', 'SUM', 'COUNT']):
+                raise ValueError("Entered aggregation doesn't exist")
+        if len(set(aggregations)) != len(aggregations):
+            raise ValueError("Every aggregation can be used once")
+        #if condition is provided, check if it's a string and if all the variables are pre-defined
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.do_vars_exist(condition)
+        self.aggregation_condition = condition
+        self.aggregation = tuple(aggregations)
+        return self
+    
+    def replace_variables_with_subsets(self, str_to_transform = None):
+        """
+        Replaces variables in a given string with their corresponding subsets if defined.
+            If no string is provided, it constructs a string representation of
+            all variables and their subsets.
+
+        Parameters:
+            str_to_transform (str, optional):
+                A string containing variable names that need to be replaced with their subsets.
+
+        Returns:
+            str: A new string with variables replaced by their subsets,
+                or a concatenated string of all variables and subsets.
+
+        Example:
+            >>> datacube.replace_variables_with_subsets("abs($c - 200)")
+            >>> "abs($c[corresponding_subset] - 200)"
+        """
+        #This distinction is critical as it determines the course of action
+        #code will either modifying an existing string or creating a new list of all variables and their subsets.
+        if str_to_transform != None:
+            # the subsetted form of every variable which has a subset
+            substitutions = {var: f'{var}[{subset}]' for var, subset in zip(self.var_names, self.Subsets)
+                             if subset != None}
+            if len(substitutions) == 0:
+                return str_to_transform
+            # every variable token is looked up once, so '$c' doesn't match inside '$cloud' and
+            # the text of a substituted subset isn't substituted again
+            return _VAR_TOKEN.sub(lambda match: substitutions.get(match.group(0), match.group(0)), str_to_transform)
+        else:
+            expression = ''
+            for var, subset in zip(self.var_names, self.Subsets):
+                if subset != None:
+                    # If a subset exists, append the variable and its subset in bracketed form
+                    expression += f'''{var}[{subset}] '''
+                else:
+                    #If no subset exists, simply append the variable
+                    expression += f'''{var}'''
+            return expression
+    
+    def transform_data(self, operation):
+        """
+        Sets a transformation operation to be applied to the datacube when the query is executed.
+
+        Parameters:
+            operation (str): A string representing the transformation operation to be applied.
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.transform_data("abs($c - 3.6 * $c)")
+        """
+        if not isinstance(operation, str):
+            raise TypeError("Value entered must be a string.")
+        self.do_vars_exist(operation)
+        self.transformation = operation
+        return self
+    
+    def encode(self, operation):
+        """
+        Specifies the encoding operation to be applied to the output of the query.
+
+        Parameters:
+            operation (str): A string representing the encoding function, such as "encode".
+
+        Returns:
+            self: Returns the instance itself, allowing for method chaining.
+
+        Example:
+            >>> datacube.encode("
+                switch 
+                    case $c = 99999 
+                        return {red: 255; green: 255; blue: 255} 
+                    case 18 > $c
+                        return {red: 0; green: 0; blue: 255} 
+                    case 23 > $c
+                        return {red: 255; green: 255; blue: 0} 
+                    case 30 > $c
+                        return {red: 255; green: 140; blue: 0} 
+                    default return {red: 255; green: 0; blue: 0}
+            ")
+        """
+        # Ensure the operation is a string, convert if not
+        if not isinstance(operation, str):
+            operation = str(operation)
+        # Ensure all variables used in the operation are recognized by the datacube    
+        if self.get_all_var_names(operation) != None:
+            self.do_vars_exist(operation)
+        self.encode_as = operation
+        return self
+        
+            
+    # method, which returns the result after using aggregation functions
+    def aggregate_data(self):
+        """
+        Constructs a part of the WCPS query for performing aggregation functions based on the current settings.
+
+        Returns:
+            str: A string representing the aggregation part of the WCPS query.
+
+        Example:
+            >>> query_part = datacube.aggregate_data()
+        """
+
+        # The `helper_query` contains the conditions and/or
+        # subsets that have been applied to the variables in the datacube.
+        # helper_query will betargeted specifically for preforming aggregation functions later on
+        helper_query = self.replace_variables_with_subsets(self.aggregation_condition)
+        # several aggregates are returned together as the bands of one composite value
+        if isinstance(self.aggregation, tuple):
+            query = composite_expression({name.lower(): f'{name.lower()}({helper_query})' for name in self.aggregation})
+        elif self.aggregation == 'MIN':
+            query = f'''min({helper_query})'''
+        elif self.aggregation == 'AVG':
+            query = f'''avg({helper_query})'''
+        elif self.aggregation == 'MAX':
+            query = f'''max({helper_query})'''
+        elif self.aggregation == 'SUM':
+            query = f'''sum({helper_query})'''
+        elif self.aggregation == 'COUNT':
+            query = f'''count({helper_query})'''
+        return query
+    
+    def return_format(self):
+        """
+        Determines the format for the output based on the configured settings of the datacube.
+
+        Returns:
+            str: A string indicating the desired output format for the WCPS query.
+
+        Example:
+            >>> output_format = datacube.return_format()
+        """
+        if self.format == 'CSV':
+            query = "text/csv" # if the desired format of the output is text/csv
+        elif self.format == 'PNG':
+            query = "image/png" # if the desired format of the output is image/png:
+        elif self.format == 'JPEG': 
+            query = "image/jpeg" # if the desired format of the output is image/jpeg:
+        elif self.format == 'GTiff':
+            query = "image/tiff" # if the desired format of the output is a GeoTIFF:
+        elif self.format == 'netCDF':
+            query = "application/netcdf" # if the desired format of the output is netCDF:
+        return query
+    
+    
+    # the part of the query before the returned expression
+    def query_head(self):
+        """
+        Constructs the beginning of the WCPS query, with the variables, the filter condition and 'return'.
+
+        Returns:
+            str: The part of the query which comes before the returned expression.
+
+        Example:
+            >>> datacube.query_head()
+            'for $c in (AvgLandTemp)\nreturn \n'
+        """
+        query = '''for '''
         for var in self.vars:
             query += (var + '\n')
         
@@ -595,58 +3395,1109 @@ class dco:
         if self.filter_condition != None:
             query += f'''where {self.filter_condition}\n'''
         query += f'''return \n'''
+        return query
+
+    # the function, which converts operations from the dco object to the query
+    def to_wcps_query(self):
+        """
+        Constructs a WCPS query string from the current state of the dco instance.
+
+        Returns:
+            str: A string that represents the complete WCPS query based on the current state of the
+                dco instance
+
+        Example:
+            >>> query = datacube.to_wcps_query()
+        """
+        query = self.query_head()
         
         # we check if any of the aggregation functions were used. If they were, we add them to the query and return.
         if self.aggregation != None:
-            query += self.aggregate_data()
-            return query
-        
-        # we check if the encoding conditions were specified. If they were, we will add them to 'return'
-        if self.encode_as != None:
-            helper_query = self.replace_variables_with_subsets(self.encode_as)
-        # encoding condition wasn't specified, so we check transformation operation
-        elif self.transformation != None:
-            helper_query = self.replace_variables_with_subsets(self.transformation)
-        # transformation wasn't used as well, so we just return a variable with the corresponding subset
-        else:
-            helper_query = self.replace_variables_with_subsets()
-        
-        # if the format was specified, we write encode() to the query
-        if self.format != None: # we check whether the format was specified
-            query += f'''encode({helper_query}, "{self.return_format()}")'''
-        # if the encoding or data transformation were used, we must include encode()
-        elif self.encode_as != None or self.transformation != None:
-            query += f'''encode({helper_query}, "text/csv")'''
-        else:
-            query += f'''{helper_query}'''
-        return query
-    
-    
-    # executing, when all the operations were added
-    def execute(self):
+            query += self.aggregate_data()
+            return query
+        
+        # we check if the encoding conditions were specified. If they were, we will add them to 'return'
+        if self.encode_as != None:
+            helper_query = self.replace_variables_with_subsets(self.encode_as)
+        # encoding condition wasn't specified, so we check transformation operation
+        elif self.transformation != None:
+            helper_query = self.replace_variables_with_subsets(self.transformation)
+        # transformation wasn't used as well, so we just return a variable with the corresponding subset
+        else:
+            helper_query = self.replace_variables_with_subsets()
+        
+        # if the format was specified, we write encode() to the query
+        if self.format != None: # we check whether the format was specified
+            query += f'''encode({helper_query}, "{self.return_format()}")'''
+        # if the encoding or data transformation were used, we must include encode()
+        elif self.encode_as != None or self.transformation != None:
+            query += f'''encode({helper_query}, "text/csv")'''
+        else:
+            query += f'''{helper_query}'''
+        return query
+    
+    
+    # compiling the query once into a template, whose placeholders are filled in for every request
+    def prepare(self):
+        """
+        Compiles the constructed WCPS query into a template. Placeholders like '@lat' or '@t0', written
+            anywhere in the subsets, conditions or operations, become parameters which bind() fills in.
+            The query is validated and built only once, binding just joins the parts of the query with the values.
+
+        Returns:
+            PreparedQuery: The compiled template.
+
+        Example:
+            >>> datacube.subset(var_name = '$c', subset = 'Lat(@lat), Long(@long), ansi("@t0":"@t1")').avg()
+            >>> template = datacube.prepare()
+            >>> template.execute(lat = 53.08, long = 8.80, t0 = '2014-01', t1 = '2014-12')
+        """
+        return PreparedQuery(self)
+
+    # converting the content of a response to the data in the requested format
+    def decode_response(self, content):
+        """
+        Processes the content of the server's response based on the specified format.
+
+        Parameters:
+            content (bytes): The body of the server's response.
+
+        Returns:
+            Varies: The processed data as per the requested format 
+                (CSV as list or array, PNG/JPEG as image object, GTiff as array, netCDF as dict of arrays,
+                or list of numbers).
+
+        Example:
+            >>> data = datacube.decode_response(b'1.0,2.0,3.0')
+        """
+        # the binary formats are read into typed arrays, which are views of the content when possible
+        if self.format == 'GTiff':
+            return _convert_arrays(read_tiff(content), self.array_dtype)
+        if self.format == 'netCDF':
+            return _convert_arrays(read_netcdf(content), self.array_dtype)
+        if self.format == 'PNG' or self.format == 'JPEG': # if the format is PNG or JPEG, return the image
+            if self.array_dtype != None:
+                return decode_image(content, self.array_dtype)
+            return content
+        # the composite value of several aggregates is split into a record with their names
+        if isinstance(self.aggregation, tuple):
+            return byte_to_record(content, [name.lower() for name in self.aggregation])
+        # if an array was requested, the numbers are parsed straight from the bytes into an array of the grid's shape
+        if self.array_dtype != None:
+            return byte_to_ndarray(content, self.array_dtype)
+        # if the format is CSV or wasn't specified, convert binary string to the list of numbers
+        return byte_to_list(content)
+
+    def result_kind(self):
+        """
+        Describes how decode_response() turns a response into the result. Results of the same query
+            decoded in different ways are cached apart.
+
+        Returns:
+            str: A short description of the decoding.
+
+        Example:
+            >>> datacube.set_format('CSV').as_array('float32').result_kind()
+            'CSV/float32'
+        """
+        if self.array_dtype != None:
+            return f'{self.format}/{self.array_dtype}'
+        return str(self.format)
+
+
+    # executing, when all the operations were added
+    def execute(self):
+        """
+        Executes the constructed WCPS query and processes the response based on the specified format.
+
+        Returns:
+            Varies: The processed data as per the requested format 
+                (CSV as list, PNG/JPEG as image object, or list of numbers).
+
+        Example:
+            >>> output = datacube.execute()
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        start = time.perf_counter()
+        wcps_query = self.to_wcps_query() # get a WCPS query
+        record = None
+        if self.DBC.metrics != None:
+            record = QueryRecord(wcps_query, self.result_kind(), build = time.perf_counter() - start)
+        # pass the WCPS query to the server and decode the response, unless the result is already cached
+        data = self.DBC.run_query(wcps_query, self.decode_response, self.result_kind(), _record = record)
+        self.reset() # returning the values of the dco instance to default
+        return data
+
+    # executing, the response is read in chunks instead of all at once
+    def iter_execute(self, chunk_size = 1024 * 1024):
+        """
+        Executes the constructed WCPS query and yields the result block by block while the response is read,
+            so the memory used doesn't grow with the size of the response. Numeric results come out as flat
+            blocks of values (lists, or arrays after as_array()), the other formats as chunks of bytes.
+            The query is built and the dco is reset right away, the request is sent on the first iteration.
+
+        Parameters:
+            chunk_size (int, optional): The number of bytes read from the connection at a time.
+
+        Returns:
+            generator: Yields the blocks of the result in order.
+
+        Example:
+            >>> total = sum(sum(block) for block in datacube.set_format("CSV").iter_execute())
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        wcps_query = self.to_wcps_query() # get a WCPS query
+        connection, output_format, dtype = self.DBC, self.format, self.array_dtype
+        self.reset() # returning the values of the dco instance to default
+
+        def blocks():
+            with connection.send_query(wcps_query, stream = True) as response:
+                chunks = response.iter_content(chunk_size = chunk_size)
+                if output_format in ('PNG', 'JPEG', 'GTiff', 'netCDF'):
+                    yield from chunks
+                else:
+                    yield from iter_csv_values(chunks, dtype)
+        return blocks()
+
+    # executing and writing the response to a file
+    def execute_to(self, target, chunk_size = 1024 * 1024):
+        """
+        Executes the constructed WCPS query and writes the undecoded response straight to a file or a writable
+            binary buffer, chunk by chunk, without holding the whole response in memory.
+
+        Parameters:
+            target (str or file object): A path of the file to write, or an object with a write() method.
+            chunk_size (int, optional): The number of bytes read from the connection at a time.
+
+        Returns:
+            int: The number of bytes written.
+
+        Example:
+            >>> datacube.set_format("PNG").execute_to("temperature.png")
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        if not (isinstance(target, (str, os.PathLike)) or hasattr(target, 'write')):
+            raise TypeError("target must be a path or a writable file object.")
+        wcps_query = self.to_wcps_query() # get a WCPS query
+        self.reset() # returning the values of the dco instance to default
+        written = 0
+        with self.DBC.send_query(wcps_query, stream = True) as response:
+            file = open(target, 'wb') if isinstance(target, (str, os.PathLike)) else target
+            try:
+                for chunk in response.iter_content(chunk_size = chunk_size):
+                    file.write(chunk)
+                    written += len(chunk)
+            finally:
+                if file is not target:
+                    file.close()
+        return written
+
+    # executing into a ResultStore, a result stored before is opened instead of being downloaded again
+    def execute_stored(self, store, chunk_size = 1024 * 1024):
+        """
+        Executes the constructed WCPS query into an on-disk store and returns the result backed by its file.
+            If the same query was stored before, in this or an earlier run, the stored file is opened
+            and nothing is downloaded. The response is decoded while it's read, so results much larger
+            than the memory can be stored.
+
+        Parameters:
+            store (ResultStore): The store of the results.
+            chunk_size (int, optional): The number of bytes read from the connection at a time.
+
+        Returns:
+            numpy.memmap or dict: A read-only array mapped from its file, a dict of them for netCDF results.
+                GTiff and netCDF results keep the type of their file, the others get the dtype of as_array().
+
+        Example:
+            >>> store = ResultStore("results")
+            >>> datacube.subset(var_name = '$c', subset = 'ansi("2000-01":"2014-12")').set_format("CSV")
+            >>> temperature = datacube.execute_stored(store)
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        if not isinstance(store, ResultStore):
+            raise TypeError("store must be a ResultStore instance.")
+        if self.aggregation != None:
+            raise ValueError("Aggregated results can't be stored, they are run with execute()")
+        wcps_query = self.to_wcps_query() # get a WCPS query
+        kind, output_format, dtype = self.result_kind(), self.format or 'CSV', self.array_dtype
+        connection = self.DBC
+        self.reset() # returning the values of the dco instance to default
+        key = store.make_key(connection.server_url, wcps_query, kind)
+        result = store.open(key)
+        if result is None:
+            with connection.send_query(wcps_query, stream = True) as response:
+                store.write(key, response.iter_content(chunk_size = chunk_size), output_format, dtype,
+                            {'query': wcps_query, 'url': connection.server_url, 'kind': kind})
+            result = store.open(key)
+        return result
+
+    # executing only the part of a time series which wasn't fetched by the earlier runs
+    def execute_incremental(self, var_name, store, axis = 'ansi', dtype = 'float64'):
+        """
+        Executes the constructed WCPS query for a time range, fetching only the time slices after the ones
+            stored by the earlier runs, and returns the whole series. The series is identified by the query
+            without the end of the time range, so e.g. 'ansi("2000-01":"<now>")' run every month downloads
+            one new slice each time. The time axis must be the first axis of the result, as it is in most
+            datacubes. The dates of the slices aren't returned by the server, so the time axis must have exactly
+            one slice for every year, month or day of the range, as written in its bounds, and the coverage
+            must cover the whole range: a range which ends after the last slice of the coverage, or an axis with
+            gaps or a coarser step, like quarterly data asked for by months, is rejected and nothing is stored.
+
+        Parameters:
+            var_name (str): The variable whose subset holds the time range, e.g. '$c'.
+            store (SeriesStore): The store of the series.
+            axis (str, optional): The name of the time axis in the subset.
+            dtype (str, optional): The type of the stored values, 'float64' or 'float32'.
+
+        Returns:
+            numpy.memmap: The series from the start to the end of the range, backed by its file.
+
+        Raises:
+            ValueError: If the server returned a different number of slices than the range has years, months
+                or days.
+
+        Example:
+            >>> store = SeriesStore("series")
+            >>> datacube.subset(var_name = '$c', subset = 'Lat(53.08), Long(8.80), ansi("2000-01":"2024-06")')
+            >>> temperature = datacube.execute_incremental('$c', store)
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        if not isinstance(store, SeriesStore):
+            raise TypeError("store must be a SeriesStore instance.")
+        if self.aggregation != None:
+            raise ValueError("Aggregated results can't be extended by new time slices")
+        if self.format in ('PNG', 'JPEG', 'GTiff', 'netCDF'):
+            raise ValueError("Only CSV results can be extended by new time slices")
+        if not (var_name in self.var_names):
+            raise ValueError("Such variable doesn't exist")
+        subset = self.Subsets[self.var_names.index(var_name)]
+        parts = split_subset(subset) if subset != None else []
+        names = [parse_axis_interval(part)[0] for part in parts]
+        if not (axis in names):
+            raise ValueError(f"The subset has no axis {axis}")
+        position = names.index(axis)
+        _, low, high = parse_axis_interval(parts[position])
+        precision, start = _date_to_ordinal(low.strip('"'))
+        high_precision, end = _date_to_ordinal((high or low).strip('"'))
+        if precision == None or precision != high_precision:
+            raise ValueError("The time range needs dates like 2014, 2014-01 or 2014-01-31 of the same precision")
+        if end < start:
+            raise ValueError("The time range ends before it starts")
+        quote = '"' if low.startswith('"') else ''
+        template = self.freeze().as_array(dtype)
+        self.reset() # returning the values of the dco instance to default
+
+        def with_range(first, last):
+            range_parts = list(parts)
+            range_parts[position] = f'{axis}({first}:{last})'
+            return template.subset(var_name = var_name, subset = ', '.join(range_parts))
+
+        # the end of the range is left out of the key, the rest of the query identifies the series
+        key = store.make_key(template.DBC.server_url, with_range(low, '*').to_wcps_query(), template.result_kind())
+        state = store.state(key)
+        origin = start
+        if state != None:
+            start = _date_to_ordinal(state['last'].strip('"'))[1] + 1
+        if start <= end:
+            first = quote + _ordinal_to_date(precision, start) + quote
+            last = quote + _ordinal_to_date(precision, end) + quote
+            query = with_range(first, last)
+            values = template.DBC.run_query(query.to_wcps_query(), query.decode_response, query.result_kind())
+            requested = end - start + 1
+            returned = len(values) if values.ndim > 0 else values.size
+            # the last date is only known from the number of slices, which must be one for every unit of the range
+            if values.ndim == 0 or returned != requested:
+                raise ValueError(f"The server returned {returned} time slices for the {requested} {precision}s "
+                                 f"from {first} to {last}: the time axis must be the first axis of the result, "
+                                 f"have one slice for every {precision} and cover the whole range")
+            store.append(key, values, low, last,
+                         {'query': with_range(low, '*').to_wcps_query(), 'url': template.DBC.server_url})
+        # the slices stored by a run with a later end are left out
+        return store.open(key)[:end - origin + 1]
+
+    # the queries of a grid of tiles, which split the subset of a variable along some of its axes
+    def tile_queries(self, var_name, tiles, resolution = None, origin = None):
+        """
+        Splits the subset of a variable into a grid of tiles and creates a query for every tile. The queries
+            are FrozenDco instances, which differ from this query only in the subset of the variable.
+
+        Parameters:
+            var_name (str): The variable whose subset is split, e.g. '$c'.
+            tiles (dict): The tile size of every tiled axis, see execute_tiled().
+            resolution (dict, optional): The grid step of every tiled axis with non-integer coordinates,
+                negative for a descending axis.
+            origin (dict, optional): The coordinate of a cell of every tiled axis whose cells aren't on the low bound
+                of the subset plus multiples of the resolution.
+
+        Returns:
+            tuple: The number of tiles along every tiled axis, and a dict of the queries by their index in the grid.
+
+        Example:
+            >>> grid_shape, queries = datacube.tile_queries('$c', {'ansi': 12})
+        """
+        if not isinstance(tiles, dict) or len(tiles) == 0:
+            raise TypeError("tiles must be a non-empty dict of tile sizes.")
+        if not (var_name in self.var_names):
+            raise ValueError("Such variable doesn't exist")
+        subset = self.Subsets[self.var_names.index(var_name)]
+        if subset == None:
+            raise ValueError("The variable has no subset to split")
+        resolution = resolution if resolution != None else {}
+        origin = origin if origin != None else {}
+
+        parts = split_subset(subset)
+        names = [parse_axis_interval(part)[0] for part in parts]
+        tiled = []
+        for name, tile_size in tiles.items():
+            if not (name in names):
+                raise ValueError(f"The subset has no axis {name}")
+            position = names.index(name)
+            _, low, high = parse_axis_interval(parts[position])
+            if high == None:
+                raise ValueError(f"The axis {name} is sliced and can't be tiled")
+            tiled.append((position, tile_interval(low, high, tile_size, resolution.get(name), origin.get(name))))
+
+        template = self.freeze()
+        jobs = {}
+        for index in itertools.product(*(range(len(intervals)) for _, intervals in tiled)):
+            tile_parts = list(parts)
+            for (position, intervals), i in zip(tiled, index):
+                low, high = intervals[i]
+                tile_parts[position] = f'{names[position]}({low}:{high})'
+            jobs[index] = template.subset(var_name = var_name, subset = ', '.join(tile_parts))
+        grid_shape = tuple(len(intervals) for _, intervals in tiled)
+        return grid_shape, jobs
+
+    # executing a large subset as many smaller queries and joining their results
+    def execute_tiled(self, var_name, tiles, axes = None, resolution = None, max_workers = 4, origin = None):
+        """
+        Executes the constructed WCPS query as a grid of smaller queries, which split the subset of a variable
+            into tiles along one or more axes, fetches the tiles in parallel and stitches them into one array.
+            A tile which fails is sent again on its own, by the retries of the connection. The result is decoded
+            like after as_array(), so the query must return numbers and can't be aggregated.
+
+        Parameters:
+            var_name (str): The variable whose subset is split, e.g. '$c'.
+            tiles (dict): The tile size of every tiled axis, e.g. {'ansi': 12} for a year of monthly data.
+                Dates are counted in their own units (years, months or days), other axes in coordinates.
+            axes (dict, optional): The axis of the result array every tiled axis corresponds to. By default
+                the tiled axes are the first axes of the result, in the order of tiles.
+            resolution (dict, optional): The grid step of every tiled axis with non-integer coordinates.
+                An axis stored in descending order, like Lat in most EPSG:4326 coverages, has a negative step,
+                so its tiles are stitched from the highest coordinates down.
+            max_workers (int, optional): The number of tiles fetched at the same time.
+            origin (dict, optional): The coordinate of a cell of every tiled axis whose cells aren't on the low bound
+                of the subset plus multiples of the resolution, e.g. {'Lat': 0.25} for cell centres.
+
+        Returns:
+            numpy.ndarray: The stitched result.
+
+        Example:
+            >>> datacube.subset(var_name = '$c', subset = 'Lat(30:60), Long(0:40), ansi("2000-01":"2014-12")')
+            >>> cube = datacube.execute_tiled('$c', tiles = {'ansi': 24, 'Lat': 10}, axes = {'ansi': 0, 'Lat': 1},
+            ...                               resolution = {'Lat': -0.5}, origin = {'Lat': 0.25})
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        if self.aggregation != None:
+            raise ValueError("Aggregated queries can't be tiled")
+        if self.format in ('PNG', 'JPEG', 'GTiff', 'netCDF'):
+            raise ValueError("Only CSV results can be tiled")
+        axes = axes if axes != None else {name: i for i, name in enumerate(tiles)}
+        grid_shape, jobs = self.tile_queries(var_name, tiles, resolution, origin)
+        jobs = {index: tile.as_array(self.array_dtype or 'float64') for index, tile in jobs.items()}
+        self.reset() # returning the values of the dco instance to default
+
+        def fetch(tile):
+            return tile.DBC.run_query(tile.to_wcps_query(), tile.decode_response, tile.result_kind())
+
+        with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'wdc-tile') as executor:
+            futures = {index: executor.submit(fetch, tile) for index, tile in jobs.items()}
+            results = {index: future.result() for index, future in futures.items()}
+        return stitch_tiles(results, grid_shape, [axes[name] for name in tiles])
+
+    # the query of the partial aggregates, which the aggregation of this query can be computed from
+    def partial_query(self):
         """
-        Executes the constructed WCPS query and processes the response based on the specified format.
+        Constructs the WCPS query of the partial aggregates which the aggregation is computed from. The average
+            is computed from the sum and the number of values, never from other averages. Several partial
+            aggregates are returned together in one composite value, so the server scans the data once.
+
+        Returns:
+            tuple: The names of the partial aggregates ('min', 'max', 'sum', 'count' or 'cells'), and the WCPS query.
+
+        Example:
+            >>> datacube.stats(['MAX', 'AVG']).partial_query()
+            (('max', 'sum', 'cells'),
+             'for $c in (AvgLandTemp)\nreturn \n{max: max($c); sum: sum($c); cells: count(($c) = ($c))}')
+        """
+        if self.aggregation == None:
+            raise ValueError("No aggregation function was used")
+        aggregations = self.aggregation if isinstance(self.aggregation, tuple) else (self.aggregation,)
+        names = tuple(dict.fromkeys(name for aggregation in aggregations for name in _PARTIALS[aggregation]))
+        helper_query = self.replace_variables_with_subsets(self.aggregation_condition)
+        expressions = {name: _PARTIAL_EXPRESSIONS[name].format(helper_query) for name in names}
+        if len(names) == 1:
+            return names, self.query_head() + expressions[names[0]]
+        return names, self.query_head() + composite_expression(expressions)
+
+    # executing an aggregation as partial aggregates of tiles, which are combined on the client
+    def execute_partitioned(self, var_name, tiles, resolution = None, max_workers = 4, origin = None):
+        """
+        Executes the aggregation of the constructed WCPS query by splitting the subset of a variable into
+            tiles, sending the partial aggregates of the tiles in parallel and combining them on the client.
+            The result is exact: min and max are the min and max of the tiles, sum and count are added, and
+            the average is the total sum divided by the total number of values. All the partial aggregates of a
+            tile are sent in one query, and a failed tile is sent again on its own, by the retries of the connection.
+
+        Parameters:
+            var_name (str): The variable whose subset is split, e.g. '$c'.
+            tiles (dict): The tile size of every tiled axis, see execute_tiled().
+            resolution (dict, optional): The grid step of every tiled axis with non-integer coordinates.
+            max_workers (int, optional): The number of queries sent at the same time.
+            origin (dict, optional): The coordinate of a cell of every tiled axis, see execute_tiled().
+
+        Returns:
+            Varies: The aggregate, decoded like the result of execute(), or a dict of the aggregates after stats().
+
+        Example:
+            >>> datacube.subset(var_name = '$c', subset = 'Lat(-60:80), Long(-180:180), ansi("2000-01":"2014-12")')
+            >>> datacube.avg().execute_partitioned('$c', tiles = {'Lat': 20, 'ansi': 60})
+        """
+        if isinstance(self.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        if self.aggregation == None:
+            raise ValueError("No aggregation function was used")
+        aggregation = self.aggregation
+        _, tile_jobs = self.tile_queries(var_name, tiles, resolution, origin)
+        jobs = [tile.partial_query() for tile in tile_jobs.values()]
+        # the aggregate is decoded like execute() would, with the settings from before the reset
+        connection, decode = self.DBC, self.freeze().decode_response
+        self.reset() # returning the values of the dco instance to default
+
+        def fetch(job):
+            names, wcps_query = job
+            return connection.run_query(wcps_query, lambda content: byte_to_record(content, names), 'partial')
+
+        partials = {}
+        with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'wdc-partial') as executor:
+            for record in executor.map(fetch, jobs):
+                for name, value in record.items():
+                    partials.setdefault(name, []).append(value)
+        combined = {name: _PARTIAL_COMBINE[name](values) for name, values in partials.items()}
+        if isinstance(aggregation, tuple):
+            return {name.lower(): finish_aggregate(name, combined) for name in aggregation}
+        return decode(repr(finish_aggregate(aggregation, combined)).encode())
+
+    # executing without blocking the event loop, the query is built by the same to_wcps_query() as in execute()
+    async def execute_async(self):
+        """
+        Executes the constructed WCPS query asynchronously and processes the response based on the specified format.
+            With a plain dbc the blocking request is run by a worker thread of the dbc, see dbc.run_query_async().
 
         Returns:
             Varies: The processed data as per the requested format 
                 (CSV as list, PNG/JPEG as image object, or list of numbers).
 
         Example:
-            >>> output = datacube.execute()
+            >>> output = await datacube.execute_async()
         """
         wcps_query = self.to_wcps_query() # get a WCPS query
-        response = self.DBC.send_query(wcps_query) # pass the WCPS query to the server and get a response
-        if self.format == 'CSV': # if the format is CSV, convert binary string to the list of numbers
-            data = byte_to_list(response.content) 
-            self.reset() # returning the values of the dco instance to default
-            return data
-        elif self.format == 'PNG': # if the format is PNG, return the image
-            self.reset() # returning the values of the dco instance to default
-            return response.content
-        elif self.format == 'JPEG': # if the format is JPEG, return the image
-            self.reset() # returning the values of the dco instance to default
-            return response.content
+        if isinstance(self.DBC, AsyncDbc):
+            data = await self.DBC.run_query(wcps_query, self.decode_response, self.result_kind())
+        else:
+            data = await self.DBC.run_query_async(wcps_query, self.decode_response, self.result_kind())
+        self.reset() # returning the values of the dco instance to default
+        return data
+
+
+# placeholders of a prepared query, e.g. '@lat' or '@t0'
+_PLACEHOLDER = re.compile(r'@([A-Za-z_][A-Za-z0-9_]*)')
+
+
+# compiled WCPS query with named placeholders
+class PreparedQuery:
+    def __init__(self, datacube):
+        """
+        Initializes a template from a dco. The WCPS query of the dco is built once and split at its placeholders.
+
+        Parameters:
+            datacube (dco): The query to compile. It's copied, so changing it afterwards doesn't change the template.
+
+        Example:
+            >>> template = PreparedQuery(datacube)
+            >>> template.parameters
+            frozenset({'lat', 'long', 't0', 't1'})
+        """
+        if not isinstance(datacube, dco):
+            raise TypeError("dco instance not passed")
+        self.query = datacube.freeze()
+        text = self.query.to_wcps_query()
+        names = _PLACEHOLDER.findall(text)
+        self.parameters = frozenset(names)
+        # the literal parts are escaped for str.format(), which joins them with the values in one call
+        literals = _PLACEHOLDER.split(text)[0::2]
+        escaped = [literal.replace('{', '{{').replace('}', '}}') for literal in literals]
+        self._template = escaped[0] + ''.join('{' + name + '}' + literal for name, literal in zip(names, escaped[1:]))
+        self._decode = self.query.decode_response
+        self._kind = self.query.result_kind()
+
+    def bind(self, **values):
+        """
+        Fills the placeholders of the template in.
+
+        Parameters:
+            **values: The value of every placeholder, by its name. Strings are inserted as they are,
+                so quotes around dates must be part of the template.
+
+        Returns:
+            str: The WCPS query.
+
+        Raises:
+            TypeError: If a placeholder has no value, or a value has no placeholder.
+
+        Example:
+            >>> template.bind(lat = 53.08, long = 8.80, t0 = '2014-01', t1 = '2014-12')
+        """
+        if values.keys() != self.parameters:
+            missing = sorted(self.parameters - values.keys())
+            unknown = sorted(values.keys() - self.parameters)
+            raise TypeError(f"Missing values: {missing}, unknown placeholders: {unknown}")
+        return self._template.format_map(values)
+
+    def execute(self, **values):
+        """
+        Fills the placeholders in, executes the query and processes the response like dco.execute() does.
+
+        Parameters:
+            **values: The value of every placeholder, by its name.
+
+        Returns:
+            Varies: The processed data as per the requested format.
+
+        Example:
+            >>> template.execute(lat = 53.08, long = 8.80, t0 = '2014-01', t1 = '2014-12')
+        """
+        if isinstance(self.query.DBC, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        return self.query.DBC.run_query(self.bind(**values), self._decode, self._kind)
+
+    async def execute_async(self, **values):
+        """
+        Fills the placeholders in and executes the query like dco.execute_async() does.
+
+        Parameters:
+            **values: The value of every placeholder, by its name.
+
+        Returns:
+            Varies: The processed data as per the requested format.
+
+        Example:
+            >>> await template.execute_async(lat = 53.08, long = 8.80, t0 = '2014-01', t1 = '2014-12')
+        """
+        wcps_query = self.bind(**values)
+        if isinstance(self.query.DBC, AsyncDbc):
+            return await self.query.DBC.run_query(wcps_query, self._decode, self._kind)
+        return await self.query.DBC.run_query_async(wcps_query, self._decode, self._kind)
+
+
+# immutable datacube object, every builder method returns a new FrozenDco and leaves the original unchanged
+class FrozenDco(dco):
+    # the lists of dco are kept as tuples, so derived queries share them with their template
+    _sequences = ('vars', 'Subsets', 'var_names')
+
+    def __init__(self, dbc_being_used):
+        """
+        Initializes an immutable dco instance. Builder methods like subset(), where() or avg() return a new
+            FrozenDco, which shares the unchanged parts with the original one, and execute() doesn't reset it.
+            Because it never changes, one FrozenDco can be used as a template by many threads without locks.
+
+        Parameters:
+            dbc_being_used (dbc or AsyncDbc): An instance of dbc used for server communication.
+
+        Example:
+            >>> base = FrozenDco(database_connection).initialize_var("$c in (AvgLandTemp)")
+            >>> yearly = base.subset(var_name = '$c', subset = 'Lat(53.08), Long(8.80), ansi("2014-01":"2014-12")')
+            >>> monthly = [base.subset(var_name = '$c', subset = f'ansi("2014-{m:02}")') for m in range(1, 13)]
+        """
+        super().__init__(dbc_being_used)
+        for name in self._sequences:
+            self.__dict__[name] = tuple(self.__dict__[name])
+        self.__dict__['_frozen'] = True
+
+    @classmethod
+    def _from_state(cls, state):
+        frozen = object.__new__(cls)
+        frozen.__dict__.update(state)
+        for name in cls._sequences:
+            frozen.__dict__[name] = tuple(state[name])
+        frozen.__dict__['_frozen'] = True
+        return frozen
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen', False):
+            raise AttributeError("FrozenDco can't be modified, its methods return a new instance")
+        super().__setattr__(name, value)
+
+    # applying a dco builder method to a thawed copy and freezing the result
+    def _derive(self, method, *args, copy_sequences = False, **kwargs):
+        derived = object.__new__(type(self))
+        derived.__dict__.update(self.__dict__)
+        derived.__dict__['_frozen'] = False
+        # only the methods which change the variables need their own lists, the others share the tuples
+        if copy_sequences:
+            for name in self._sequences:
+                derived.__dict__[name] = list(self.__dict__[name])
+        method(derived, *args, **kwargs)
+        for name in self._sequences:
+            derived.__dict__[name] = tuple(derived.__dict__[name])
+        derived.__dict__['_frozen'] = True
+        return derived
+
+    def thaw(self):
+        """
+        Creates a mutable dco with the same variables, subsets and operations.
+
+        Returns:
+            dco: A mutable copy of the instance.
+
+        Example:
+            >>> datacube = template.thaw()
+        """
+        thawed = object.__new__(dco)
+        thawed.__dict__.update({name: value for name, value in self.__dict__.items() if name != '_frozen'})
+        for name in self._sequences:
+            thawed.__dict__[name] = list(self.__dict__[name])
+        return thawed
+
+    def freeze(self):
+        return self
+
+    def reset(self):
+        return type(self)(self.DBC)
+
+    def initialize_var(self, s):
+        return self._derive(dco.initialize_var, s, copy_sequences = True)
+
+    def subset(self, subset, var_name):
+        return self._derive(dco.subset, subset, var_name, copy_sequences = True)
+
+    def where(self, filter_condition):
+        return self._derive(dco.where, filter_condition)
+
+    def set_format(self, output_format):
+        return self._derive(dco.set_format, output_format)
+
+    def as_array(self, dtype = 'float64'):
+        return self._derive(dco.as_array, dtype)
+
+    def min(self, condition = None):
+        return self._derive(dco.min, condition)
+
+    def max(self, condition = None):
+        return self._derive(dco.max, condition)
+
+    def avg(self, condition = None):
+        return self._derive(dco.avg, condition)
+
+    def sum(self, condition = None):
+        return self._derive(dco.sum, condition)
+
+    def count(self, condition = None):
+        return self._derive(dco.count, condition)
+
+    def stats(self, aggregations, condition = None):
+        return self._derive(dco.stats, aggregations, condition)
+
+    def transform_data(self, operation):
+        return self._derive(dco.transform_data, operation)
+
+    def encode(self, operation):
+        return self._derive(dco.encode, operation)
+
+
+# lazy array over a coverage, slicing and reductions only change the query until the data is computed
+class LazyCoverage:
+    def __init__(self, datacube, var_name, domain, chunks = None, dtype = 'float64', max_workers = 4):
+        """
+        Initializes a lazy array over the domain of a coverage variable. Nothing is fetched when it's created,
+            sliced or reduced: slicing narrows the subset of the variable, the reductions are computed by the
+            server, and only compute() downloads the values, in parallel chunks if chunks are given.
+            The axes of the domain must be given in the order of the axes of the coverage, and the coordinates
+            of every axis in the order the server stores its cells, so an index counts the cells like the server.
+
+        Parameters:
+            datacube (dco): A query with the variable initialized, e.g. with '$c in (AvgLandTemp)'.
+            var_name (str): The variable of the coverage, e.g. '$c'.
+            domain (dict): The (first, last) or (first, last, step) coordinates of every axis, by their names.
+                Dates like "2014", "2014-01" or "2014-01-31" step by one year, month or day, numeric axes by
+                step, 1 or -1 by default. An axis stored in descending order, like Lat in most EPSG:4326
+                coverages, starts at its highest coordinate and has a negative step.
+            chunks (dict, optional): The number of cells of every chunked axis fetched by one query.
+            dtype (str, optional): The type of the computed array, 'float64' or 'float32'.
+            max_workers (int, optional): The number of chunks fetched at the same time.
+
+        Example:
+            >>> cube = LazyCoverage(dco(database_connection).initialize_var('$c in (AvgLandTemp)'), '$c',
+            ...                     {'ansi': ('2000-01', '2015-12'), 'Lat': (89.5, -89.5), 'Long': (-179.5, 179.5)},
+            ...                     chunks = {'ansi': 24})
+            >>> cube[:12, 70:80, 200:210].mean()
+            14.2
+            >>> bremen = cube[:, 36, 188].compute()
+        """
+        if not isinstance(datacube, dco):
+            raise TypeError("datacube must be a dco instance.")
+        if not (var_name in datacube.var_names):
+            raise ValueError("Such variable doesn't exist")
+        if not isinstance(domain, dict) or not domain:
+            raise ValueError("domain must be a non-empty dict of the axes.")
+        if not (dtype in ['float64', 'float32']):
+            raise ValueError("Entered dtype isn't supported")
+        self.datacube = datacube.freeze() if not isinstance(datacube, FrozenDco) else datacube
+        self.var_name = var_name
+        self.chunks = dict(chunks or {})
+        self.dtype = dtype
+        self.max_workers = max_workers
+        # every axis is kept with the coordinate of its first cell, its signed step and the range of its cells
+        # which is selected
+        self._axes = [self._axis(name, bounds) for name, bounds in domain.items()]
+        for name in self.chunks:
+            if not (name in domain):
+                raise ValueError(f"The domain has no axis {name}")
+
+    @staticmethod
+    def _axis(name, bounds):
+        if not isinstance(bounds, (tuple, list)) or len(bounds) not in (2, 3):
+            raise ValueError(f"The domain of {name} must be (first, last) or (first, last, step).")
+        first, last = bounds[0], bounds[1]
+        if isinstance(first, str):
+            precision, origin = _date_to_ordinal(first.strip('"'))
+            last_precision, end = _date_to_ordinal(str(last).strip('"'))
+            if precision == None or precision != last_precision:
+                raise ValueError(f"The dates of {name} must be like 2014, 2014-01 or 2014-01-31 of the same precision")
+            step = bounds[2] if len(bounds) == 3 else 1
+            if step != 1:
+                raise ValueError(f"The dates of {name} step by one {precision}.")
+            size = end - origin + 1
+        else:
+            precision, origin = None, float(first)
+            step = bounds[2] if len(bounds) == 3 else 1 if float(last) >= origin else -1
+            if step == 0 or (float(last) - origin) * step < 0:
+                raise ValueError(f"The step of {name} must lead from its first to its last coordinate.")
+            size = int(round((float(last) - origin) / step)) + 1
+        if size < 1:
+            raise ValueError(f"The domain of {name} ends before it starts.")
+        return {'name': name, 'precision': precision, 'origin': origin, 'step': step,
+                'start': 0, 'stop': size, 'point': False}
+
+    # the coordinate of a cell of an axis, as it's written in a subset
+    @staticmethod
+    def _coordinate(axis, index):
+        if axis['precision'] != None:
+            return f'"{_ordinal_to_date(axis["precision"], axis["origin"] + index)}"'
+        return _format_number(round(axis['origin'] + index * axis['step'], 10))
+
+    # the interval of the selected cells of an axis, from the low coordinate even if the axis is descending
+    @staticmethod
+    def _interval(axis):
+        ends = sorted((axis['start'], axis['stop'] - 1), key = lambda index: index * axis['step'])
+        return ':'.join(LazyCoverage._coordinate(axis, index) for index in ends)
+
+    @property
+    def shape(self):
+        return tuple(axis['stop'] - axis['start'] for axis in self._axes if not axis['point'])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return math.prod(self.shape)
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError("len() of a 0-d coverage")
+        return self.shape[0]
+
+    @property
+    def subset(self):
+        return ', '.join(self._parts())
+
+    # the subset of every axis, the iterated ones are indexed by the grid coordinate of their iterator
+    def _parts(self, iterated = ()):
+        parts = []
+        for position, axis in enumerate(self._axes):
+            if position in iterated:
+                parts.append(f'{axis["name"]}:"CRS:1"($p{position})')
+            elif axis['point']:
+                parts.append(f"{axis['name']}({self._coordinate(axis, axis['start'])})")
+            else:
+                parts.append(f"{axis['name']}({self._interval(axis)})")
+        return parts
+
+    def __repr__(self):
+        return f'LazyCoverage({self.var_name}, shape={self.shape}, subset={self.subset!r})'
+
+    def __getitem__(self, key):
+        """
+        Selects a part of the coverage like a numpy array does, with integers, contiguous slices and an Ellipsis.
+            An integer takes one coordinate of the axis and removes the axis, as a slice in the subset.
+
+        Returns:
+            LazyCoverage: The selected part, still without any data.
+
+        Example:
+            >>> cube[-12:, 36, 188].subset
+            'ansi("2015-01":"2015-12"), Lat(53.5), Long(8.5)'
+        """
+        key = key if isinstance(key, tuple) else (key,)
+        free = [axis for axis in self._axes if not axis['point']]
+        if key.count(Ellipsis) > 1:
+            raise IndexError("An index can only have a single ellipsis ('...')")
+        if Ellipsis in key:
+            position = key.index(Ellipsis)
+            key = key[:position] + (slice(None),) * (len(free) - len(key) + 1) + key[position + 1:]
+        if len(key) > len(free):
+            raise IndexError(f"Too many indices for a coverage with {len(free)} axes")
+        axes = [dict(axis) for axis in self._axes]
+        free = [axis for axis in axes if not axis['point']]
+        for axis, index in zip(free, key):
+            length = axis['stop'] - axis['start']
+            if isinstance(index, slice):
+                start, stop, step = index.indices(length)
+                if step != 1:
+                    raise IndexError("Only contiguous slices can be selected from a coverage")
+                if stop <= start:
+                    raise IndexError(f"The slice selects no cells of {axis['name']}")
+                axis['start'], axis['stop'] = axis['start'] + start, axis['start'] + stop
+            elif isinstance(index, int) and not isinstance(index, bool):
+                if not -length <= index < length:
+                    raise IndexError(f"Index {index} is out of bounds for {axis['name']} with size {length}")
+                axis['start'] = axis['start'] + index % length
+                axis['stop'] = axis['start'] + 1
+                axis['point'] = True
+            else:
+                raise IndexError("Only integers, slices and an ellipsis can index a coverage")
+        selected = object.__new__(LazyCoverage)
+        selected.__dict__.update(self.__dict__)
+        selected._axes = axes
+        return selected
+
+    def to_dco(self):
+        """
+        Returns the query of the selected part of the coverage, a FrozenDco which can be extended further.
+
+        Example:
+            >>> cube[:12].to_dco().where('$c > 0').avg().execute()
+        """
+        return self.datacube.subset(var_name = self.var_name, subset = self.subset)
+
+    # the tiles of the chunked axes which are still selected, in the units execute_tiled() counts them in,
+    # with the signed step and the first cell of the numeric axes, so descending axes are tiled in their order
+    def _tiles(self, chunks):
+        tiles, resolution, origin, positions = {}, {}, {}, {}
+        position = 0
+        for axis in self._axes:
+            if axis['point']:
+                continue
+            if axis['name'] in chunks:
+                if axis['precision'] != None:
+                    tiles[axis['name']] = int(chunks[axis['name']])
+                else:
+                    tiles[axis['name']] = chunks[axis['name']] * abs(axis['step'])
+                    resolution[axis['name']] = axis['step']
+                    origin[axis['name']] = axis['origin']
+                positions[axis['name']] = position
+            position += 1
+        return tiles, resolution, origin, positions
+
+    def compute(self, chunks = None, max_workers = None):
+        """
+        Fetches the values of the selected part of the coverage. With chunks, the part is split into tiles
+            which are fetched in parallel and stitched together, see dco.execute_tiled().
+
+        Parameters:
+            chunks (dict, optional): The number of cells of every chunked axis, the chunks of the coverage by default.
+            max_workers (int, optional): The number of chunks fetched at the same time.
+
+        Returns:
+            numpy.ndarray: The values, with the shape of the coverage.
+
+        Raises:
+            ValueError: If the server returned a different number of values than the domain has cells.
+
+        Example:
+            >>> cube[:12, 100:110, 200:210].compute().shape
+            (12, 10, 10)
+        """
+        query = self.to_dco().set_format('CSV').as_array(self.dtype)
+        tiles, resolution, origin, positions = self._tiles(chunks if chunks != None else self.chunks)
+        if tiles:
+            data = query.execute_tiled(self.var_name, tiles, axes = positions, resolution = resolution,
+                                       max_workers = max_workers or self.max_workers, origin = origin)
         else:
-            self.reset()
-            data = byte_to_list(response.content) 
-            return data
+            data = query.execute()
+        if data.size != self.size:
+            raise ValueError(f"The server returned {data.size} values for {self.size} cells, "
+                             "check the domain of the coverage")
+        return data.reshape(self.shape)
+
+    # an aggregation of the selected part, computed by the server in parallel partial aggregates if it's chunked
+    def _aggregate(self, method, *arguments):
+        query = getattr(self.to_dco(), method)(*arguments)
+        tiles, resolution, origin, _ = self._tiles(self.chunks)
+        if tiles:
+            return query.execute_partitioned(self.var_name, tiles, resolution = resolution,
+                                             max_workers = self.max_workers, origin = origin)
+        return query.execute()
+
+    # the WCPS condensers of the aggregations, a count adds up a 1 for every cell
+    _condensers = {'min': 'min', 'max': 'max', 'sum': '+', 'count': '+'}
+
+    # the iterators over the selected cells of the axes at the positions, in the grid coordinates of the coverage
+    def _over(self, positions):
+        selected = f'{self.var_name}[{self.subset}]'
+        return ', '.join(f'$p{position} {self._axes[position]["name"]}'
+                         f'(imageCrsDomain({selected}, {self._axes[position]["name"]}))' for position in positions)
+
+    # the expression of an aggregate over the axes reduced, for every cell of the axes kept
+    def _expression(self, method, reduced, kept, condition):
+        if condition == None:
+            # the cells of the reduced axes are aggregated by the server's own function
+            return f'{method}({self.var_name}[{", ".join(self._parts(kept))}])'
+        if method == 'avg':
+            return (f'({self._expression("sum", reduced, kept, condition)}) / '
+                    f'({self._expression("count", reduced, kept, condition)})')
+        cell = f'{self.var_name}[{", ".join(self._parts(reduced + kept))}]'
+        # the condition is evaluated at every cell, e.g. '$c > 20' becomes '$c[Lat:"CRS:1"($p1), ...] > 20'
+        where = _VAR_TOKEN.sub(lambda match: cell if match.group(0) == self.var_name else match.group(0), condition)
+        value = '1' if method == 'count' else cell
+        return f'condense {self._condensers[method]} over {self._over(reduced)} where {where} using {value}'
+
+    # the positions of the reduced and of the kept axes among all the axes, from numpy-like axis numbers
+    def _reduced_axes(self, axis):
+        free = [position for position, selected in enumerate(self._axes) if not selected['point']]
+        numbers = range(len(free)) if axis == None else axis if isinstance(axis, (tuple, list)) else (axis,)
+        reduced = set()
+        for number in numbers:
+            if not isinstance(number, int) or isinstance(number, bool) or not -len(free) <= number < len(free):
+                raise ValueError(f"axis {number} is out of bounds for a coverage with {len(free)} axes")
+            reduced.add(free[number])
+        kept = [position for position in free if not (position in reduced)]
+        return [position for position in free if position in reduced], kept
+
+    # sending a query built here, the aggregation queries of dco aren't expressive enough for it
+    def _run(self, expression, decode, kind):
+        connection = self.datacube.DBC
+        if isinstance(connection, AsyncDbc):
+            raise TypeError("AsyncDbc queries must be run with execute_async()")
+        return connection.run_query(self.datacube.query_head() + expression, decode, kind)
+
+    def _reduce(self, method, axis, condition):
+        if condition != None:
+            if not isinstance(condition, str):
+                raise TypeError("Value entered must be a string.")
+            self.datacube.do_vars_exist(condition)
+        reduced, kept = self._reduced_axes(axis)
+        if not kept and (condition == None or method == 'count'):
+            # the whole selection is aggregated, by parallel partial aggregates if it's chunked
+            result = self._aggregate(method, condition)
+            value = result[0] if isinstance(result, list) else result
+            return int(value) if method == 'count' else float(value)
+        expression = self._expression(method, reduced, kept, condition)
+        if not kept:
+            value = self._run(expression, byte_to_list, 'scalar')[0]
+            return int(value) if method == 'count' else float(value)
+        # the axes which are kept are those of a new coverage, whose every cell is an aggregate of the reduced axes
+        shape = tuple(self._axes[position]['stop'] - self._axes[position]['start'] for position in kept)
+        data = self._run(f'encode(coverage reduced over {self._over(kept)} values {expression}, "text/csv")',
+                         lambda content: byte_to_ndarray(content, self.dtype), f'CSV/{self.dtype}')
+        if data.size != math.prod(shape):
+            raise ValueError(f"The server returned {data.size} values for {math.prod(shape)} cells, "
+                             "check the domain of the coverage")
+        return data.reshape(shape)
+
+    def min(self, axis = None, condition = None):
+        """
+        Computes the minimum of the selected part on the server, only the result is downloaded. Without an axis
+            it's one number, otherwise an array of the axes which are kept, built as a WCPS coverage.
+
+        Parameters:
+            axis (int or tuple, optional): The axes reduced, like in numpy. All of them by default.
+            condition (str, optional): A WCPS condition of the variable, only the cells which meet it are aggregated.
+
+        Returns:
+            float or numpy.ndarray: The minimum.
+
+        Example:
+            >>> cube[:, 100:110, 200:210].min()
+            -3.2
+            >>> cube[:12].min(axis = 0, condition = '$c > -50').shape
+            (180, 360)
+        """
+        return self._reduce('min', axis, condition)
+
+    def max(self, axis = None, condition = None):
+        """
+        Computes the maximum of the selected part on the server, see min().
+
+        Example:
+            >>> cube[:12].max(axis = (1, 2))
+        """
+        return self._reduce('max', axis, condition)
+
+    def sum(self, axis = None, condition = None):
+        """
+        Computes the sum of the selected part on the server, see min().
+
+        Example:
+            >>> cube[:12, 36, 188].sum(condition = '$c > 0')
+        """
+        return self._reduce('sum', axis, condition)
+
+    def mean(self, axis = None, condition = None):
+        """
+        Computes the average of the selected part on the server, see min(). With a condition it's the sum of
+            the cells which meet it divided by their number.
+
+        Example:
+            >>> monthly_means = cube[:, 100:110, 200:210].mean(axis = (1, 2))
+        """
+        return self._reduce('avg', axis, condition)
+
+    def count(self, condition = None):
+        """
+        Counts the cells of the selected part which meet a WCPS condition, on the server.
+
+        Example:
+            >>> cube[:12].count('$c > 20')
+            4211
+        """
+        return self._reduce('count', None, condition)
+
+    def stats(self, aggregations, condition = None):
+        """
+        Computes several aggregates of the selected part in one pass of the server, see dco.stats().
+            With a condition only the cells which meet it are aggregated.
+
+        Returns:
+            dict: The aggregates by their lower-case names.
+
+        Example:
+            >>> cube[:12].stats(['MIN', 'MAX', 'AVG'])
+            {'min': -3.2, 'max': 31.9, 'avg': 14.2}
+        """
+        if condition == None:
+            return self._aggregate('stats', aggregations, condition)
+        # checking the aggregations like dco does
+        self.datacube.stats(aggregations, condition)
+        reduced, _ = self._reduced_axes(None)
+        names = [name.lower() for name in aggregations]
+        expressions = {name: self._expression(name, reduced, [], condition) for name in names}
+        return self._run(composite_expression(expressions), lambda content: byte_to_record(content, names), 'record')